@@ -0,0 +1,287 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app import metering
+import asyncio
+import json
+import math
+import threading
+import time
+
+# Degradation tiers, in the order they are reached as load grows
+NORMAL, SKIP_LLM, SKIP_SYNTHESIS, SHED = 0, 1, 2, 3
+
+_level: ContextVar[int] = ContextVar("admission_level", default=NORMAL)
+
+# How quickly a queue-wait spike is forgotten once requests stop reporting it
+WAIT_DECAY_SECONDS = 5.0
+
+class Degraded(Exception):
+    """Raised by an upstream call admission control is currently skipping"""
+
+def route_class(path: str) -> Optional[str]:
+    """Group a path into the class its load is tracked under; None for paths that are never limited"""
+    if path == "/api/health" or path.startswith("/uploads/"):
+        return None
+    if path.startswith("/api/ws/"):
+        # Admitted at connect time only; session_ws admits each generation step itself (see step())
+        return "session"
+    if path.startswith("/one-tap/"):
+        return "one_tap"
+    if path in ("/api/meditate/start", "/api/visualize/start", "/api/audio/generate"):
+        return "session"
+    if path.endswith(("/questions", "/goal-analysis", "/challenges")):
+        return "llm"
+    return "other"
+
+class LoadTracker:
+    """In-flight requests and a decaying average of threadpool queue wait, per route class"""
+
+    def __init__(self):
+        self.in_flight: Dict[str, int] = {}
+        self.wait_ms: Dict[str, float] = {}
+        self.wait_updated: Dict[str, float] = {}
+        self.shed: Dict[str, int] = {}
+        self.probe_started: Dict[str, float] = {}
+        self.lock = threading.Lock()
+
+    def enter(self, name: str) -> None:
+        with self.lock:
+            self.in_flight[name] = self.in_flight.get(name, 0) + 1
+
+    def exit(self, name: str) -> None:
+        with self.lock:
+            self.in_flight[name] -= 1
+
+    def record_wait(self, name: str, wait_ms: float) -> None:
+        with self.lock:
+            self.wait_ms[name] = 0.8 * self._current_wait(name) + 0.2 * wait_ms
+            self.wait_updated[name] = time.monotonic()
+
+    def record_shed(self, name: str) -> None:
+        with self.lock:
+            self.shed[name] = self.shed.get(name, 0) + 1
+
+    def start_probe(self, name: str) -> bool:
+        """Claim the class's queue-wait probe; False while one is already waiting for a thread"""
+        with self.lock:
+            if name in self.probe_started:
+                return False
+            self.probe_started[name] = time.monotonic()
+            return True
+
+    def end_probe(self, name: str, wait_ms: Optional[float]) -> None:
+        if wait_ms is not None:
+            self.record_wait(name, wait_ms)
+        with self.lock:
+            self.probe_started.pop(name, None)
+
+    def _current_wait(self, name: str) -> float:
+        now = time.monotonic()
+        age = now - self.wait_updated.get(name, 0.0)
+        # A probe still queued has waited at least this long, so a stalled pool shows up without waiting for it
+        pending = (now - self.probe_started[name]) * 1000 if name in self.probe_started else 0.0
+        return max(self.wait_ms.get(name, 0.0) * math.exp(-age / WAIT_DECAY_SECONDS), pending)
+
+    def level(self, name: str) -> int:
+        """Degradation tier for a new request of this class"""
+        thresholds = getattr(settings, "admission_wait_ms", [300, 1000, 3000])
+        limits = getattr(settings, "admission_in_flight", {})
+        with self.lock:
+            wait = self._current_wait(name)
+            in_flight = self.in_flight.get(name, 0)
+        level = sum(wait >= t for t in thresholds)
+        limit = limits.get(name, limits.get("other", 32))
+        if limit:
+            # At the limit skip the LLM, at 1.5x skip synthesis, at 2x shed
+            level = max(level, sum(in_flight >= limit * f for f in (1, 1.5, 2)))
+        return min(level, SHED)
+
+    def snapshot(self) -> Dict[str, dict]:
+        names = set(self.in_flight) | set(self.wait_ms)
+        return {
+            name: {
+                "inFlight": self.in_flight.get(name, 0),
+                "queueWaitMs": round(self._current_wait(name), 1),
+                "level": self.level(name),
+                "shed": self.shed.get(name, 0),
+            }
+            for name in sorted(names)
+        }
+
+tracker = LoadTracker()
+
+def budget_level() -> int:
+    """Tier forced by the current endpoint's usage budgets, so an endpoint over budget takes the cheap paths"""
+    exceeded = metering.exceeded()
+    if "tts_chars" in exceeded:
+        return SKIP_SYNTHESIS
+    if "openai_tokens" in exceeded:
+        return SKIP_LLM
+    return NORMAL
+
+def level() -> int:
+    return max(_level.get(), budget_level())
+
+def allow_llm() -> bool:
+    return level() < SKIP_LLM
+
+def allow_synthesis() -> bool:
+    return level() < SKIP_SYNTHESIS
+
+def overall_level() -> int:
+    """Highest tier across route classes, for background work that has no request of its own"""
+    return max((tracker.level(name) for name in list(tracker.in_flight)), default=NORMAL)
+
+def _noop() -> None:
+    pass
+
+async def _probe_wait(name: str) -> None:
+    started = time.monotonic()
+    wait_ms = None
+    try:
+        await run_in_threadpool(_noop)
+        wait_ms = (time.monotonic() - started) * 1000
+    finally:
+        tracker.end_probe(name, wait_ms)
+
+def probe(name: str) -> None:
+    """Time how long a no-op waits for a threadpool thread, at most one at a time per class.
+
+    Sampled this way rather than in each request, so requests that never
+    need a thread (health checks, async routes) don't queue for one.
+    """
+    if tracker.start_probe(name):
+        try:
+            asyncio.get_running_loop().create_task(_probe_wait(name))
+        except RuntimeError:
+            tracker.end_probe(name, None)
+
+@contextmanager
+def step(name: str, exempt: bool = False):
+    """Admit one piece of work on a long-lived connection as a request of class `name`.
+
+    The WebSocket session is admitted once when it connects, so each
+    question, generation or one-tap stream on it is checked here at the
+    current level. Raises HTTPException(503) when the class is shedding,
+    unless `exempt` (work served from disk), which is only kept off synthesis.
+    """
+    probe(name)
+    current = tracker.level(name)
+    if current >= SHED:
+        if not exempt:
+            tracker.record_shed(name)
+            raise HTTPException(status_code=503, detail="Server is busy, please retry shortly",
+                                headers={"Retry-After": "5"})
+        current = SKIP_SYNTHESIS
+    token = _level.set(current)
+    tracker.enter(name)
+    try:
+        yield current
+    finally:
+        tracker.exit(name)
+        _level.reset(token)
+
+def _one_tap_cache_hit(path: str, query: str, body: bytes) -> bool:
+    from urllib.parse import parse_qs
+    from app import one_tap_audio
+    import os
+
+    try:
+        req = json.loads(body or b"{}")
+        session_type = req["sessionType"]
+        voice_id = req.get("voiceId", "21m00Tcm4TlvDq8ikWAM")
+        if path == "/one-tap/start":
+            filename = one_tap_audio.full_filename(session_type, voice_id)
+        elif path == "/one-tap/step-audio":
+            step_index = int(parse_qs(query)["stepIndex"][0])
+            filename = one_tap_audio.step_filename(session_type, step_index, voice_id)
+        else:
+            return False
+        return os.path.exists(one_tap_audio.asset_path(filename))
+    except Exception:
+        return False
+
+class AdmissionMiddleware:
+    """Track load per route class and degrade in tiers instead of letting the threadpool back up.
+
+    Past the configured thresholds requests first skip OpenAI (cached or
+    fallback scripts), then skip synthesis (cached or fallback audio), and
+    only then get a 503. Health checks, static files and one-tap requests
+    whose audio is already on disk always get through. WebSocket sessions
+    are only turned away at connect time here; see step(). Queue wait is
+    sampled with probe().
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        name = route_class(scope.get("path", "")) if scope["type"] in ("http", "websocket") else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+
+        probe(name)
+        current = tracker.level(name)
+        if scope["type"] == "websocket":
+            if current >= SHED:
+                tracker.record_shed(name)
+                # 1013: try again later
+                await send({"type": "websocket.close", "code": 1013})
+                return
+            await self.app(scope, receive, send)
+            return
+        if current >= SHED:
+            if name == "one_tap":
+                body, receive = await _buffer_body(receive)
+                exempt = _one_tap_cache_hit(scope["path"], scope.get("query_string", b"").decode(), body)
+            else:
+                exempt = False
+            if not exempt:
+                tracker.record_shed(name)
+                await _send_busy(send)
+                return
+            current = SKIP_SYNTHESIS
+        if current:
+            print(f"Admission control: {scope['path']} at degradation level {current}")
+
+        level_token = _level.set(current)
+        tracker.enter(name)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            tracker.exit(name)
+            _level.reset(level_token)
+
+async def _buffer_body(receive):
+    """Read the whole (small JSON) body and return it with a receive callable that replays it"""
+    chunks = []
+    while True:
+        message = await receive()
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            break
+    body = b"".join(chunks)
+    sent = False
+
+    async def replay():
+        nonlocal sent
+        if not sent:
+            sent = True
+            return {"type": "http.request", "body": body, "more_body": False}
+        return await receive()
+    return body, replay
+
+async def _send_busy(send) -> None:
+    body = json.dumps({"detail": "Server is busy, please retry shortly"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 503,
+        "headers": [(b"content-type", b"application/json"), (b"retry-after", b"5"),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
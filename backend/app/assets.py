@@ -0,0 +1,131 @@
+from itertools import islice
+from typing import Dict, Iterator, List, Optional
+from app.config import settings
+from app.state import get_state
+from app import tts
+import os
+import re
+import shutil
+import time
+
+# One-tap clips and tracks: <sessionType>_<stepIndex|full>_<voice>[__<fallback provider>].mp3 and their timing index
+_ONE_TAP = re.compile(
+    r"^(?P<sessionType>[a-z-]+)_(?P<step>\d+|full|timing)_(?P<voiceId>.+?)(?:__(?P<provider>[a-z]+))?\.(mp3|json)$")
+# Subdirectories of the upload dir, reported as one entry each
+ASSET_DIRS = ("beds", "hls", "library")
+
+def upload_dir() -> str:
+    return getattr(settings, "upload_dir", "uploads")
+
+def record(filename: str, **meta) -> None:
+    """Remember what produced an audio file (voice, session type, TTS provider and model) for filtered purges"""
+    meta = {**(tts.last_synthesis() or {}), **{k: v for k, v in meta.items() if v is not None}}
+    meta["createdAt"] = time.time()
+    get_state().set_json(f"asset:{filename}", meta)
+
+def describe(entry: os.DirEntry) -> dict:
+    stat = entry.stat()
+    meta = get_state().get_json(f"asset:{entry.name}") or {}
+    match = _ONE_TAP.match(entry.name)
+    if match:
+        meta.setdefault("sessionType", match["sessionType"])
+        meta.setdefault("voiceId", match["voiceId"])
+        if match["provider"]:
+            meta.setdefault("provider", match["provider"])
+        kind = "one_tap_timing" if match["step"] == "timing" else "one_tap_full" if match["step"] == "full" else "one_tap_step"
+        if match["step"].isdigit():
+            meta["stepIndex"] = int(match["step"])
+    elif entry.name.startswith("mix_"):
+        kind = "mix"
+    elif entry.name.startswith("fallback_") or entry.name.endswith(".jsonl"):
+        kind = "other"
+    else:
+        kind = "session"
+    return {
+        "filename": entry.name,
+        "kind": kind,
+        "bytes": stat.st_size,
+        "modifiedAt": stat.st_mtime,
+        "pinned": is_pinned(entry.name),
+        **meta,
+    }
+
+def iter_assets() -> Iterator[dict]:
+    """Files at the top of the upload dir, read lazily so a page never stats the whole directory"""
+    with os.scandir(upload_dir()) as entries:
+        for entry in entries:
+            if entry.is_file() and not entry.name.startswith("."):
+                yield describe(entry)
+
+def matches(asset: dict, voice_id: Optional[str] = None, session_type: Optional[str] = None,
+            model: Optional[str] = None) -> bool:
+    if voice_id and asset.get("voiceId") not in (voice_id, voice_id.replace("/", "_")):
+        return False
+    if session_type and asset.get("sessionType") != session_type:
+        return False
+    if model and model not in (asset.get("model"), asset.get("provider")):
+        return False
+    return True
+
+def list_assets(offset: int = 0, limit: int = 100, **filters) -> List[dict]:
+    selected = (a for a in iter_assets() if matches(a, **filters))
+    return list(islice(selected, offset, offset + limit))
+
+def summary() -> Dict[str, dict]:
+    """File count and bytes per kind of asset"""
+    kinds: Dict[str, dict] = {}
+    for asset in iter_assets():
+        total = kinds.setdefault(asset["kind"], {"files": 0, "bytes": 0, "pinned": 0})
+        total["files"] += 1
+        total["bytes"] += asset["bytes"]
+        total["pinned"] += asset["pinned"]
+    for name in ASSET_DIRS:
+        path = os.path.join(upload_dir(), name)
+        files = sizes = 0
+        for root, _, names in os.walk(path):
+            for filename in names:
+                files += 1
+                sizes += os.path.getsize(os.path.join(root, filename))
+        if files:
+            kinds[name] = {"files": files, "bytes": sizes, "pinned": 0}
+    return kinds
+
+def is_pinned(filename: str) -> bool:
+    return get_state().get(f"pin:{filename}") is not None
+
+def pin(filename: str) -> None:
+    get_state().set(f"pin:{filename}", "1")
+
+def unpin(filename: str) -> None:
+    get_state().delete(f"pin:{filename}")
+
+def pinned() -> List[str]:
+    return sorted(key[len("pin:"):] for key in get_state().scan("pin:"))
+
+def exists(filename: str) -> bool:
+    return os.path.basename(filename) == filename and os.path.isfile(os.path.join(upload_dir(), filename))
+
+def purge(dry_run: bool = False, **filters) -> dict:
+    """Delete unpinned audio matching the filters; returns what was (or would be) removed.
+
+    The HLS segments of a removed progressive session go with it.
+    """
+    removed, skipped, freed = [], [], 0
+    for asset in list(iter_assets()):
+        if asset["kind"] == "other" or not matches(asset, **filters):
+            continue
+        if asset["pinned"]:
+            skipped.append(asset["filename"])
+            continue
+        removed.append(asset)
+        freed += asset["bytes"]
+        if dry_run:
+            continue
+        path = os.path.join(upload_dir(), asset["filename"])
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        shutil.rmtree(os.path.join(upload_dir(), "hls", asset["filename"].rsplit(".", 1)[0]), ignore_errors=True)
+        get_state().delete(f"asset:{asset['filename']}")
+    return {"removed": removed, "skippedPinned": skipped, "bytes": freed}
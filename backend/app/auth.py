@@ -0,0 +1,171 @@
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import datetime, timedelta
+from typing import Optional
+from fastapi import HTTPException, Request
+from app.config import settings
+import hmac
+import json
+import re
+import threading
+import time
+
+# Who the current request is for: "user:<sub>" from a verified token, else "anon:<client address>"
+_identity: ContextVar[str] = ContextVar("identity", default="anon:unknown")
+_authenticated: ContextVar[bool] = ContextVar("authenticated", default=False)
+_address: ContextVar[str] = ContextVar("client_address", default="anon:unknown")
+# Random id an app install sends in X-Client-Id, so anonymous users behind one NAT are told apart
+_CLIENT_ID = re.compile(r"^[A-Za-z0-9_-]{8,64}$")
+
+def require_admin(request: Request) -> None:
+    """FastAPI dependency for operator endpoints: the X-Admin-Token header must match ADMIN_TOKEN.
+
+    With no ADMIN_TOKEN configured the endpoints are disabled entirely.
+    """
+    expected = getattr(settings, "admin_token", "")
+    if not expected:
+        raise HTTPException(status_code=404, detail="Not Found")
+    supplied = request.headers.get("x-admin-token", "")
+    if not hmac.compare_digest(supplied.encode(), expected.encode()):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
+
+def create_access_token(user_id: str, expires_minutes: Optional[int] = None) -> str:
+    from jose import jwt
+
+    minutes = expires_minutes or settings.access_token_expire_minutes
+    claims = {"sub": user_id, "exp": datetime.utcnow() + timedelta(minutes=minutes)}
+    return jwt.encode(claims, settings.secret_key, algorithm=settings.algorithm)
+
+class TokenCache:
+    """LRU of tokens whose signature already verified, so repeat requests skip the HMAC check.
+
+    Entries are only trusted until the token's own exp claim.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.entries: "OrderedDict[str, dict]" = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, token: str) -> Optional[dict]:
+        with self.lock:
+            claims = self.entries.get(token)
+            if claims is None:
+                self.misses += 1
+                return None
+            if claims.get("exp") and claims["exp"] <= time.time():
+                del self.entries[token]
+                self.misses += 1
+                return None
+            self.entries.move_to_end(token)
+            self.hits += 1
+            return claims
+
+    def put(self, token: str, claims: dict) -> None:
+        with self.lock:
+            self.entries[token] = claims
+            self.entries.move_to_end(token)
+            while len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+
+_token_cache: Optional[TokenCache] = None
+
+def _cache() -> TokenCache:
+    global _token_cache
+    if _token_cache is None:
+        _token_cache = TokenCache(getattr(settings, "auth_token_cache_size", 10000))
+    return _token_cache
+
+def verify_token(token: str) -> dict:
+    """Claims of a valid access token; raises ValueError for a bad signature, expiry or missing subject"""
+    cache = _cache()
+    claims = cache.get(token)
+    if claims is not None:
+        return claims
+    from jose import JWTError, jwt
+
+    try:
+        claims = jwt.decode(token, settings.secret_key, algorithms=[settings.algorithm])
+    except JWTError as e:
+        raise ValueError(str(e))
+    if not claims.get("sub"):
+        raise ValueError("Token has no subject")
+    cache.put(token, claims)
+    return claims
+
+def current_identity() -> str:
+    return _identity.get()
+
+def is_authenticated() -> bool:
+    return _authenticated.get()
+
+def require_user(user_id: str, owner: Optional[str] = None) -> None:
+    """Only a request signed in as `user_id` may read or write that user's history.
+
+    `owner` is the identity that started the session being recorded, if
+    known; a session another signed-in user started is refused too.
+    """
+    if not is_authenticated():
+        raise HTTPException(status_code=401, detail="Sign in to use session history",
+                            headers={"WWW-Authenticate": "Bearer"})
+    identity = current_identity()
+    if identity != f"user:{user_id}" or (owner and owner.startswith("user:") and owner != identity):
+        raise HTTPException(status_code=403, detail="Not allowed to access another user's history")
+
+def current_address() -> str:
+    """"anon:<client address>" of the current request, whoever it is signed in as"""
+    return _address.get()
+
+class AuthMiddleware:
+    """Resolve the bearer token of each request into the identity fair-share and quotas are keyed on.
+
+    Requests without a token are identified by client address plus the
+    X-Client-Id header when the app sends one; a token that fails
+    verification is rejected outright rather than treated as anonymous.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        header = headers.get(b"authorization", b"").decode("latin-1")
+        client = scope.get("client")
+        address = f"anon:{client[0] if client else 'unknown'}"
+        client_id = headers.get(b"x-client-id", b"").decode("latin-1")
+        identity, authenticated = address, False
+        if _CLIENT_ID.match(client_id):
+            identity = f"{address}:{client_id}"
+        if header.lower().startswith("bearer "):
+            try:
+                identity, authenticated = f"user:{verify_token(header[7:].strip())['sub']}", True
+            except ValueError as e:
+                await _reject(scope, send, str(e))
+                return
+        identity_token = _identity.set(identity)
+        auth_token = _authenticated.set(authenticated)
+        address_token = _address.set(address)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _address.reset(address_token)
+            _authenticated.reset(auth_token)
+            _identity.reset(identity_token)
+
+async def _reject(scope, send, reason: str) -> None:
+    if scope["type"] == "websocket":
+        await send({"type": "websocket.close", "code": 1008})
+        return
+    body = json.dumps({"detail": f"Invalid token: {reason}"}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": 401,
+        "headers": [(b"content-type", b"application/json"), (b"www-authenticate", b"Bearer"),
+                    (b"content-length", str(len(body)).encode())],
+    })
+    await send({"type": "http.response.body", "body": body})
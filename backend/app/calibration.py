@@ -0,0 +1,97 @@
+from typing import List, Optional
+from app.config import settings
+from app.state import get_state
+from app import mp3
+import math
+import re
+
+# Observations outside this range are bad audio or odd text, not a speaking rate
+MIN_WPS, MAX_WPS = 0.8, 4.5
+# Clips shorter than this say little about the rate
+MIN_OBSERVED_WORDS = 20
+# Weight of a new observation in the per-voice moving average
+ALPHA = 0.2
+# English averages about 1.33 tokens per word; headroom lets the model finish its last sentence
+TOKENS_PER_WORD = 1.35
+TOKEN_HEADROOM = 1.15
+# Scripts this much over the target are trimmed before synthesis
+TRIM_TOLERANCE = 0.1
+
+def count_words(text: str) -> int:
+    return len(re.findall(r"[A-Za-z0-9']+", text))
+
+def _rate_key(voice_id: str, provider: Optional[str] = None) -> str:
+    """Rates are per provider: the same voice id speaks at a different pace on each engine.
+
+    `provider` defaults to the one the next synthesis would use.
+    """
+    from app import tts
+
+    provider = provider or tts.preferred_provider()
+    if provider in (None, tts.primary_provider()):
+        return f"speech_rate:{voice_id}"
+    return f"speech_rate:{provider}:{voice_id}"
+
+def words_per_second(voice_id: str, provider: Optional[str] = None) -> float:
+    """Learned speaking rate of a voice, pauses included; SPEECH_WORDS_PER_SECOND until one is measured"""
+    learned = get_state().get_json(_rate_key(voice_id, provider))
+    if learned:
+        return learned["wps"]
+    return getattr(settings, "speech_words_per_second", 2.2)
+
+def observe(voice_id: str, text: str, audio: bytes, provider: Optional[str] = None) -> Optional[float]:
+    """Fold the rate of a freshly synthesized clip into the voice's average on `provider`; returns the observed rate"""
+    words = count_words(text)
+    if words < MIN_OBSERVED_WORDS:
+        return None
+    try:
+        seconds = mp3.duration(audio)
+    except Exception as e:
+        print(f"Error measuring synthesized audio: {e}")
+        return None
+    if seconds <= 0:
+        return None
+    rate = words / seconds
+    if not MIN_WPS <= rate <= MAX_WPS:
+        return None
+    state = get_state()
+    key = _rate_key(voice_id, provider)
+    learned = state.get_json(key)
+    if learned:
+        learned = {"wps": (1 - ALPHA) * learned["wps"] + ALPHA * rate, "samples": learned["samples"] + 1}
+    else:
+        learned = {"wps": rate, "samples": 1}
+    state.set_json(key, learned)
+    return rate
+
+def target_words(duration_seconds: float, voice_id: str) -> int:
+    return max(int(duration_seconds * words_per_second(voice_id)), MIN_OBSERVED_WORDS)
+
+def max_tokens_for(words: int) -> int:
+    """Completion limit for a script of `words`, never above OPENAI_MAX_TOKENS"""
+    return min(math.ceil(words * TOKENS_PER_WORD * TOKEN_HEADROOM), getattr(settings, "openai_max_tokens", 1000))
+
+def script_parts(words: int) -> List[int]:
+    """Word targets of the completions a script of `words` is generated in, each fitting OPENAI_MAX_TOKENS"""
+    per_part = max(int(getattr(settings, "openai_max_tokens", 1000) / (TOKENS_PER_WORD * TOKEN_HEADROOM)), 1)
+    count = math.ceil(words / per_part)
+    return [words // count + (1 if i < words % count else 0) for i in range(count)]
+
+def trim_script(script: str, words: int) -> str:
+    """Cut a script that runs past its target at the last sentence that fits.
+
+    Paragraph breaks are kept, so pauses and HLS chunking still work on the
+    trimmed script. Scripts within TRIM_TOLERANCE of the target are left alone.
+    """
+    if count_words(script) <= words * (1 + TRIM_TOLERANCE):
+        return script
+    kept, total = [], 0
+    for sentence in re.split(r"(?<=[.!?…])(\s+)", script):
+        size = count_words(sentence)
+        if total + size > words and total:
+            break
+        kept.append(sentence)
+        total += size
+    trimmed = "".join(kept).rstrip()
+    print(f"Trimmed script from {count_words(script)} to {count_words(trimmed)} words (target {words})")
+    return trimmed
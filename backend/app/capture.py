@@ -0,0 +1,227 @@
+from contextvars import ContextVar
+from typing import Any, List, Optional
+from app.config import settings
+from app import auth
+import glob
+import gzip
+import hashlib
+import hmac
+import json
+import os
+import queue
+import random
+import re
+import shutil
+import threading
+import time
+
+# Request fields, query and path parameters that hold a choice from a fixed set, kept as-is so the
+# replayed mix is realistic
+CATEGORICAL_FIELDS = {
+    "sessionType", "voiceId", "mood", "goalCategory", "goalComplexity", "userExperienceLevel",
+    "backgroundMusic", "category", "timeline", "type", "stream", "session_type", "kind",
+}
+# Bodies and responses larger than this are recorded by size only
+MAX_CAPTURED_BODY = 64 * 1024
+SKIPPED_PREFIXES = ("/uploads/", "/api/admin/", "/api/traces", "/api/health")
+
+_WORD = re.compile(r"[A-Za-z]+")
+_upstream: ContextVar[Optional[List[dict]]] = ContextVar("captured_upstream", default=None)
+
+def _pseudonym(value: str, length: int) -> str:
+    digest = hmac.new(settings.secret_key.encode(), value.lower().encode(), hashlib.sha256).digest()
+    letters = "".join(chr(ord("a") + b % 26) for b in digest)
+    return (letters * (length // len(letters) + 1))[:length]
+
+def scramble(text: str) -> str:
+    """Replace every word with a keyed pseudonym of the same length.
+
+    Punctuation, numbers and spacing survive, so lengths and token counts are
+    close to the original, and the same word always maps to the same
+    pseudonym, so repeated answers still hit the same caches on replay.
+    """
+    return _WORD.sub(lambda m: _pseudonym(m.group(0), len(m.group(0))), text)
+
+def anonymize(value: Any, key: str = "") -> Any:
+    if isinstance(value, dict):
+        return {(scramble(k) if " " in k else k): anonymize(v, k) for k, v in value.items()}
+    if isinstance(value, list):
+        return [anonymize(v, key) for v in value]
+    if isinstance(value, str) and key not in CATEGORICAL_FIELDS:
+        return scramble(value)
+    return value
+
+def anonymize_content(text: str) -> str:
+    """LLM output echoes user answers; JSON responses keep their keys so replayed parsing still works"""
+    try:
+        return json.dumps(anonymize(json.loads(text)))
+    except (ValueError, TypeError):
+        return scramble(text)
+
+def record_upstream(kind: str, **fields) -> None:
+    """Called by the upstream clients; a no-op unless the current request is being captured"""
+    calls = _upstream.get()
+    if calls is not None:
+        calls.append(dict(fields, k=kind))
+
+class CaptureLog:
+    """Append-only JSONL written by a background thread, rotated by size and gzipped when closed"""
+
+    def __init__(self, directory: str, max_bytes: int, keep: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep = keep
+        self.queue: "queue.Queue" = queue.Queue(maxsize=10000)
+        self.dropped = 0
+        os.makedirs(directory, exist_ok=True)
+        threading.Thread(target=self._write, daemon=True).start()
+
+    def append(self, record: dict) -> None:
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+    def _open(self):
+        path = os.path.join(self.directory, f"capture-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.jsonl")
+        return path, open(path, "a")
+
+    def _rotate(self, path: str) -> None:
+        with open(path, "rb") as src, gzip.open(path + ".gz", "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(path)
+        for old in sorted(glob.glob(os.path.join(self.directory, "capture-*.jsonl.gz")))[:-self.keep]:
+            os.remove(old)
+
+    def _write(self) -> None:
+        path, f = self._open()
+        while True:
+            record = self.queue.get()
+            f.write(json.dumps(record, separators=(",", ":")) + "\n")
+            if self.queue.empty():
+                f.flush()
+            if f.tell() >= self.max_bytes:
+                f.close()
+                self._rotate(path)
+                path, f = self._open()
+
+_log: Optional[CaptureLog] = None
+
+def get_log() -> CaptureLog:
+    global _log
+    if _log is None:
+        _log = CaptureLog(
+            getattr(settings, "capture_dir", "captures"),
+            getattr(settings, "capture_max_bytes", 50 * 1024 * 1024),
+            getattr(settings, "capture_keep_files", 5),
+        )
+    return _log
+
+def _route_template(scope) -> str:
+    endpoint = scope.get("endpoint")
+    for route in scope["app"].routes if "app" in scope else []:
+        if getattr(route, "endpoint", None) is endpoint:
+            return route.path
+    return scope["path"]
+
+def _anonymize_param(name: str, value: Any) -> str:
+    value = str(value)
+    if name in CATEGORICAL_FIELDS or value.isdigit() or _is_uuid(value):
+        return value
+    return _pseudonym(value, 12)
+
+_PARAM = re.compile(r"\{(\w+)(?::\w+)?\}")
+
+def _anonymize_path(scope) -> str:
+    """The path rebuilt from its route template, so only the parameter segments change"""
+    template = _route_template(scope)
+    params = scope.get("path_params") or {}
+    if template == scope["path"] or not all(m[1] in params for m in _PARAM.finditer(template)):
+        return scope["path"]
+    return _PARAM.sub(lambda m: _anonymize_param(m[1], params[m[1]]), template)
+
+def _is_uuid(value: str) -> bool:
+    # Server-generated session ids carry no user data and are needed to chain replayed requests
+    return bool(re.fullmatch(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}", value))
+
+def _anonymize_query(query: str) -> str:
+    from urllib.parse import parse_qsl, urlencode
+
+    return urlencode([
+        (k, v if k in CATEGORICAL_FIELDS or v.isdigit() or _is_uuid(v) else scramble(v)) for k, v in parse_qsl(query)
+    ])
+
+class TrafficCaptureMiddleware:
+    """Opt-in (CAPTURE_ENABLED) capture of anonymized requests, timings and upstream responses for replay.
+
+    Each record holds the arrival time, route, anonymized body and query,
+    a keyed hash of the caller, status and duration, plus every OpenAI and
+    TTS call made while serving it: anonymized completion text and token
+    usage, synthesized seconds and latency. scripts/replay_traffic.py plays
+    the log back against the app with those responses standing in for the
+    real services.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (scope["type"] != "http" or not getattr(settings, "capture_enabled", False)
+                or scope["path"].startswith(SKIPPED_PREFIXES)
+                or random.random() >= getattr(settings, "capture_sample_rate", 1.0)):
+            await self.app(scope, receive, send)
+            return
+
+        started_at = time.time()
+        started = time.perf_counter()
+        body = bytearray()
+        response = {"status": 0, "body": bytearray(), "json": False}
+
+        async def capture_receive():
+            message = await receive()
+            if message["type"] == "http.request" and len(body) <= MAX_CAPTURED_BODY:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                headers = dict(message.get("headers") or [])
+                response["json"] = headers.get(b"content-type", b"").startswith(b"application/json")
+            elif message["type"] == "http.response.body" and response["json"] and len(response["body"]) <= MAX_CAPTURED_BODY:
+                response["body"].extend(message.get("body", b""))
+            await send(message)
+
+        calls: List[dict] = []
+        token = _upstream.set(calls)
+        try:
+            await self.app(scope, capture_receive, capture_send)
+        finally:
+            _upstream.reset(token)
+            get_log().append(self._record(scope, started_at, started, bytes(body), response, calls))
+
+    def _record(self, scope, started_at: float, started: float, body: bytes, response: dict, calls: List[dict]) -> dict:
+        record = {
+            "t": round(started_at, 3),
+            "m": scope["method"],
+            "p": _anonymize_path(scope),
+            "r": _route_template(scope),
+            "q": _anonymize_query(scope.get("query_string", b"").decode("latin-1")),
+            "u": _pseudonym(auth.current_identity(), 12),
+            "a": auth.is_authenticated(),
+            "bs": len(body),
+            "s": response["status"],
+            "ms": round((time.perf_counter() - started) * 1000, 1),
+            "up": calls,
+        }
+        try:
+            record["b"] = anonymize(json.loads(body)) if body and len(body) <= MAX_CAPTURED_BODY else None
+        except ValueError:
+            record["b"] = None
+        try:
+            session_id = json.loads(bytes(response["body"])).get("sessionId") if response["body"] else None
+            if session_id:
+                record["sid"] = session_id
+        except (ValueError, AttributeError):
+            pass
+        return record
@@ -0,0 +1,78 @@
+from collections import defaultdict
+from typing import Dict, Optional, Tuple
+from app.goal_categories import GOAL_CATEGORIES
+import re
+
+# Keyword sets per (namespace, label). Question-type rules are checked in the
+# order listed; the first label with a hit wins.
+MEDITATION_QUESTION_RULES = [
+    ("number", ["how long", "how much", "how many"]),
+    ("text", ["where", "location", "place"]),
+    ("single", ["yes", "no", "are you", "do you"]),
+]
+
+VISUALIZATION_QUESTION_RULES = [
+    ("scale", ["how long", "how much", "how many", "rate", "scale"]),
+    ("textarea", ["describe", "explain", "tell me about"]),
+    ("single", ["yes", "no", "are you", "do you"]),
+]
+
+def _keyword_table() -> Dict[str, list]:
+    table = defaultdict(list)
+    for label, words in MEDITATION_QUESTION_RULES:
+        for word in words:
+            table[word].append(("meditation", label))
+    for label, words in VISUALIZATION_QUESTION_RULES:
+        for word in words:
+            table[word].append(("visualization", label))
+    for category, info in GOAL_CATEGORIES.items():
+        for word in info["keywords"]:
+            table[word].append(("goal", category))
+    return dict(table)
+
+_KEYWORDS = _keyword_table()
+
+# Every keyword set in one alternation, longest phrases first so "how long"
+# wins over any shorter overlap. Plurals ("jobs", "relationships") also match.
+_PATTERN = re.compile(
+    r"\b(" + "|".join(re.escape(w) for w in sorted(_KEYWORDS, key=len, reverse=True)) + r")s?\b"
+)
+
+def classify(text: str) -> Dict[Tuple[str, str], int]:
+    """Count keyword hits per (namespace, label) in one scan of the text"""
+    hits: Dict[Tuple[str, str], int] = defaultdict(int)
+    for match in _PATTERN.finditer(text.lower()):
+        for key in _KEYWORDS[match.group(1)]:
+            hits[key] += 1
+    return hits
+
+def _first_rule(hits: Dict[Tuple[str, str], int], namespace: str, rules: list) -> Optional[str]:
+    for label, _ in rules:
+        if hits.get((namespace, label)):
+            return label
+    return None
+
+def meditation_question_type(question: str) -> str:
+    question_type = _first_rule(classify(question), "meditation", MEDITATION_QUESTION_RULES)
+    if question_type:
+        return question_type
+    return "textarea" if len(question) > 100 else "text"
+
+def visualization_question_type(question: str) -> str:
+    return _first_rule(classify(question), "visualization", VISUALIZATION_QUESTION_RULES) or "text"
+
+def detect_goal_category(text: str) -> Optional[str]:
+    """Goal category with the most keyword hits, or None when nothing matches"""
+    hits = classify(text)
+    best, best_count = None, 0
+    for category in GOAL_CATEGORIES:
+        count = hits.get(("goal", category), 0)
+        if count > best_count:
+            best, best_count = category, count
+    return best
+
+def resolve_goal_category(category: str, goal: str) -> str:
+    """Use the given category when it is a known one, otherwise infer it from the goal text"""
+    if category and category.lower() in GOAL_CATEGORIES:
+        return category.lower()
+    return detect_goal_category(goal) or "personal_growth"
@@ -0,0 +1,79 @@
+from functools import lru_cache
+from app.config import settings
+from app import admission, capture, hedging, metering, tracing
+import time
+
+# Upstream SDKs are imported inside the accessors so importing a router stays cheap;
+# the first request that needs a client pays for it once per process.
+
+@lru_cache(maxsize=None)
+def _openai_client():
+    from openai import OpenAI
+
+    return OpenAI(api_key=settings.openai_api_key)
+
+def get_openai_client():
+    """Raises admission.Degraded while load shedding or a usage budget skips the LLM, so callers take their fallback path"""
+    if not admission.allow_llm():
+        raise admission.Degraded("OpenAI skipped under load or over budget")
+    return _openai_client()
+
+def get_openai_speech_client():
+    """The same OpenAI client for text-to-speech, which load shedding gates separately from the LLM"""
+    return _openai_client()
+
+def chat_completion(hedge: bool = False, **kwargs):
+    """Create a chat completion, traced as an upstream call and metered against the current endpoint.
+
+    hedge=True is for short prompts whose tail latency the user waits on:
+    a slow call gets a backup attempt (see app/hedging.py).
+    """
+    client = get_openai_client()
+
+    def attempt():
+        with tracing.span("openai.chat", model=kwargs.get("model"), maxTokens=kwargs.get("max_tokens")):
+            result = client.chat.completions.create(**kwargs)
+        # Every attempt is paid for, including a hedge that lost
+        metering.record_completion(result)
+        return result
+
+    started = time.perf_counter()
+    response = hedging.hedged("openai.chat", attempt) if hedge else attempt()
+    _capture_completion(response, started)
+    return response
+
+def script_completion(messages, words: int, **kwargs) -> str:
+    """Chat-complete a script of about `words` words, in several completions when one can't hold it.
+
+    Each completion is capped at OPENAI_MAX_TOKENS, so long sessions are
+    written in parts that continue from the end of the previous one (see
+    prompts.part_messages) instead of one call the model can't serve.
+    """
+    from app import calibration, prompts
+
+    parts = calibration.script_parts(words)
+    script = ""
+    for index, part_words in enumerate(parts):
+        part_prompt = messages if len(parts) == 1 else prompts.part_messages(
+            messages, script, index + 1, len(parts), part_words
+        )
+        response = chat_completion(messages=part_prompt, max_tokens=calibration.max_tokens_for(part_words), **kwargs)
+        text = response.choices[0].message.content.strip()
+        script = f"{script}\n\n{text}" if script else text
+    return script
+
+def _capture_completion(response, started: float) -> None:
+    usage = getattr(response, "usage", None)
+    capture.record_upstream(
+        "openai",
+        ms=round((time.perf_counter() - started) * 1000, 1),
+        content=capture.anonymize_content(response.choices[0].message.content or ""),
+        prompt=getattr(usage, "prompt_tokens", 0),
+        completion=getattr(usage, "completion_tokens", 0),
+    )
+
+@lru_cache(maxsize=None)
+def get_tts_client():
+    from app.tts import ElevenLabsClient
+
+    return ElevenLabsClient(settings.eleven_labs_api_key, settings.eleven_labs_base_url, settings.eleven_labs_model)
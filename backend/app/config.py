@@ -1,5 +1,6 @@
 from pydantic_settings import BaseSettings
-from typing import List
+from functools import lru_cache
+from typing import Dict, List
 import os
 
 class Settings(BaseSettings):
@@ -19,24 +20,115 @@ class Settings(BaseSettings):
     # Eleven Labs
     eleven_labs_base_url: str = "https://api.elevenlabs.io/v1"
     eleven_labs_model: str = "eleven_monolingual_v1"
+    # Speech providers in order of preference; requests are routed by their rolling latency and error rate
+    tts_providers: List[str] = ["elevenlabs", "openai", "local"]
+    openai_tts_model: str = "tts-1"
+    # Offline engine: reads text on stdin, writes WAV to stdout ({voice} is substituted); needs ffmpeg
+    local_tts_command: str = "espeak-ng -s 140 -v {voice} --stdout"
+    # Equivalent voice on each provider for the ElevenLabs voice ids used by the app
+    tts_voice_map: Dict[str, Dict[str, str]] = {
+        "21m00Tcm4TlvDq8ikWAM": {"openai": "shimmer", "local": "en-us+f3"},
+        "AZnzlk1XvdvUeBnXmlld": {"openai": "onyx", "local": "en-us+m3"},
+    }
+    # A remote provider slower than this (ms per character) or failing this often is routed around
+    tts_slow_ms_per_char: float = 20
+    tts_max_error_rate: float = 0.5
+    # Speaking rate assumed for a voice until its generated audio has been measured
+    speech_words_per_second: float = 2.2
     # OpenAI
     openai_model: str = "gpt-4"
     openai_max_tokens: int = 1000
     openai_temperature: float = 0.7
+    prompt_input_budgets: Dict[str, int] = {}  # Per-prompt input token budget overrides
+    # Script reuse: serve a stored session when a request is this close (cosine distance) to it
+    script_reuse_enabled: bool = True
+    script_reuse_max_distance: float = 0.25
+    # Looser cap used while load shedding skips the LLM; still bounded so unrelated scripts are never served
+    script_reuse_degraded_max_distance: float = 0.4
+    # Progressive (HLS) delivery for sessions at least hls_min_duration seconds long
+    hls_min_duration: int = 300
+    hls_segment_seconds: float = 6.0
+    hls_chunk_chars: int = 1200
+    # One-tap sessions
+    one_tap_pause_seconds: float = 1.5
+    one_tap_prefetch_steps: int = 2  # Steps synthesized ahead of the one requested, 0 disables
+    one_tap_prefetch_workers: int = 1
+    one_tap_prefetch_idle_seconds: int = 90  # Queued prefetch is dropped for sessions idle this long
     # Suno
     suno_base_url: str = "https://api.suno.ai/v1"
+    # Background music
+    background_music_level_db: float = -30.0
+    music_workers: int = 2
+    precompute_background_beds: bool = False
+    # Tracing: requests slower than this keep their full span tree for /api/traces
+    trace_slow_ms: float = 2000
+    trace_buffer_size: int = 100
+    # Profiling: admin endpoints need X-Admin-Token to match ADMIN_TOKEN (disabled when empty)
+    admin_token: str = ""
+    loop_lag_monitor: bool = True
+    loop_lag_threshold_ms: float = 100
+    # Traffic capture for replay (scripts/replay_traffic.py): anonymized requests and upstream responses
+    capture_enabled: bool = False
+    capture_dir: str = "captures"
+    capture_sample_rate: float = 1.0
+    capture_max_bytes: int = 50 * 1024 * 1024
+    capture_keep_files: int = 5
     # Database
     database_url: str = "sqlite:///./mindful_coach.db"
     # JWT
     secret_key: str = "my-super-secret-key-change-this-in-production"
     algorithm: str = "HS256"
     access_token_expire_minutes: int = 30
+    # Require a bearer token for session generation; without one, anonymous users are keyed by address
+    auth_required: bool = False
+    auth_token_cache_size: int = 10000
+    # Per-user fair share of generation slots (/start, /one-tap/*) and an hourly quota in audio minutes
+    fair_share_slots: int = 8
+    fair_share_per_user: int = 2
+    fair_share_max_wait_seconds: float = 30
+    user_quota_minutes_per_hour: float = 60
+    # Anonymous quotas are per app install (X-Client-Id); one address gets at most this many allowances
+    anon_clients_per_address: int = 10
     # Redis
     redis_url: str = "redis://localhost:6379"
+    state_backend: str = "auto"  # auto, redis or memory
+    state_key_prefix: str = "mindful:"
+    synthesis_rate_per_minute: int = 30
+    # Speculative next-question calls a user's typing may start per minute on the session WebSocket
+    ws_speculation_per_minute: int = 20
+    # Admission control: queue-wait (ms) at which requests skip the LLM, skip synthesis, get 503s
+    admission_wait_ms: List[float] = [300, 1000, 3000]
+    # In-flight requests per route class where degradation starts (1.5x skips synthesis, 2x sheds)
+    admission_in_flight: Dict[str, int] = {"session": 8, "llm": 16, "one_tap": 16, "other": 32}
+    # Upstream usage metering: seconds between batched ledger flushes, and daily budgets per endpoint,
+    # e.g. {"meditate.start": {"openai_tokens": 2000000, "tts_chars": 5000000}}
+    metering_flush_seconds: float = 10
+    metering_budgets: Dict[str, Dict[str, int]] = {}
+    # Hedged upstream calls (questions, one-tap step audio): a backup attempt starts after the route's
+    # p<percentile> latency, limited to budget_ratio extra calls per call
+    hedge_enabled: bool = True
+    hedge_percentile: float = 95
+    hedge_budget_ratio: float = 0.05
+    hedge_min_samples: int = 20
+    hedge_min_delay_ms: float = 50
+    hedge_max_chars: int = 600
+    hedge_workers: int = 16
 
     class Config:
         env_file = ".env"
         case_sensitive = False
 
-settings = Settings()
-os.makedirs(settings.upload_dir, exist_ok=True) 
\ No newline at end of file
+@lru_cache(maxsize=None)
+def get_settings() -> Settings:
+    """Build settings on first use instead of at import, so cold starts skip env parsing until needed"""
+    loaded = Settings()
+    os.makedirs(loaded.upload_dir, exist_ok=True)
+    return loaded
+
+class _LazySettings:
+    """Module-level `settings` that resolves to get_settings() on first attribute access"""
+
+    def __getattr__(self, name):
+        return getattr(get_settings(), name)
+
+settings = _LazySettings() 
\ No newline at end of file
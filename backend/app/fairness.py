@@ -0,0 +1,230 @@
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Deque, Dict, List, Optional
+from fastapi import HTTPException
+from starlette.concurrency import run_in_threadpool
+from app.config import settings
+from app.state import get_state
+from app import auth
+import asyncio
+import inspect
+import threading
+
+# Set by trusted in-process callers (scripts/batch_generate.py) that are not users of the API
+_exempt: ContextVar[bool] = ContextVar("fair_share_exempt", default=False)
+# Work started under share() that outlives it; a mutable list so threadpool code (with a copied context) can add to it
+_held: ContextVar[Optional[List[threading.Event]]] = ContextVar("fair_share_held", default=None)
+
+class _Ticket:
+    def __init__(self, user: str, loop: asyncio.AbstractEventLoop):
+        self.user = user
+        self.loop = loop
+        self.future = loop.create_future()
+        self.granted = False
+
+def _grant(future: asyncio.Future) -> None:
+    if not future.done():
+        future.set_result(True)
+
+class FairScheduler:
+    """Shares a fixed number of generation slots between users in round-robin order.
+
+    Each user with waiting requests takes one turn per rotation and holds at
+    most FAIR_SHARE_PER_USER slots at once, so a batch from one client queues
+    behind itself instead of ahead of everyone else. Waiting happens on the
+    event loop, so queued requests don't hold threadpool threads.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.active: Dict[str, int] = {}
+        self.waiting: Dict[str, Deque[_Ticket]] = {}
+        self.rotation: Deque[str] = deque()
+        self.total = 0
+
+    def _next_ticket(self):
+        """The ticket that gets the next free slot, or None when none can start now"""
+        if self.total >= getattr(settings, "fair_share_slots", 8):
+            return None
+        per_user = getattr(settings, "fair_share_per_user", 2)
+        for user in self.rotation:
+            if self.active.get(user, 0) < per_user:
+                return self.waiting[user][0]
+        return None
+
+    def _dispatch(self) -> None:
+        """Hand free slots to waiting tickets; called with the lock held"""
+        while True:
+            ticket = self._next_ticket()
+            if ticket is None:
+                return
+            # Go to the back of the rotation so every other waiting user gets a turn first
+            self._dequeue(ticket, to_back=True)
+            self.active[ticket.user] = self.active.get(ticket.user, 0) + 1
+            self.total += 1
+            ticket.granted = True
+            ticket.loop.call_soon_threadsafe(_grant, ticket.future)
+
+    def _dequeue(self, ticket: _Ticket, to_back: bool) -> None:
+        user = ticket.user
+        self.waiting[user].remove(ticket)
+        if not self.waiting[user]:
+            del self.waiting[user]
+            self.rotation.remove(user)
+        elif to_back:
+            self.rotation.remove(user)
+            self.rotation.append(user)
+
+    async def acquire(self, user: str, timeout: float) -> bool:
+        ticket = _Ticket(user, asyncio.get_running_loop())
+        with self.lock:
+            self.waiting.setdefault(user, deque()).append(ticket)
+            if user not in self.rotation:
+                self.rotation.append(user)
+            self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(ticket.future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            # A slot granted just as the wait ran out is kept
+            return not self._withdraw(ticket)
+        except asyncio.CancelledError:
+            # The client went away while waiting
+            if not self._withdraw(ticket):
+                self.release(user)
+            raise
+
+    def _withdraw(self, ticket: _Ticket) -> bool:
+        """Take a ticket out of the queue; False if it was granted a slot meanwhile"""
+        with self.lock:
+            if ticket.granted:
+                return False
+            self._dequeue(ticket, to_back=False)
+            self._dispatch()
+            return True
+
+    def release(self, user: str) -> None:
+        with self.lock:
+            self.active[user] -= 1
+            if not self.active[user]:
+                del self.active[user]
+            self.total -= 1
+            self._dispatch()
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            return {
+                "active": self.total,
+                "slots": getattr(settings, "fair_share_slots", 8),
+                "activeUsers": len(self.active),
+                "waiting": sum(len(q) for q in self.waiting.values()),
+                "waitingUsers": len(self.waiting),
+            }
+
+scheduler = FairScheduler()
+
+def charge_quota(user: str, minutes: float, address: Optional[str] = None) -> bool:
+    """Take `minutes` of generated audio from the user's hourly allowance (a token bucket shared by workers).
+
+    Anonymous users are told apart by the client id their app sends, so
+    their address as a whole gets ANON_CLIENTS_PER_ADDRESS allowances: enough
+    for a NAT or proxy, without letting one client mint unlimited ids.
+    `address` defaults to the current request's, for work charged later.
+    """
+    per_hour = getattr(settings, "user_quota_minutes_per_hour", 60)
+    if not per_hour:
+        return True
+    minutes = min(minutes, per_hour)
+    state = get_state()
+    # The user's own bucket first: it is the one that usually runs out, and a refusal there costs the address nothing
+    if not state.allow(f"quota:{user}", per_hour / 3600.0, per_hour, minutes):
+        return False
+    address = address or auth.current_address()
+    # Without a client id the identity is the address itself, whose own bucket was just charged
+    if user.startswith("anon:") and user != address:
+        shared = per_hour * getattr(settings, "anon_clients_per_address", 10)
+        return state.allow(f"quota:{address}", shared / 3600.0, shared, minutes)
+    return True
+
+def is_exempt() -> bool:
+    return _exempt.get()
+
+@contextmanager
+def exempt():
+    """Run trusted offline work (batch generation) outside quotas and the shared slots"""
+    token = _exempt.set(True)
+    try:
+        yield
+    finally:
+        _exempt.reset(token)
+
+def hold_until(done: threading.Event) -> None:
+    """Keep the current request's generation slot until `done` is set.
+
+    For work that carries on after the endpoint returns, like progressive
+    synthesis; a no-op outside share().
+    """
+    held = _held.get()
+    if held is not None:
+        held.append(done)
+
+async def _release_when_done(user: str, held: List[threading.Event]) -> None:
+    try:
+        # Polled rather than waited on in a thread, so a long session doesn't tie up an executor thread
+        while not all(done.is_set() for done in held):
+            await asyncio.sleep(0.5)
+    finally:
+        scheduler.release(user)
+
+@asynccontextmanager
+async def share(minutes: float):
+    """Authenticate if required, wait for a generation slot, then charge the user's quota.
+
+    Raises HTTPException (401, 503 when no slot frees up in time, 429 when
+    the quota is used up). Used by fair_share and the WebSocket channel.
+    """
+    if not minutes or _exempt.get():
+        yield
+        return
+    if getattr(settings, "auth_required", False) and not auth.is_authenticated():
+        raise HTTPException(status_code=401, detail="Sign in to start a session",
+                            headers={"WWW-Authenticate": "Bearer"})
+    user = auth.current_identity()
+    if not await scheduler.acquire(user, getattr(settings, "fair_share_max_wait_seconds", 30)):
+        raise HTTPException(status_code=503, detail="Server is busy, please retry shortly",
+                            headers={"Retry-After": "5"})
+    held: List[threading.Event] = []
+    token = _held.set(held)
+    try:
+        # Charged only once the work can start, so requests turned away with 503 cost nothing
+        if not charge_quota(user, minutes):
+            raise HTTPException(status_code=429, detail="Hourly session quota used up, please try again later")
+        yield
+    finally:
+        _held.reset(token)
+        if any(not done.is_set() for done in held):
+            asyncio.get_running_loop().create_task(_release_when_done(user, held))
+        else:
+            scheduler.release(user)
+
+def fair_share(cost: Callable[..., float]):
+    """Decorator for expensive endpoints: run them inside share(cost(...)).
+
+    `cost` gets the endpoint's arguments and returns the minutes of audio
+    the call will generate; 0 (e.g. audio already on disk) skips quota and
+    queue. The decorated endpoint becomes async: it waits for its slot on
+    the event loop and only then takes a threadpool thread. Place it under
+    @cached_response so cache hits skip it too.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            minutes = cost(**signature.bind(*args, **kwargs).arguments)
+            async with share(minutes):
+                return await run_in_threadpool(func, *args, **kwargs)
+        return wrapper
+    return decorator
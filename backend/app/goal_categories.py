@@ -0,0 +1,33 @@
+# Goal Categories and their characteristics
+GOAL_CATEGORIES = {
+    "career": {
+        "keywords": ["job", "career", "business", "work", "professional", "promotion", "startup"],
+        "common_challenges": ["imposter syndrome", "work-life balance", "skill gaps", "networking"],
+        "success_factors": ["clear planning", "skill development", "networking", "persistence"]
+    },
+    "health": {
+        "keywords": ["health", "fitness", "weight", "exercise", "diet", "wellness", "medical"],
+        "common_challenges": ["motivation", "time management", "consistency", "plateaus"],
+        "success_factors": ["habit formation", "realistic goals", "support system", "tracking"]
+    },
+    "relationships": {
+        "keywords": ["relationship", "love", "marriage", "family", "friendship", "dating"],
+        "common_challenges": ["communication", "trust issues", "time investment", "expectations"],
+        "success_factors": ["open communication", "patience", "understanding", "quality time"]
+    },
+    "personal_growth": {
+        "keywords": ["growth", "development", "learning", "self-improvement", "confidence", "mindset"],
+        "common_challenges": ["self-doubt", "fear of failure", "comfort zone", "comparison"],
+        "success_factors": ["self-awareness", "continuous learning", "resilience", "authenticity"]
+    },
+    "financial": {
+        "keywords": ["money", "finance", "wealth", "investment", "savings", "debt", "income"],
+        "common_challenges": ["financial literacy", "discipline", "market volatility", "debt"],
+        "success_factors": ["education", "discipline", "diversification", "long-term thinking"]
+    },
+    "creative": {
+        "keywords": ["creative", "art", "music", "writing", "design", "innovation", "expression"],
+        "common_challenges": ["creative blocks", "perfectionism", "criticism", "consistency"],
+        "success_factors": ["regular practice", "experimentation", "feedback", "authenticity"]
+    }
+}
@@ -0,0 +1,156 @@
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from contextvars import ContextVar, copy_context
+from typing import Callable, Deque, Dict, Optional
+from app.config import settings
+from app import admission, metering
+import threading
+import time
+
+# Set in each attempt of a hedged call; the losing attempt sees it set once the other has won
+_cancelled: ContextVar[Optional[threading.Event]] = ContextVar("hedge_cancelled", default=None)
+
+def cancelled() -> bool:
+    """True inside the losing attempt of a hedged call, so clients that can stop early do"""
+    event = _cancelled.get()
+    return event is not None and event.is_set()
+
+class HedgeStats:
+    """Latencies of one upstream call on one route, and how hedging it went"""
+
+    def __init__(self, window: int = 200):
+        self.latency: Deque[float] = deque(maxlen=window)
+        self.calls = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.skipped_budget = 0
+
+    def delay_ms(self) -> Optional[float]:
+        """The route's p9x latency, after which a second attempt starts; None until enough calls were seen"""
+        if len(self.latency) < getattr(settings, "hedge_min_samples", 20):
+            return None
+        ordered = sorted(self.latency)
+        percentile = getattr(settings, "hedge_percentile", 95) / 100.0
+        p = ordered[min(len(ordered) - 1, int(percentile * len(ordered)))]
+        return max(p, getattr(settings, "hedge_min_delay_ms", 50))
+
+    def snapshot(self) -> dict:
+        delay = self.delay_ms()
+        return {
+            "calls": self.calls,
+            "hedged": self.hedged,
+            "hedgeWins": self.hedge_wins,
+            "winRate": round(self.hedge_wins / self.hedged, 3) if self.hedged else None,
+            "skippedBudget": self.skipped_budget,
+            "delayMs": round(delay, 1) if delay is not None else None,
+        }
+
+class Hedger:
+    """Runs short idempotent upstream calls with a backup attempt for the slow tail.
+
+    A second attempt starts once the first has taken longer than the route's
+    observed p9x latency; whichever returns first wins and the other is told
+    to stop (see cancelled()) and its result dropped. Each call earns
+    HEDGE_BUDGET_RATIO of a hedge, so backups never add more than that share
+    of upstream load, and nothing is hedged while admission control is
+    degrading.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.stats: Dict[str, HedgeStats] = {}
+        self.tokens = 0.0
+        self.pool: Optional[ThreadPoolExecutor] = None
+
+    def _stats(self, key: str) -> HedgeStats:
+        if key not in self.stats:
+            self.stats[key] = HedgeStats()
+        return self.stats[key]
+
+    def _take_token(self) -> bool:
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def _submit(self, func: Callable, args: tuple, event: threading.Event):
+        if self.pool is None:
+            with self.lock:
+                if self.pool is None:
+                    self.pool = ThreadPoolExecutor(getattr(settings, "hedge_workers", 16), thread_name_prefix="hedge")
+        context = copy_context()
+
+        def attempt():
+            _cancelled.set(event)
+            return func(*args)
+        return self.pool.submit(context.run, attempt)
+
+    def call(self, upstream: str, func: Callable, *args, ok: Callable = bool):
+        """func(*args), hedged on the current route; `ok` tells a usable result from a failed one"""
+        key = f"{upstream}:{metering.current_endpoint()}"
+        ratio = getattr(settings, "hedge_budget_ratio", 0.05)
+        with self.lock:
+            stats = self._stats(key)
+            stats.calls += 1
+            self.tokens = min(self.tokens + ratio, max(ratio * 100, 1))
+            delay = stats.delay_ms()
+        started = time.monotonic()
+        if not getattr(settings, "hedge_enabled", True) or delay is None or admission.overall_level() > admission.NORMAL:
+            result = func(*args)
+            self._record(stats, started, result, ok)
+            return result
+
+        events = [threading.Event(), threading.Event()]
+        primary = self._submit(func, args, events[0])
+        done, _ = wait([primary], timeout=delay / 1000)
+        if done:
+            return self._finish(stats, started, primary.result(), ok)
+        with self.lock:
+            allowed = self._take_token()
+            if allowed:
+                stats.hedged += 1
+            else:
+                stats.skipped_budget += 1
+        if not allowed:
+            return self._finish(stats, started, primary.result(), ok)
+
+        backup = self._submit(func, args, events[1])
+        pending = {primary, backup}
+        result = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            winner = next(iter(done))
+            try:
+                result = winner.result()
+            except Exception:
+                if not pending:
+                    raise
+                continue
+            if ok(result) or not pending:
+                break
+        for attempt, event in zip((primary, backup), events):
+            if attempt in pending:
+                attempt.cancel()
+                event.set()
+        if winner is backup:
+            with self.lock:
+                stats.hedge_wins += 1
+        return self._finish(stats, started, result, ok)
+
+    def _finish(self, stats: HedgeStats, started: float, result, ok: Callable):
+        self._record(stats, started, result, ok)
+        return result
+
+    def _record(self, stats: HedgeStats, started: float, result, ok: Callable) -> None:
+        if ok(result):
+            with self.lock:
+                stats.latency.append((time.monotonic() - started) * 1000)
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self.lock:
+            return {key: stats.snapshot() for key, stats in sorted(self.stats.items())}
+
+hedger = Hedger()
+
+def hedged(upstream: str, func: Callable, *args, ok: Callable = bool):
+    return hedger.call(upstream, func, *args, ok=ok)
@@ -0,0 +1,214 @@
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+from sqlalchemy import (Column, Float, Index, Integer, MetaData, String, Table, Text, and_, create_engine,
+                        or_, select)
+from sqlalchemy.exc import IntegrityError
+from app.config import settings
+import base64
+import threading
+
+metadata = MetaData()
+
+sessions = Table(
+    "session_history", metadata,
+    Column("session_id", String(64), primary_key=True),
+    Column("user_id", String(128), nullable=False),
+    Column("session_type", String(32), nullable=False),
+    Column("created_at", String(32), nullable=False),
+    Column("completed_at", String(32), nullable=False),
+    Column("rating", Integer),
+    Column("notes", Text),
+    Column("clarity_score", Integer),
+    Column("confidence_score", Integer),
+    Column("mood", String(64)),
+    Column("goal", Text),
+    Column("voice_id", String(64)),
+    Column("audio_url", String(256)),
+    # Keyset pagination walks these indexes newest-first; session_id breaks ties
+    Index("ix_history_user_created", "user_id", "created_at", "session_id"),
+    Index("ix_history_user_type_created", "user_id", "session_type", "created_at", "session_id"),
+)
+
+# Per-user aggregates, updated incrementally on every completion so profile reads are one row
+user_stats = Table(
+    "user_session_stats", metadata,
+    Column("user_id", String(128), primary_key=True),
+    Column("total_sessions", Integer, nullable=False, default=0),
+    Column("meditation_sessions", Integer, nullable=False, default=0),
+    Column("visualization_sessions", Integer, nullable=False, default=0),
+    Column("rating_sum", Float, nullable=False, default=0),
+    Column("rating_count", Integer, nullable=False, default=0),
+    Column("clarity_sum", Float, nullable=False, default=0),
+    Column("clarity_count", Integer, nullable=False, default=0),
+    Column("confidence_sum", Float, nullable=False, default=0),
+    Column("confidence_count", Integer, nullable=False, default=0),
+    Column("current_streak", Integer, nullable=False, default=0),
+    Column("longest_streak", Integer, nullable=False, default=0),
+    Column("last_active_date", String(10)),
+)
+
+# Attempts at a completion whose stats row was created concurrently
+STATS_RETRIES = 3
+
+_engine = None
+_engine_lock = threading.Lock()
+
+def get_engine():
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            url = settings.database_url
+            connect_args = {"check_same_thread": False} if url.startswith("sqlite") else {}
+            _engine = create_engine(url, connect_args=connect_args, pool_pre_ping=True)
+            metadata.create_all(_engine)
+        return _engine
+
+def encode_cursor(created_at: str, session_id: str) -> str:
+    return base64.urlsafe_b64encode(f"{created_at}|{session_id}".encode()).decode()
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    created_at, session_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|", 1)
+    return created_at, session_id
+
+def _next_streak(row, today: date) -> Tuple[int, int]:
+    current = row.current_streak if row else 0
+    longest = row.longest_streak if row else 0
+    last = date.fromisoformat(row.last_active_date) if row and row.last_active_date else None
+    if last == today:
+        return current, longest
+    current = current + 1 if last == today - timedelta(days=1) else 1
+    return current, max(longest, current)
+
+class _AlreadyRecorded(Exception):
+    """The session row exists: rolls back the transaction without touching the stats"""
+
+def record_completion(session_id: str, user_id: str, session_type: str, created_at: Optional[str] = None,
+                      rating: Optional[int] = None, notes: Optional[str] = None,
+                      clarity_score: Optional[int] = None, confidence_score: Optional[int] = None,
+                      **details) -> bool:
+    """Store a completed session and fold it into the user's aggregates.
+
+    Returns False if the session was already recorded, so repeated completion
+    calls never double-count. When two first completions of a new user race
+    to create the stats row, the loser retries instead of losing its session.
+    """
+    now = datetime.utcnow()
+    row = {
+        "session_id": session_id,
+        "user_id": user_id,
+        "session_type": session_type,
+        "created_at": created_at or now.isoformat(),
+        "completed_at": now.isoformat(),
+        "rating": rating,
+        "notes": notes,
+        "clarity_score": clarity_score,
+        "confidence_score": confidence_score,
+        "mood": details.get("mood"),
+        "goal": details.get("goal"),
+        "voice_id": details.get("voiceId"),
+        "audio_url": details.get("audioUrl"),
+    }
+    for attempt in range(STATS_RETRIES):
+        try:
+            with get_engine().begin() as conn:
+                try:
+                    conn.execute(sessions.insert().values(**row))
+                except IntegrityError as e:
+                    raise _AlreadyRecorded() from e
+                _add_to_stats(conn, user_id, session_type, now, rating, clarity_score, confidence_score)
+            return True
+        except _AlreadyRecorded:
+            return False
+        except IntegrityError:
+            # Another completion created the user's stats row first; it exists now, so update it
+            if attempt == STATS_RETRIES - 1:
+                raise
+    return False
+
+def _add_to_stats(conn, user_id: str, session_type: str, now: datetime, rating: Optional[int],
+                  clarity_score: Optional[int], confidence_score: Optional[int]) -> None:
+    stats = conn.execute(
+        select(user_stats).where(user_stats.c.user_id == user_id).with_for_update()
+    ).first()
+    current, longest = _next_streak(stats, now.date())
+    values = {
+        "total_sessions": (stats.total_sessions if stats else 0) + 1,
+        "meditation_sessions": (stats.meditation_sessions if stats else 0) + (session_type == "meditation"),
+        "visualization_sessions": (stats.visualization_sessions if stats else 0) + (session_type == "visualization"),
+        "current_streak": current,
+        "longest_streak": longest,
+        "last_active_date": now.date().isoformat(),
+    }
+    for name, value in (("rating", rating), ("clarity", clarity_score), ("confidence", confidence_score)):
+        values[f"{name}_sum"] = (getattr(stats, f"{name}_sum") if stats else 0) + (value or 0)
+        values[f"{name}_count"] = (getattr(stats, f"{name}_count") if stats else 0) + (value is not None)
+    if stats:
+        conn.execute(user_stats.update().where(user_stats.c.user_id == user_id).values(**values))
+    else:
+        conn.execute(user_stats.insert().values(user_id=user_id, **values))
+
+def _history_item(row) -> Dict[str, Any]:
+    return {
+        "sessionId": row.session_id,
+        "sessionType": row.session_type,
+        "createdAt": row.created_at,
+        "completedAt": row.completed_at,
+        "rating": row.rating,
+        "notes": row.notes,
+        "clarityScore": row.clarity_score,
+        "confidenceScore": row.confidence_score,
+        "mood": row.mood,
+        "goal": row.goal,
+        "voiceId": row.voice_id,
+        "audioUrl": row.audio_url,
+    }
+
+def get_history(user_id: str, limit: int = 20, cursor: Optional[str] = None,
+                session_type: Optional[str] = None) -> Dict[str, Any]:
+    """One page of a user's sessions, newest first, using keyset pagination"""
+    query = select(sessions).where(sessions.c.user_id == user_id)
+    if session_type:
+        query = query.where(sessions.c.session_type == session_type)
+    if cursor:
+        created_at, session_id = decode_cursor(cursor)
+        query = query.where(or_(
+            sessions.c.created_at < created_at,
+            and_(sessions.c.created_at == created_at, sessions.c.session_id < session_id),
+        ))
+    query = query.order_by(sessions.c.created_at.desc(), sessions.c.session_id.desc()).limit(limit + 1)
+    with get_engine().connect() as conn:
+        rows = conn.execute(query).fetchall()
+    items: List[Dict[str, Any]] = [_history_item(r) for r in rows[:limit]]
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = encode_cursor(last.created_at, last.session_id)
+    return {"items": items, "nextCursor": next_cursor}
+
+def get_stats(user_id: str) -> Dict[str, Any]:
+    with get_engine().connect() as conn:
+        row = conn.execute(select(user_stats).where(user_stats.c.user_id == user_id)).first()
+
+    def average(total, count):
+        return round(total / count, 2) if count else None
+
+    if not row:
+        return {"userId": user_id, "totalSessions": 0, "meditationSessions": 0, "visualizationSessions": 0,
+                "currentStreak": 0, "longestStreak": 0, "lastActiveDate": None, "averageRating": None,
+                "averageClarityScore": None, "averageConfidenceScore": None}
+    # A streak only counts as current if the user was active today or yesterday
+    current = row.current_streak
+    if row.last_active_date and date.fromisoformat(row.last_active_date) < datetime.utcnow().date() - timedelta(days=1):
+        current = 0
+    return {
+        "userId": user_id,
+        "totalSessions": row.total_sessions,
+        "meditationSessions": row.meditation_sessions,
+        "visualizationSessions": row.visualization_sessions,
+        "currentStreak": current,
+        "longestStreak": row.longest_streak,
+        "lastActiveDate": row.last_active_date,
+        "averageRating": average(row.rating_sum, row.rating_count),
+        "averageClarityScore": average(row.clarity_sum, row.clarity_count),
+        "averageConfidenceScore": average(row.confidence_sum, row.confidence_count),
+    }
@@ -0,0 +1,224 @@
+from typing import Callable, List, Optional, Tuple
+from app.config import settings
+from app import mp3
+from app.state import get_state
+import contextvars
+import math
+import os
+import re
+import struct
+import threading
+
+PLAYLIST_NAME = "playlist.m3u8"
+# Packed-audio segments carry their start time in this ID3 PRIV frame (HLS spec, section 3.4)
+_TIMESTAMP_OWNER = b"com.apple.streaming.transportStreamTimestamp\x00"
+
+def hls_dir(name: str) -> str:
+    return os.path.join(getattr(settings, "upload_dir", "uploads"), "hls", name)
+
+def playlist_url(name: str) -> str:
+    return f"/api/audio/playlist/{name}.m3u8"
+
+def _syncsafe(size: int) -> bytes:
+    return bytes([(size >> 21) & 0x7F, (size >> 14) & 0x7F, (size >> 7) & 0x7F, size & 0x7F])
+
+def timestamp_tag(seconds: float) -> bytes:
+    """ID3v2.4 tag holding the segment's start as a 33-bit 90 kHz timestamp"""
+    payload = _TIMESTAMP_OWNER + struct.pack(">Q", round(seconds * 90000) & 0x1FFFFFFFF)
+    frame = b"PRIV" + _syncsafe(len(payload)) + b"\x00\x00" + payload
+    return b"ID3\x04\x00\x00" + _syncsafe(len(frame)) + frame
+
+def split_segments(data: bytes, target_seconds: float) -> List[Tuple[bytes, float]]:
+    """Cut an MP3 into (bytes, duration) pieces of at most target_seconds, at frame boundaries"""
+    segments = []
+    current, length = bytearray(), 0.0
+    for frame in mp3.audio_frames(data):
+        frame_seconds = frame.samples / frame.sample_rate
+        if current and length + frame_seconds > target_seconds:
+            segments.append((bytes(current), length))
+            current, length = bytearray(), 0.0
+        current += data[frame.offset:frame.offset + frame.length]
+        length += frame_seconds
+    if current:
+        segments.append((bytes(current), length))
+    return segments
+
+def _write_atomic(path: str, data: bytes) -> None:
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+    os.replace(tmp, path)
+
+class SegmentedPlaylist:
+    """An append-only (EVENT) HLS playlist of fixed-length MP3 segments.
+
+    Audio is appended as it is synthesized. Frames are buffered until a full
+    segment is available, so every segment but the last has the same length
+    regardless of how the audio was chunked. The playlist is rewritten
+    atomically after each segment, and finish() ends it with EXT-X-ENDLIST.
+    The optional listener is called with a dict for every published segment
+    and when the playlist ends.
+    """
+
+    def __init__(self, name: str, segment_seconds: Optional[float] = None,
+                 listener: Optional[Callable[[dict], None]] = None):
+        self.name = name
+        self.listener = listener
+        self.directory = hls_dir(name)
+        self.segment_seconds = segment_seconds or getattr(settings, "hls_segment_seconds", 6.0)
+        self.segments: List[Tuple[str, float]] = []
+        self.position = 0.0
+        self._pending = b""
+        os.makedirs(self.directory, exist_ok=True)
+        self._write_playlist(ended=False)
+
+    @property
+    def url(self) -> str:
+        return playlist_url(self.name)
+
+    def _add_segment(self, data: bytes, seconds: float) -> None:
+        filename = f"seg_{len(self.segments):05d}.mp3"
+        _write_atomic(os.path.join(self.directory, filename), timestamp_tag(self.position) + data)
+        self.segments.append((filename, seconds))
+        self.position += seconds
+        self._notify({"type": "segment", "index": len(self.segments) - 1,
+                      "url": f"/uploads/hls/{self.name}/{filename}", "duration": round(seconds, 3)})
+
+    def _notify(self, event: dict) -> None:
+        if self.listener:
+            try:
+                self.listener(event)
+            except Exception as e:
+                print(f"Error in playlist listener for {self.name}: {e}")
+
+    def append(self, audio: bytes) -> int:
+        """Add synthesized MP3 audio, returning how many segments were published"""
+        pieces = split_segments(self._pending + audio, self.segment_seconds)
+        self._pending = b""
+        if pieces and pieces[-1][1] < self.segment_seconds - 0.05:
+            self._pending = pieces.pop()[0]
+        for data, seconds in pieces:
+            self._add_segment(data, seconds)
+        if pieces:
+            self._write_playlist(ended=False)
+        return len(pieces)
+
+    def finish(self) -> None:
+        if self._pending:
+            self._add_segment(self._pending, mp3.duration(self._pending))
+            self._pending = b""
+        self._write_playlist(ended=True)
+        self._notify({"type": "ended", "playlistUrl": self.url, "duration": round(self.position, 3)})
+
+    def _write_playlist(self, ended: bool) -> None:
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:3",
+            f"#EXT-X-TARGETDURATION:{math.ceil(self.segment_seconds)}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+            "#EXT-X-PLAYLIST-TYPE:EVENT",
+        ]
+        for filename, seconds in self.segments:
+            # Absolute URIs, so the playlist can be served from the API while segments come from /uploads
+            lines += [f"#EXTINF:{seconds:.3f},", f"/uploads/hls/{self.name}/{filename}"]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+        _write_atomic(os.path.join(self.directory, PLAYLIST_NAME), ("\n".join(lines) + "\n").encode())
+
+def read_playlist(name: str) -> Optional[str]:
+    try:
+        with open(os.path.join(hls_dir(name), PLAYLIST_NAME)) as f:
+            return f.read()
+    except OSError:
+        return None
+
+def chunk_script(script: str, max_chars: Optional[int] = None) -> List[str]:
+    """Split a script into synthesis chunks at paragraph (then sentence) boundaries.
+
+    The first chunk is kept short so the first segment is ready quickly.
+    """
+    max_chars = max_chars or getattr(settings, "hls_chunk_chars", 1200)
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", script.strip()):
+        paragraph = " ".join(paragraph.split())
+        if len(paragraph) <= max_chars:
+            pieces.append(paragraph)
+        else:
+            pieces += re.split(r"(?<=[.!?])\s+", paragraph)
+    chunks: List[str] = []
+    for piece in filter(None, pieces):
+        limit = max_chars // 3 if len(chunks) == 1 else max_chars
+        if chunks and len(chunks[-1]) + len(piece) + 2 <= limit:
+            chunks[-1] = f"{chunks[-1]}\n\n{piece}"
+        else:
+            chunks.append(piece)
+    return chunks
+
+def synthesize_progressive(name: str, script: str, synthesize: Callable[[str], Optional[bytes]],
+                           full_path: str, first_segment_timeout: float = 60.0,
+                           listener: Optional[Callable[[dict], None]] = None,
+                           finished: Optional[threading.Event] = None) -> bool:
+    """Synthesize a script chunk by chunk into a growing playlist.
+
+    Runs in a background thread and returns once the first segment is
+    published (True), or False when the first chunk fails or misses
+    first_segment_timeout, in which case the thread stops before its next
+    chunk. When every chunk is done, the whole track is also written to
+    full_path, before the listener hears that the playlist ended.
+    `finished` is set when the thread exits, so callers can account for it.
+    """
+    first_ready = threading.Event()
+    stop = threading.Event()
+    outcome = {"ok": False}
+
+    def work():
+        try:
+            worker()
+        finally:
+            if finished is not None:
+                finished.set()
+
+    def worker():
+        playlist = SegmentedPlaylist(name, listener=listener)
+        clips = []
+        try:
+            for index, chunk in enumerate(chunk_script(script)):
+                if stop.is_set():
+                    print(f"Progressive synthesis for {name} abandoned after the first segment timed out")
+                    break
+                audio = synthesize(chunk)
+                if not audio:
+                    print(f"Progressive synthesis for {name} stopped at chunk {index}")
+                    break
+                clips.append(audio)
+                if playlist.append(audio) and not first_ready.is_set():
+                    outcome["ok"] = True
+                    first_ready.set()
+        except Exception as e:
+            print(f"Error in progressive synthesis for {name}: {e}")
+        if clips and not stop.is_set():
+            outcome["ok"] = True
+            _write_atomic(full_path, mp3.concat(clips)[0])
+        playlist.finish()
+        first_ready.set()
+
+    # Run in a copy of the request context so the chunks are metered and degraded like the request itself
+    threading.Thread(target=contextvars.copy_context().run, args=(work,), daemon=True).start()
+    if not first_ready.wait(first_segment_timeout):
+        stop.set()
+    return outcome["ok"] and not stop.is_set()
+
+def segment_file(name: str, path: str) -> Optional[str]:
+    """Playlist for an already generated MP3, written once and reused"""
+    with get_state().lock(f"hls:{name}", ttl=60, timeout=60):
+        if "#EXT-X-ENDLIST" in (read_playlist(name) or ""):
+            return playlist_url(name)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except OSError:
+            return None
+        playlist = SegmentedPlaylist(name)
+        playlist.append(data)
+        playlist.finish()
+        return playlist.url
@@ -1,15 +1,32 @@
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from app.config import settings
-from app.routers import health, meditate, visualize, audio, one_tap
+from app.routers import health, meditate, visualize, audio, one_tap, history, session_ws, traces, uploads
+from app.routers import cache_admin, metering as metering_router, profiling as profiling_router, tokens
+from app import admission, auth, capture, metering, music, profiling, tracing
 from fastapi.staticfiles import StaticFiles
 import os
+import threading
 
 app = FastAPI(title="Mindful Coach Backend MVP")
 
+class LazyCORSMiddleware(CORSMiddleware):
+    """CORS whose allowed origins are read when the middleware stack is built on the first request, not at import"""
+
+    def __init__(self, app, **kwargs):
+        super().__init__(app, allow_origins=settings.allowed_origins, **kwargs)
+
+# Added before CORS so that 503s from load shedding still carry CORS headers;
+# tracing wraps admission so shed requests are traced too
+app.add_middleware(metering.MeteringMiddleware)
+app.add_middleware(admission.AdmissionMiddleware)
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
+# Inside auth so captured records carry the caller's (hashed) identity
+app.add_middleware(capture.TrafficCaptureMiddleware)
+app.add_middleware(auth.AuthMiddleware)
 app.add_middleware(
-    CORSMiddleware,
-    allow_origins=settings.allowed_origins,
+    LazyCORSMiddleware,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
@@ -20,6 +37,14 @@ app.include_router(meditate.router, prefix="/api/meditate")
 app.include_router(visualize.router, prefix="/api/visualize")
 app.include_router(audio.router, prefix="/api/audio")
 app.include_router(one_tap.router)
+app.include_router(history.router, prefix="/api/history")
+app.include_router(session_ws.router, prefix="/api/ws")
+app.include_router(uploads.router, prefix="/api/uploads")
+app.include_router(traces.router, prefix="/api/traces")
+app.include_router(profiling_router.router, prefix="/api/admin/profile")
+app.include_router(metering_router.router, prefix="/api/admin/usage")
+app.include_router(tokens.router, prefix="/api/admin/tokens")
+app.include_router(cache_admin.router, prefix="/api/admin/cache")
 
 # Make sure the uploads directory exists
 os.makedirs("uploads", exist_ok=True)
@@ -29,4 +54,12 @@ app.mount("/uploads", StaticFiles(directory="uploads"), name="uploads")
 
 @app.on_event("startup")
 def startup_event():
-    print("Mindful Coach Backend MVP started!") 
\ No newline at end of file
+    profiling.start_loop_monitor()
+    if settings.precompute_background_beds:
+        threading.Thread(target=music.precompute_beds, daemon=True).start()
+    print("Mindful Coach Backend MVP started!")
+
+@app.on_event("shutdown")
+def shutdown_event():
+    # Counters not yet flushed would otherwise be lost with the process
+    metering.meter.flush() 
\ No newline at end of file
@@ -0,0 +1,153 @@
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional, Set, Tuple
+from app.config import settings
+from app.state import get_state
+import threading
+import time
+
+# Recorded per call; budgets are set on openai_tokens (prompt + completion) and tts_chars
+METRICS = ("openai_calls", "prompt_tokens", "completion_tokens", "tts_calls", "tts_chars")
+
+_endpoint: ContextVar[str] = ContextVar("metering_endpoint", default="background")
+
+def endpoint_for(path: str) -> str:
+    """Ledger name for a request path: /api/meditate/start -> meditate.start, /one-tap/* -> one-tap"""
+    parts = [p for p in path.split("/") if p]
+    if parts and parts[0] == "api":
+        parts = parts[1:]
+    if parts and parts[0] == "one-tap":
+        return "one-tap"
+    # Two segments at most, so ids in paths never become ledger names
+    return ".".join(parts[:2]) or "root"
+
+def current_endpoint() -> str:
+    return _endpoint.get()
+
+@contextmanager
+def attributed(endpoint: str):
+    """Charge upstream usage inside the block to `endpoint`, for background work outside a request"""
+    token = _endpoint.set(endpoint)
+    try:
+        yield
+    finally:
+        _endpoint.reset(token)
+
+def _window() -> str:
+    return time.strftime("%Y-%m-%d", time.gmtime())
+
+class Meter:
+    """Upstream usage per endpoint, counted in memory and flushed to shared state in batches.
+
+    Every OpenAI completion and ElevenLabs synthesis adds to an in-process
+    counter; a background thread adds those counters to the shared daily
+    ledger every METERING_FLUSH_SECONDS and reads back the totals of all
+    workers, so the budget check on the hot path never touches the backend.
+    """
+
+    def __init__(self):
+        self.pending: Counter = Counter()
+        self.totals: Dict[Tuple[str, str], int] = {}
+        self.window = _window()
+        self.lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+
+    def record(self, endpoint: Optional[str] = None, **amounts: int) -> None:
+        endpoint = endpoint or current_endpoint()
+        with self.lock:
+            for metric, amount in amounts.items():
+                if amount:
+                    self.pending[(endpoint, metric)] += amount
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, daemon=True)
+                self._flusher.start()
+
+    def usage(self, endpoint: str) -> Dict[str, int]:
+        """Today's usage for an endpoint across workers, including what this worker hasn't flushed yet"""
+        with self.lock:
+            return {
+                metric: self.totals.get((endpoint, metric), 0) + self.pending.get((endpoint, metric), 0)
+                for metric in METRICS
+            }
+
+    def exceeded(self, endpoint: str) -> Set[str]:
+        """Budgets (openai_tokens, tts_chars) the endpoint has used up today"""
+        budget = getattr(settings, "metering_budgets", {}).get(endpoint)
+        if not budget:
+            return set()
+        used = self.usage(endpoint)
+        used["openai_tokens"] = used["prompt_tokens"] + used["completion_tokens"]
+        return {name for name, limit in budget.items() if limit and used.get(name, 0) >= limit}
+
+    def flush(self) -> None:
+        with self.lock:
+            batch, self.pending = self.pending, Counter()
+            window = self.window
+        state = get_state()
+        try:
+            for (endpoint, metric), amount in batch.items():
+                state.incr(f"meter:{window}:{endpoint}:{metric}", amount)
+            totals = {}
+            today = _window()
+            prefix = f"meter:{today}:"
+            for key in state.scan(prefix):
+                endpoint, metric = key[len(prefix):].rsplit(":", 1)
+                totals[(endpoint, metric)] = int(state.get(key) or 0)
+        except Exception as e:
+            # Keep the batch for the next flush rather than losing it
+            print(f"Error flushing usage meter: {e}")
+            with self.lock:
+                self.pending.update(batch)
+            return
+        with self.lock:
+            self.totals = totals
+            self.window = today
+
+    def _flush_loop(self) -> None:
+        while True:
+            time.sleep(getattr(settings, "metering_flush_seconds", 10))
+            self.flush()
+
+    def report(self) -> Dict[str, dict]:
+        self.flush()
+        budgets = getattr(settings, "metering_budgets", {})
+        with self.lock:
+            endpoints = sorted({endpoint for endpoint, _ in self.totals})
+        return {
+            endpoint: {
+                "usage": self.usage(endpoint),
+                "budget": budgets.get(endpoint, {}),
+                "exceeded": sorted(self.exceeded(endpoint)),
+            }
+            for endpoint in endpoints
+        }
+
+meter = Meter()
+
+def record_completion(response) -> None:
+    usage = getattr(response, "usage", None)
+    meter.record(
+        openai_calls=1,
+        prompt_tokens=getattr(usage, "prompt_tokens", 0) or 0,
+        completion_tokens=getattr(usage, "completion_tokens", 0) or 0,
+    )
+
+def record_synthesis(text: str) -> None:
+    meter.record(tts_calls=1, tts_chars=len(text))
+
+def exceeded() -> Set[str]:
+    return meter.exceeded(current_endpoint())
+
+class MeteringMiddleware:
+    """Attribute upstream usage during a request (or WebSocket session) to its endpoint"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+        with attributed(endpoint_for(scope["path"])):
+            await self.app(scope, receive, send)
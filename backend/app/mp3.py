@@ -0,0 +1,140 @@
+from typing import Iterator, NamedTuple, Optional, Tuple
+
+# Bitrates in kbps indexed by [version_is_mpeg1][layer][bitrate_index]
+_BITRATES = {
+    (True, 1): [0, 32, 64, 96, 128, 160, 192, 224, 256, 288, 320, 352, 384, 416, 448],
+    (True, 2): [0, 32, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320, 384],
+    (True, 3): [0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320],
+    (False, 1): [0, 32, 48, 56, 64, 80, 96, 112, 128, 144, 160, 176, 192, 224, 256],
+    (False, 2): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+    (False, 3): [0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160],
+}
+
+# Sample rates indexed by version bits (0 = MPEG2.5, 2 = MPEG2, 3 = MPEG1)
+_SAMPLE_RATES = {
+    0: [11025, 12000, 8000],
+    2: [22050, 24000, 16000],
+    3: [44100, 48000, 32000],
+}
+
+class Frame(NamedTuple):
+    offset: int
+    length: int
+    samples: int
+    sample_rate: int
+    header: bytes
+
+def _id3v2_size(data: bytes) -> int:
+    """Return the size of a leading ID3v2 tag, or 0 if there is none"""
+    if len(data) < 10 or data[:3] != b"ID3":
+        return 0
+    size = (data[6] << 21) | (data[7] << 14) | (data[8] << 7) | data[9]
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+def parse_header(header: bytes) -> Optional[tuple]:
+    """Decode a 4-byte frame header into (length, samples, sample_rate)"""
+    if len(header) < 4 or header[0] != 0xFF or (header[1] & 0xE0) != 0xE0:
+        return None
+    version_bits = (header[1] >> 3) & 0x03
+    layer_bits = (header[1] >> 1) & 0x03
+    bitrate_index = (header[2] >> 4) & 0x0F
+    sample_rate_index = (header[2] >> 2) & 0x03
+    padding = (header[2] >> 1) & 0x01
+    if version_bits == 1 or layer_bits == 0 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+
+    layer = 4 - layer_bits
+    mpeg1 = version_bits == 3
+    bitrate = _BITRATES[(mpeg1, layer)][bitrate_index] * 1000
+    sample_rate = _SAMPLE_RATES[version_bits][sample_rate_index]
+
+    if layer == 1:
+        return (12 * bitrate // sample_rate + padding) * 4, 384, sample_rate
+    if layer == 3 and not mpeg1:
+        return 72 * bitrate // sample_rate + padding, 576, sample_rate
+    return 144 * bitrate // sample_rate + padding, 1152, sample_rate
+
+def iter_frames(data: bytes) -> Iterator[Frame]:
+    """Yield every audio frame in an MP3 byte string, skipping ID3 tags and junk"""
+    pos = _id3v2_size(data)
+    end = len(data)
+    if end >= 128 and data[end - 128:end - 125] == b"TAG":
+        end -= 128
+
+    while pos + 4 <= end:
+        parsed = parse_header(data[pos:pos + 4])
+        if not parsed or pos + parsed[0] > end:
+            pos += 1
+            continue
+        length, samples, sample_rate = parsed
+        yield Frame(pos, length, samples, sample_rate, data[pos:pos + 4])
+        pos += length
+
+def duration(data: bytes) -> float:
+    """Playback length of an MP3 byte string in seconds, computed by frame scanning"""
+    return sum(frame.samples / frame.sample_rate for frame in iter_frames(data))
+
+def file_duration(path: str) -> float:
+    with open(path, "rb") as f:
+        return duration(f.read())
+
+def _side_info_size(header: bytes) -> int:
+    mpeg1 = ((header[1] >> 3) & 0x03) == 3
+    mono = ((header[3] >> 6) & 0x03) == 3
+    if mpeg1:
+        return 17 if mono else 32
+    return 9 if mono else 17
+
+def is_info_frame(data: bytes, frame: Frame) -> bool:
+    """True for the Xing/Info/VBRI header frame encoders put at the start of a file"""
+    offset = frame.offset + 4 + _side_info_size(frame.header)
+    if not frame.header[1] & 0x01:
+        offset += 2  # CRC
+    tag = data[offset:offset + 4]
+    return tag in (b"Xing", b"Info") or data[frame.offset + 36:frame.offset + 40] == b"VBRI"
+
+def audio_frames(data: bytes) -> list:
+    """Frames carrying audio, without tags or the encoder's Xing/Info frame"""
+    frames = list(iter_frames(data))
+    if frames and is_info_frame(data, frames[0]):
+        frames = frames[1:]
+    return frames
+
+def silence(seconds: float, template: bytes) -> bytes:
+    """Generate silent frames matching the format of the given frame header.
+
+    A frame whose side information is all zeros has no Huffman data, so a
+    decoder outputs silence for it. Padding is cleared and CRC disabled so
+    every frame has the same length.
+    """
+    header = bytes([template[0], template[1] | 0x01, template[2] & 0xFD, template[3]])
+    parsed = parse_header(header)
+    if not parsed or seconds <= 0:
+        return b""
+    length, samples, sample_rate = parsed
+    count = round(seconds * sample_rate / samples)
+    return (header + bytes(length - 4)) * count
+
+def concat(clips: list, gaps: Optional[list] = None) -> Tuple[bytes, list]:
+    """Join MP3 clips at frame boundaries, optionally with silence after each clip.
+
+    Returns the stitched bytes and a list of (start, end) offsets in seconds
+    for each clip within the result.
+    """
+    out = bytearray()
+    offsets = []
+    position = 0.0
+    for i, clip in enumerate(clips):
+        frames = audio_frames(clip)
+        start = position
+        for frame in frames:
+            out += clip[frame.offset:frame.offset + frame.length]
+            position += frame.samples / frame.sample_rate
+        offsets.append((start, position))
+        gap = gaps[i] if gaps and i < len(gaps) else 0
+        if gap and frames:
+            padding = silence(gap, frames[0].header)
+            out += padding
+            position += sum(f.samples / f.sample_rate for f in iter_frames(padding))
+    return bytes(out), offsets
@@ -0,0 +1,274 @@
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+from app.config import settings
+from app.state import get_state
+from app import tracing
+from array import array
+import hashlib
+import math
+import os
+import random
+import shutil
+import subprocess
+import threading
+import wave
+
+# Precomputed bed lengths in seconds; a session uses the shortest bed that covers it
+BED_LENGTHS = [60, 180, 300, 600]
+
+# Ambient styles: base drone frequencies in Hz and how much filtered noise to add.
+# Frequencies are whole numbers so every voice completes in one loop period.
+BED_STYLES = {
+    "calm": {"tones": [110, 165, 220], "noise": 0.15},
+    "ocean": {"tones": [98, 147], "noise": 0.6},
+    "night": {"tones": [82, 123, 164, 246], "noise": 0.05},
+}
+
+DEFAULT_STYLE = "calm"
+BED_SAMPLE_RATE = 16000
+LOOP_SECONDS = 20
+FADE_SECONDS = 3.0
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+# ffmpeg already runs in its own process, so mixes only need a cap on how many run at once
+_mix_slots: Optional[threading.BoundedSemaphore] = None
+
+def _get_pool() -> ProcessPoolExecutor:
+    """Processes for rendering beds, which is pure-Python number crunching"""
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=getattr(settings, "music_workers", 2))
+        return _pool
+
+def _get_mix_slots() -> threading.BoundedSemaphore:
+    global _mix_slots
+    with _pool_lock:
+        if _mix_slots is None:
+            _mix_slots = threading.BoundedSemaphore(getattr(settings, "music_workers", 2))
+        return _mix_slots
+
+def beds_dir() -> str:
+    directory = os.path.join(getattr(settings, "upload_dir", "uploads"), "beds")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+def _normalize(samples: list, target_db: float) -> list:
+    """Scale samples so their RMS level matches target_db (dBFS), without clipping"""
+    rms = math.sqrt(sum(s * s for s in samples) / max(len(samples), 1))
+    if rms == 0:
+        return samples
+    gain = (10 ** (target_db / 20)) / rms
+    peak = max(abs(s) for s in samples) * gain
+    if peak > 0.99:
+        gain *= 0.99 / peak
+    return [s * gain for s in samples]
+
+def _render_loop(style: str, sample_rate: int) -> list:
+    """Synthesize one seamless loop of an ambient bed"""
+    spec = BED_STYLES[style]
+    rng = random.Random(style)
+    count = LOOP_SECONDS * sample_rate
+    crossfade = sample_rate // 2
+    loop = []
+    smoothed = 0.0
+    for n in range(count + crossfade):
+        t = n / sample_rate
+        swell = 0.6 + 0.4 * math.sin(2 * math.pi * t / LOOP_SECONDS)
+        value = sum(math.sin(2 * math.pi * f * t) / (i + 1) for i, f in enumerate(spec["tones"]))
+        # One-pole low-pass turns white noise into a soft wash
+        smoothed += 0.02 * (rng.uniform(-1, 1) - smoothed)
+        wash = 0.5 + 0.5 * math.sin(2 * math.pi * 2 * t / LOOP_SECONDS)
+        loop.append(value * swell + smoothed * 8 * spec["noise"] * wash)
+    # Blend the overrun into the head so the loop point does not click
+    for n in range(crossfade):
+        w = n / crossfade
+        loop[n] = loop[n] * w + loop[count + n] * (1 - w)
+    return loop[:count]
+
+def _render_bed(path: str, style: str, length: int, level_db: float) -> str:
+    """Process-pool worker: write a loudness-normalized bed of the given length"""
+    loop = _normalize(_render_loop(style, BED_SAMPLE_RATE), level_db)
+    total = length * BED_SAMPLE_RATE
+    fade = int(FADE_SECONDS * BED_SAMPLE_RATE)
+    pcm = array("h")
+    for n in range(total):
+        gain = min(1.0, n / fade, (total - n) / fade)
+        pcm.append(int(loop[n % len(loop)] * gain * 32767))
+    tmp_path = path + ".tmp"
+    with wave.open(tmp_path, "wb") as w:
+        w.setnchannels(1)
+        w.setsampwidth(2)
+        w.setframerate(BED_SAMPLE_RATE)
+        w.writeframes(pcm.tobytes())
+    os.replace(tmp_path, path)
+    return path
+
+def _mix(voice_path: str, bed_path: str, out_path: str, bed_level_db: float) -> Optional[str]:
+    """Loudness-normalize voice and bed with ffmpeg, then lay the bed underneath"""
+    filters = (
+        "[0:a]loudnorm=I=-16:TP=-1.5:LRA=11[voice];"
+        f"[1:a]loudnorm=I={bed_level_db}:TP=-12[bed];"
+        "[voice][bed]amix=inputs=2:duration=first:normalize=0[out]"
+    )
+    tmp_path = out_path + ".tmp.mp3"
+    result = subprocess.run(
+        ["ffmpeg", "-y", "-loglevel", "error", "-i", voice_path, "-stream_loop", "-1", "-i", bed_path,
+         "-filter_complex", filters, "-map", "[out]", "-codec:a", "libmp3lame", "-b:a", "128k", tmp_path],
+        capture_output=True,
+    )
+    if result.returncode != 0:
+        print(f"ffmpeg mix failed: {result.stderr.decode(errors='ignore')[:500]}")
+        return None
+    os.replace(tmp_path, out_path)
+    return out_path
+
+class SunoClient:
+    """Fetches generated ambient tracks from Suno; without an API key it renders beds locally"""
+
+    def __init__(self, api_key: str, base_url: str):
+        self.api_key = api_key
+        self.base_url = base_url
+
+    def generate_bed(self, path: str, style: str, length: int) -> Optional[str]:
+        if not self.api_key:
+            return None
+        import requests
+
+        try:
+            response = requests.post(
+                f"{self.base_url}/generate",
+                json={"prompt": f"{style} ambient meditation background, no vocals", "duration": length,
+                      "instrumental": True},
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                timeout=120,
+            )
+            if response.status_code != 200:
+                print(f"Suno API error: {response.status_code} - {response.text[:500]}")
+                return None
+            audio = requests.get(response.json()["audio_url"], timeout=120)
+            if audio.status_code != 200:
+                return None
+            with open(path, "wb") as f:
+                f.write(audio.content)
+            return path
+        except Exception as e:
+            print(f"Error generating bed with Suno: {e}")
+            return None
+
+_suno: Optional[SunoClient] = None
+
+def get_suno_client() -> SunoClient:
+    global _suno
+    if _suno is None:
+        _suno = SunoClient(settings.suno_api_key, settings.suno_base_url)
+    return _suno
+
+def bed_length_for(duration: float) -> int:
+    for length in BED_LENGTHS:
+        if length >= duration:
+            return length
+    return BED_LENGTHS[-1]
+
+def _fetch_from_suno(style: str, length: int) -> Optional[str]:
+    """Generate a bed with Suno, trying each bed at most once an hour; None without an API key"""
+    if not get_suno_client().api_key:
+        return None
+    name = f"{style}_{length}"
+    state = get_state()
+    if state.get(f"suno_attempt:{name}"):
+        return None
+    state.set(f"suno_attempt:{name}", "1", ttl=3600)
+    return get_suno_client().generate_bed(os.path.join(beds_dir(), f"{name}.mp3"), style, length)
+
+def get_bed(style: str, length: int) -> Optional[str]:
+    """Path of a bed: a Suno track when one has been generated, else one rendered locally on first use.
+
+    A request that finds only the rendered bed uses it and has the Suno
+    track fetched in the background, so it never waits on Suno.
+    """
+    if style not in BED_STYLES or length not in BED_LENGTHS:
+        return None
+    directory = beds_dir()
+    generated = os.path.join(directory, f"{style}_{length}.mp3")
+    rendered = os.path.join(directory, f"{style}_{length}.wav")
+    if os.path.exists(generated):
+        return generated
+    if os.path.exists(rendered):
+        if get_suno_client().api_key:
+            threading.Thread(target=_fetch_from_suno, args=(style, length), daemon=True).start()
+        return rendered
+    if _fetch_from_suno(style, length):
+        return generated
+    try:
+        return _render_once(rendered, style, length)
+    except Exception as e:
+        print(f"Error rendering background bed {style}_{length}: {e}")
+        return None
+
+def _render_once(path: str, style: str, length: int) -> str:
+    """Render a bed unless it exists; the lock is shared by every worker, so each bed is rendered only once"""
+    with get_state().lock(f"bed:{os.path.basename(path)}", ttl=120, timeout=120):
+        if os.path.exists(path):
+            return path
+        level = getattr(settings, "background_music_level_db", -30.0)
+        return _get_pool().submit(_render_bed, path, style, length, level).result()
+
+def precompute_beds(styles: Optional[list] = None) -> None:
+    """Prepare every (style, length) bed ahead of time: from Suno when configured, else rendered.
+
+    Off by default (PRECOMPUTE_BACKGROUND_BEDS), since beds are rendered on
+    first use anyway and music is opt-in; worth it only on a long-lived
+    deployment where most sessions ask for music.
+    """
+    directory = beds_dir()
+    for style in styles or BED_STYLES:
+        for length in BED_LENGTHS:
+            path = os.path.join(directory, f"{style}_{length}.wav")
+            if os.path.exists(path[:-4] + ".mp3") or _fetch_from_suno(style, length):
+                continue
+            try:
+                _render_once(path, style, length)
+            except Exception as e:
+                print(f"Error rendering background bed {style}_{length}: {e}")
+
+def to_url(path: str) -> str:
+    upload_dir = getattr(settings, "upload_dir", "uploads")
+    return "/uploads/" + os.path.relpath(path, upload_dir).replace(os.sep, "/")
+
+@tracing.traced()
+def mix_with_bed(voice_url: str, duration: float, style: str = DEFAULT_STYLE) -> tuple:
+    """Mix a bed under a generated voice track.
+
+    Returns (audio_url, bed_url). Mixed outputs are cached by (voice asset,
+    bed, duration). When ffmpeg is not installed the voice track is returned
+    unchanged with the bed URL, so the client can play them together.
+    """
+    bed = get_bed(style, bed_length_for(duration))
+    if not bed:
+        return voice_url, ""
+    bed_url = to_url(bed)
+    upload_dir = getattr(settings, "upload_dir", "uploads")
+    voice_path = os.path.join(upload_dir, voice_url.rsplit("/", 1)[-1])
+    if not os.path.exists(voice_path) or not ffmpeg_available():
+        return voice_url, bed_url
+
+    key = hashlib.sha1(f"{os.path.basename(voice_path)}|{os.path.basename(bed)}|{int(duration)}".encode()).hexdigest()
+    out_path = os.path.join(upload_dir, f"mix_{key[:20]}.mp3")
+    if os.path.exists(out_path):
+        return to_url(out_path), bed_url
+    level = getattr(settings, "background_music_level_db", -30.0)
+    with get_state().lock(f"mix:{os.path.basename(out_path)}", ttl=300, timeout=300):
+        if os.path.exists(out_path):
+            return to_url(out_path), bed_url
+        try:
+            with _get_mix_slots():
+                mixed = _mix(voice_path, bed, out_path, level)
+        except Exception as e:
+            print(f"Error mixing background music: {e}")
+            mixed = None
+    return (to_url(mixed) if mixed else voice_url), bed_url
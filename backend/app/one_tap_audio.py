@@ -0,0 +1,220 @@
+from typing import Dict, List, Optional, Tuple
+from app.config import settings
+from app import mp3
+from app.tts import synthesize_speech
+from app.state import get_state
+from app import assets, tracing, tts
+import json
+import os
+
+# Minutes of a user's quota one synthesized step costs, whether requested or prefetched
+STEP_COST_MINUTES = 0.5
+
+# (sessionType, voiceId) -> list of step timings, loaded from shared state or disk on first use
+_timing_index: Dict[Tuple[str, str], List[dict]] = {}
+
+def upload_dir() -> str:
+    directory = getattr(settings, "upload_dir", "uploads")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def safe_voice(voice_id: str) -> str:
+    return voice_id.replace("/", "_")
+
+def _provider_suffix(provider: Optional[str]) -> str:
+    """Clips from a fallback provider are kept apart, so they never stand in for the primary voice"""
+    return "" if provider in (None, tts.primary_provider()) else f"__{provider}"
+
+def step_filename(session_type: str, step_index: int, voice_id: str, provider: Optional[str] = None) -> str:
+    return f"{session_type}_{step_index}_{safe_voice(voice_id)}{_provider_suffix(provider)}.mp3"
+
+def full_filename(session_type: str, voice_id: str, provider: Optional[str] = None) -> str:
+    return f"{session_type}_full_{safe_voice(voice_id)}{_provider_suffix(provider)}.mp3"
+
+def timing_filename(session_type: str, voice_id: str) -> str:
+    return f"{session_type}_timing_{safe_voice(voice_id)}.json"
+
+def asset_path(filename: str) -> str:
+    return os.path.join(upload_dir(), filename)
+
+def build_timing_index(session_type: str, voice_id: str, steps: List[str]) -> Optional[List[dict]]:
+    """Compute each step's start/end offset within the full-session mp3.
+
+    Offsets come from frame-scanned durations of the cached step clips, scaled
+    to the length of the full track. Steps without a cached clip are estimated
+    from their share of the script's characters.
+    """
+    full_path = asset_path(full_filename(session_type, voice_id))
+    if not os.path.exists(full_path):
+        return None
+    total = mp3.file_duration(full_path)
+    if total <= 0:
+        return None
+
+    measured: List[Optional[float]] = []
+    for i in range(len(steps)):
+        step_path = asset_path(step_filename(session_type, i, voice_id))
+        measured.append(mp3.file_duration(step_path) if os.path.exists(step_path) else None)
+
+    known_chars = sum(len(steps[i]) for i, d in enumerate(measured) if d)
+    known_seconds = sum(d for d in measured if d)
+    if known_chars:
+        seconds_per_char = known_seconds / known_chars
+    else:
+        seconds_per_char = total / max(sum(len(s) for s in steps), 1)
+    durations = [d if d else len(steps[i]) * seconds_per_char for i, d in enumerate(measured)]
+    scale = total / max(sum(durations), 1e-6)
+
+    timings = []
+    start = 0.0
+    for i, step_duration in enumerate(durations):
+        end = start + step_duration * scale
+        timings.append({
+            "stepIndex": i,
+            "text": steps[i],
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "duration": round(end - start, 3),
+            "estimated": measured[i] is None,
+        })
+        start = end
+
+    return _store_timing_index(session_type, voice_id, timings)
+
+def _store_timing_index(session_type: str, voice_id: str, timings: List[dict]) -> List[dict]:
+    with open(asset_path(timing_filename(session_type, voice_id)), "w") as f:
+        json.dump(timings, f)
+    get_state().set_json(f"timing:{session_type}:{voice_id}", timings)
+    _timing_index[(session_type, voice_id)] = timings
+    return timings
+
+def forget_timing_index(session_type: str, voice_id: str) -> None:
+    """Drop the timing index after its track was purged, so the next stitch measures it again"""
+    _timing_index.pop((session_type, voice_id), None)
+    get_state().delete(f"timing:{session_type}:{voice_id}")
+
+def get_timing_index(session_type: str, voice_id: str) -> Optional[List[dict]]:
+    key = (session_type, voice_id)
+    if key in _timing_index:
+        return _timing_index[key]
+    shared = get_state().get_json(f"timing:{session_type}:{voice_id}")
+    if shared is not None:
+        _timing_index[key] = shared
+        return shared
+    path = asset_path(timing_filename(session_type, voice_id))
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path) as f:
+            _timing_index[key] = json.load(f)
+    except Exception as e:
+        print(f"Error loading timing index {path}: {e}")
+        return None
+    return _timing_index[key]
+
+def clip_provider(path: str) -> str:
+    """The TTS provider a cached clip or track was synthesized with, read from its filename"""
+    stem = os.path.basename(path).rsplit(".", 1)[0]
+    return stem.rsplit("__", 1)[1] if "__" in stem else tts.primary_provider()
+
+def _fallback_clip(session_type: str, step_index: int, voice_id: str) -> Optional[str]:
+    """An existing clip from the provider that would be used now, while the primary is unavailable"""
+    provider = tts.preferred_provider()
+    if provider in (None, tts.primary_provider()):
+        return None
+    path = asset_path(step_filename(session_type, step_index, voice_id, provider))
+    return path if os.path.exists(path) else None
+
+@tracing.traced()
+def ensure_step_clip(session_type: str, step_index: int, voice_id: str, text: str,
+                     hedge: bool = False) -> Optional[str]:
+    """Return the path of a cached step clip, synthesizing it only if it is missing.
+
+    The clip is stored under the filename of the provider that spoke it
+    (see step_filename), so the returned path may be a fallback provider's
+    clip; callers build URLs from it rather than from step_filename.
+    A fallback clip is only reused while the primary provider is still
+    unavailable. hedge=True when a listener is waiting on this clip rather
+    than prefetch.
+    """
+    filename = step_filename(session_type, step_index, voice_id)
+    path = asset_path(filename)
+    if os.path.exists(path):
+        return path
+    # Concurrent requests for the same clip wait for one synthesis instead of each paying for it
+    with get_state().lock(f"tts:{filename}"):
+        existing = path if os.path.exists(path) else _fallback_clip(session_type, step_index, voice_id)
+        if existing:
+            return existing
+        audio = synthesize_speech(text, voice_id, hedge=hedge)
+        if not audio:
+            return None
+        provider = (tts.last_synthesis() or {}).get("provider")
+        filename = step_filename(session_type, step_index, voice_id, provider)
+        path = asset_path(filename)
+        with tracing.span("disk.write", bytes=len(audio)):
+            with open(path + ".tmp", "wb") as f:
+                f.write(audio)
+            os.replace(path + ".tmp", path)
+        assets.record(filename, sessionType=session_type, voiceId=voice_id, stepIndex=step_index)
+    return path
+
+@tracing.traced()
+def stitch_full_track(session_type: str, voice_id: str, steps: List[str]) -> Optional[Tuple[str, List[dict]]]:
+    """Build the full-session mp3 by concatenating the cached step clips; returns its filename and step timings.
+
+    Only steps without a cached clip are synthesized. Steps are joined
+    at frame boundaries with generated silence between them, so the step
+    offsets in the timing index are exact. All clips must come from one
+    provider: a track from a fallback provider gets its own filename and is
+    not stored in the timing index, which describes the primary track.
+    """
+    with get_state().lock(f"stitch:{full_filename(session_type, voice_id)}"):
+        existing = get_timing_index(session_type, voice_id)
+        if existing and os.path.exists(asset_path(full_filename(session_type, voice_id))):
+            return full_filename(session_type, voice_id), existing
+        return _stitch(session_type, voice_id, steps)
+
+def _stitch(session_type: str, voice_id: str, steps: List[str]) -> Optional[Tuple[str, List[dict]]]:
+    paths = []
+    for i, text in enumerate(steps):
+        path = ensure_step_clip(session_type, i, voice_id, text)
+        if not path:
+            print(f"Could not synthesize step {i} of {session_type} for voice {voice_id}")
+            return None
+        paths.append(path)
+    providers = {clip_provider(path) for path in paths}
+    if len(providers) > 1:
+        print(f"Not stitching {session_type} for voice {voice_id}: steps come from {', '.join(sorted(providers))}")
+        return None
+    provider = providers.pop()
+    clips = []
+    for path in paths:
+        with open(path, "rb") as f:
+            clips.append(f.read())
+
+    pause = getattr(settings, "one_tap_pause_seconds", 1.5)
+    audio, offsets = mp3.concat(clips, gaps=[pause] * (len(clips) - 1))
+    if not audio:
+        return None
+    filename = full_filename(session_type, voice_id, provider)
+    full_path = asset_path(filename)
+    with open(full_path + ".tmp", "wb") as f:
+        f.write(audio)
+    os.replace(full_path + ".tmp", full_path)
+    assets.record(filename, sessionType=session_type, voiceId=voice_id, provider=provider)
+
+    timings = [
+        {
+            "stepIndex": i,
+            "text": steps[i],
+            "start": round(start, 3),
+            "end": round(end, 3),
+            "duration": round(end - start, 3),
+            "estimated": False,
+        }
+        for i, (start, end) in enumerate(offsets)
+    ]
+    if filename != full_filename(session_type, voice_id):
+        return filename, timings
+    return filename, _store_timing_index(session_type, voice_id, timings)
@@ -0,0 +1,157 @@
+from typing import Dict, List, Optional, Set
+from app.config import settings
+from app.state import get_state
+from app import admission, auth, fairness, metering, one_tap_audio
+import itertools
+import os
+import queue
+import threading
+import time
+
+METRICS = ("hit", "miss", "cached", "queued", "synthesized", "cancelled", "over_quota")
+
+def _count(name: str, amount: int = 1) -> None:
+    get_state().incr(f"metrics:prefetch:{name}", amount)
+
+class StepPrefetcher:
+    """Synthesizes upcoming one-tap steps in the background before they are requested.
+
+    When step N is requested, steps N+1..N+k are queued for the same
+    (sessionType, voice). Nearer steps are synthesized first, and a small
+    dedicated worker pool keeps prefetch from competing with on-demand
+    requests. Queued steps are dropped when their session is stopped or
+    has been idle too long. Clips are cached per (sessionType, voice), so a
+    step prefetched for one session also serves every later one. Each
+    prefetched step is charged to the quota of the user whose request
+    queued it, and is dropped once that quota is used up.
+    """
+
+    def __init__(self, workers: int = 1):
+        self.queue: "queue.PriorityQueue" = queue.PriorityQueue()
+        self.order = itertools.count()
+        self.last_seen: Dict[str, float] = {}
+        self.stopped: Dict[str, float] = {}
+        self.pending: Dict[str, str] = {}  # clip filename -> session that queued it
+        self.in_flight: Set[str] = set()  # clip filenames already charged for and being synthesized
+        self.lock = threading.Lock()
+        self.pruned_at = time.time()
+        for _ in range(workers):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def _active(self, session_id: str) -> bool:
+        idle = getattr(settings, "one_tap_prefetch_idle_seconds", 90)
+        with self.lock:
+            if session_id in self.stopped:
+                return False
+            return time.time() - self.last_seen.get(session_id, 0) <= idle
+
+    def touch(self, session_id: str) -> None:
+        now = time.time()
+        with self.lock:
+            self.last_seen[session_id] = now
+            self.stopped.pop(session_id, None)
+            # Sessions idle past the window can't prefetch anymore; forget them so the dict stays small
+            idle = getattr(settings, "one_tap_prefetch_idle_seconds", 90)
+            if now - self.pruned_at > idle:
+                self.pruned_at = now
+                for key in [k for k, t in self.last_seen.items() if now - t > idle]:
+                    del self.last_seen[key]
+
+    def stop(self, session_id: str) -> None:
+        """Drop everything still queued for an abandoned session"""
+        with self.lock:
+            self.stopped[session_id] = time.time()
+            self.last_seen.pop(session_id, None)
+            # Forget stops older than an hour so the dict stays small
+            cutoff = time.time() - 3600
+            for key in [k for k, t in self.stopped.items() if t < cutoff]:
+                del self.stopped[key]
+
+    def schedule(self, session_id: str, session_type: str, voice_id: str, steps: List[str], step_index: int) -> int:
+        """Queue the k steps after step_index that have no cached clip yet; returns how many were queued"""
+        self.touch(session_id)
+        if admission.level() > admission.NORMAL:
+            return 0
+        depth = getattr(settings, "one_tap_prefetch_steps", 2)
+        # Who pays for the prefetched steps: the worker thread has no request context of its own
+        payer = None if fairness.is_exempt() else (auth.current_identity(), auth.current_address())
+        queued = 0
+        for index in range(step_index + 1, min(step_index + 1 + depth, len(steps))):
+            filename = one_tap_audio.step_filename(session_type, index, voice_id)
+            with self.lock:
+                if filename in self.pending or os.path.exists(one_tap_audio.asset_path(filename)):
+                    continue
+                self.pending[filename] = session_id
+            self.queue.put((index - step_index, next(self.order), session_id, session_type, index, voice_id,
+                            steps[index], payer))
+            queued += 1
+        if queued:
+            _count("queued", queued)
+        return queued
+
+    def is_pending(self, filename: str) -> bool:
+        with self.lock:
+            return filename in self.pending
+
+    def is_in_flight(self, filename: str) -> bool:
+        """True while a prefetch someone has paid for is synthesizing this clip"""
+        with self.lock:
+            return filename in self.in_flight
+
+    def _work(self) -> None:
+        while True:
+            _, _, session_id, session_type, index, voice_id, text, payer = self.queue.get()
+            filename = one_tap_audio.step_filename(session_type, index, voice_id)
+            try:
+                if not self._active(session_id) or admission.overall_level() > admission.NORMAL:
+                    _count("cancelled")
+                    continue
+                if os.path.exists(one_tap_audio.asset_path(filename)):
+                    continue
+                if payer and not fairness.charge_quota(payer[0], one_tap_audio.STEP_COST_MINUTES, address=payer[1]):
+                    _count("over_quota")
+                    continue
+                with self.lock:
+                    self.in_flight.add(filename)
+                with metering.attributed("one-tap"):
+                    clip = one_tap_audio.ensure_step_clip(session_type, index, voice_id, text)
+                if clip:
+                    get_state().set(f"prefetched:{filename}", "1", ttl=86400)
+                    _count("synthesized")
+            except Exception as e:
+                print(f"Error prefetching {filename}: {e}")
+            finally:
+                with self.lock:
+                    self.pending.pop(filename, None)
+                    self.in_flight.discard(filename)
+                self.queue.task_done()
+
+    def record_request(self, filename: str) -> str:
+        """Classify a step request for the hit-rate metrics: hit, miss or cached"""
+        if get_state().get(f"prefetched:{filename}") or self.is_pending(filename):
+            get_state().delete(f"prefetched:{filename}")
+            outcome = "hit"
+        elif os.path.exists(one_tap_audio.asset_path(filename)):
+            outcome = "cached"
+        else:
+            outcome = "miss"
+        _count(outcome)
+        return outcome
+
+def metrics() -> Dict[str, object]:
+    state = get_state()
+    counts = {name: int(state.get(f"metrics:prefetch:{name}") or 0) for name in METRICS}
+    served = counts["hit"] + counts["miss"]
+    counts["hitRate"] = round(counts["hit"] / served, 4) if served else None
+    counts["queueDepth"] = get_prefetcher().queue.qsize() if _prefetcher else 0
+    return counts
+
+_prefetcher: Optional[StepPrefetcher] = None
+_prefetcher_lock = threading.Lock()
+
+def get_prefetcher() -> StepPrefetcher:
+    global _prefetcher
+    with _prefetcher_lock:
+        if _prefetcher is None:
+            _prefetcher = StepPrefetcher(getattr(settings, "one_tap_prefetch_workers", 1))
+        return _prefetcher
@@ -0,0 +1,225 @@
+from collections import Counter, deque
+from typing import Optional
+from app.config import settings
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+import tracemalloc
+
+def _label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+def collapse(weights: Counter) -> str:
+    """Render stack weights in the collapsed format flamegraph.pl and speedscope read"""
+    return "".join(f"{stack} {weight}\n" for stack, weight in weights.most_common() if weight > 0)
+
+class ProfileSession:
+    """Sampled stacks and allocation growth for the next N requests to one route.
+
+    A sampler thread records the stack of every thread currently inside the
+    route's endpoint at a fixed interval (wall clock, so time blocked on
+    upstream calls shows up too). With allocations on, tracemalloc runs for
+    the session and the growth between its first and last request is
+    reported by allocating stack. tracemalloc is process-wide, so
+    concurrent requests to other routes can show up there.
+    """
+
+    def __init__(self, route, requests: int, interval_ms: float, allocations: bool):
+        self.path = route.path
+        self.path_regex = route.path_regex
+        endpoint = route.endpoint
+        # Decorated endpoints (response cache, fair share) are matched by the function they wrap:
+        # the wrappers' code is shared by every decorated route, so matching it would sample those too
+        while getattr(endpoint, "__wrapped__", None) is not None:
+            endpoint = endpoint.__wrapped__
+        self.code = endpoint.__code__
+        self.requests = requests
+        self.interval = interval_ms / 1000
+        self.allocations = allocations
+        self.started = 0
+        self.finished = 0
+        self.in_flight = 0
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+        self.memory: Counter = Counter()
+        self.status = "waiting"
+        self.created_at = time.time()
+        self._baseline = None
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def matches(self, path: str) -> bool:
+        return self.status in ("waiting", "running") and bool(self.path_regex.match(path))
+
+    def claim(self) -> bool:
+        """Count a matching request towards the session; False once N have started"""
+        with self._lock:
+            if self.started >= self.requests or self.status not in ("waiting", "running"):
+                return False
+            self.started += 1
+            self.in_flight += 1
+            if self.status == "waiting":
+                self.status = "running"
+                if self.allocations:
+                    if not tracemalloc.is_tracing():
+                        tracemalloc.start(25)
+                    self._baseline = tracemalloc.take_snapshot()
+                threading.Thread(target=self._sample, daemon=True).start()
+            return True
+
+    def release(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+            self.finished += 1
+            if self.finished >= self.requests:
+                self._complete("done")
+
+    def cancel(self) -> None:
+        with self._lock:
+            if self.status in ("waiting", "running"):
+                self._complete("cancelled")
+
+    def _complete(self, status: str) -> None:
+        if self._baseline is not None:
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            for stat in snapshot.compare_to(self._baseline, "traceback"):
+                if stat.size_diff > 0:
+                    stack = ";".join(f"{f.filename.rsplit(os.sep, 1)[-1]}:{f.lineno}" for f in stat.traceback)
+                    self.memory[stack] += stat.size_diff
+            self._baseline = None
+        self.status = status
+        self._done.set()
+
+    def _sample(self) -> None:
+        while not self._done.wait(self.interval):
+            if not self.in_flight:
+                continue
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == threading.get_ident():
+                    continue
+                stack = []
+                inside = False
+                while frame is not None:
+                    stack.append(frame.f_code)
+                    if frame.f_code is self.code:
+                        inside = True
+                        break
+                    frame = frame.f_back
+                if inside:
+                    self.samples[";".join(_label(code) for code in reversed(stack))] += 1
+                    self.sample_count += 1
+
+    def summary(self) -> dict:
+        return {
+            "path": self.path,
+            "status": self.status,
+            "requests": self.requests,
+            "started": self.started,
+            "finished": self.finished,
+            "intervalMs": round(self.interval * 1000, 2),
+            "samples": self.sample_count,
+            "allocations": self.allocations,
+            "allocatedBytes": sum(self.memory.values()),
+        }
+
+_session: Optional[ProfileSession] = None
+
+def start_session(app, path: str, requests: int, interval_ms: float, allocations: bool) -> ProfileSession:
+    global _session
+    if _session and _session.status in ("waiting", "running"):
+        raise RuntimeError("A profiling session is already running")
+    route = next((r for r in app.routes if getattr(r, "path", None) == path and hasattr(r, "endpoint")), None)
+    if route is None:
+        raise LookupError(f"No route {path}")
+    _session = ProfileSession(route, requests, interval_ms, allocations)
+    return _session
+
+def get_session() -> Optional[ProfileSession]:
+    return _session
+
+class ProfilingMiddleware:
+    """Hands matching requests to the active profiling session; costs one attribute check otherwise"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        session = _session
+        if scope["type"] != "http" or session is None or not session.matches(scope["path"]) or not session.claim():
+            await self.app(scope, receive, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            session.release()
+
+class LoopLagMonitor:
+    """Reports when synchronous code blocks the event loop.
+
+    A coroutine bumps a heartbeat every tick; a watchdog thread notices when
+    the heartbeat goes stale and captures what the loop thread is running at
+    that moment, which is the blocking call itself.
+    """
+
+    def __init__(self, threshold_ms: float, tick: float = 0.05):
+        self.threshold = threshold_ms / 1000
+        self.tick = tick
+        self.heartbeat = time.monotonic()
+        self.loop_thread: Optional[int] = None
+        self.events: deque = deque(maxlen=50)
+        self.stalls = 0
+        self.max_lag_ms = 0.0
+
+    async def _beat(self) -> None:
+        self.loop_thread = threading.get_ident()
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.tick)
+
+    def _watch(self) -> None:
+        stalled: Optional[dict] = None
+        while True:
+            time.sleep(self.tick)
+            lag = time.monotonic() - self.heartbeat - self.tick
+            if lag >= self.threshold and stalled is None:
+                frame = sys._current_frames().get(self.loop_thread)
+                stalled = {
+                    "at": time.time(),
+                    "since": self.heartbeat,
+                    "stack": "".join(traceback.format_stack(frame)[-8:]) if frame else "",
+                }
+            elif lag < self.threshold and stalled is not None:
+                stalled["lagMs"] = round((self.heartbeat - stalled.pop("since") - self.tick) * 1000, 1)
+                self.max_lag_ms = max(self.max_lag_ms, stalled["lagMs"])
+                self.stalls += 1
+                self.events.append(stalled)
+                print(f"Event loop blocked for {stalled['lagMs']}ms in:\n{stalled['stack']}")
+                stalled = None
+
+    def start(self) -> None:
+        asyncio.get_running_loop().create_task(self._beat())
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def report(self) -> dict:
+        return {
+            "thresholdMs": self.threshold * 1000,
+            "stalls": self.stalls,
+            "maxLagMs": self.max_lag_ms,
+            "recent": list(reversed(self.events)),
+        }
+
+_monitor: Optional[LoopLagMonitor] = None
+
+def start_loop_monitor() -> None:
+    """Called from the startup hook, on the event loop"""
+    global _monitor
+    if _monitor is None and getattr(settings, "loop_lag_monitor", True):
+        _monitor = LoopLagMonitor(getattr(settings, "loop_lag_threshold_ms", 100))
+        _monitor.start()
+
+def loop_lag_report() -> Optional[dict]:
+    return _monitor.report() if _monitor else None
@@ -0,0 +1,216 @@
+from typing import Any, Dict, List, Optional
+from app.config import settings
+from app import tracing
+import math
+import re
+
+# Prompt templates for every LLM call, with the input-token budget each
+# rendered user prompt must fit in. Free-text answers are compacted to fit.
+PROMPTS = {
+    "meditation_question": {
+        "budget": 700,
+        "system": "You are a meditation expert who asks thoughtful, personalized questions to understand a person's meditation needs.",
+        "user": """You are a meditation coach conducting an intake session. The user feels {mood}.
+
+{context}
+
+Current question number: {question_number} of 5
+
+Generate the next personalized question for meditation intake. The question should:
+- Be relevant to their mood: {mood}
+- Build upon their previous answers
+- Help understand their meditation needs
+- Be conversational and empathetic
+
+Return only the question text, nothing else.""",
+    },
+    "meditation_script": {
+        "budget": 1500,
+        "system": "You are a meditation expert who creates deeply personalized, calming meditation scripts that address specific user needs and emotions.",
+        "user": """Create a {minutes}-minute personalized meditation script for someone feeling {mood}.
+
+{context}
+
+The script should be:
+- Deeply personalized based on their mood ({mood}) and all their answers
+- Include specific references to their stressors, body tension, and desired outcomes
+- Use calming, soothing language that matches their emotional state
+- Include breathing guidance and relaxation techniques
+- Written in a conversational, empathetic tone
+- About {words} words, which is {minutes} minutes when spoken at a calm pace
+- Include natural pauses for breathing (indicated by "...")
+- Address their specific needs mentioned in the intake
+
+Make it feel like you truly understand their situation and are speaking directly to them.
+Return only the meditation script text.""",
+    },
+    "visualization_question": {
+        "budget": 700,
+        "system": "You are a visualization expert who asks thoughtful, personalized questions to help people achieve their goals.",
+        "user": """You are a visualization coach conducting a goal-setting session.
+
+Goal: {goal}
+Category: {category}
+Complexity: {complexity}
+User Experience: {experience}
+Current Question: {question_number} of 5
+
+{context}
+
+Generate the next personalized question that:
+- Builds upon previous answers
+- Is appropriate for {experience} level
+- Helps identify challenges or solutions
+- Moves toward creating a vivid visualization
+
+Return only the question text.""",
+    },
+    "visualization_script": {
+        "budget": 1500,
+        "system": "You are a visualization expert who creates deeply personalized, vivid visualization scripts that help people achieve their goals and overcome challenges.",
+        "user": """Create a {session_type} visualization script for someone with a {complexity} goal: {goal}
+
+{context}
+{challenges}
+
+The script should be:
+- Deeply personalized based on their goal and answers
+- Address specific challenges they've identified
+- Include vivid sensory details (sight, sound, touch, emotion)
+- Use calming, motivational language
+- Include specific action steps within the visualization
+- Written for {experience} level
+- About {words} words, which is {minutes} minutes when spoken
+- Include natural pauses for reflection (indicated by "...")
+
+Make it feel like a personal coaching session that guides them to their goal.
+Return only the visualization script text.""",
+    },
+}
+
+# Longest a single free-text field (goal, mood, challenge list) may be
+FIELD_TOKEN_CAP = 150
+# Answers given most recently are kept verbatim as long as possible
+RECENT_ANSWERS = 2
+OLDER_ANSWER_TOKENS = (60, 20)
+# Words of the script so far that a continuation part is shown
+CONTINUATION_CONTEXT_WORDS = 250
+
+_encoding = None
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+
+            _encoding = tiktoken.encoding_for_model(settings.openai_model)
+        except Exception:
+            _encoding = False
+    return _encoding
+
+def count_tokens(text: str) -> int:
+    """Token count from tiktoken when installed, else the ~4 characters per token rule of thumb"""
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text))
+    return math.ceil(len(text) / 4)
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text to at most max_tokens, at a word boundary, marking the cut with an ellipsis"""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding:
+        head = encoding.decode(encoding.encode(text)[:max(max_tokens - 1, 0)])
+    else:
+        head = text[:max(max_tokens - 1, 0) * 4]
+    head = head.rsplit(" ", 1)[0] if " " in head else head
+    return head.rstrip(" ,;:") + "…"
+
+def summarize_answer(text: str, max_tokens: int) -> str:
+    """Extractive summary: the first sentence, cut to the token limit"""
+    first = re.split(r"(?<=[.!?])\s+", text.strip(), maxsplit=1)[0]
+    return truncate_tokens(first, max_tokens)
+
+def format_answers(answers: Optional[Dict[str, Any]], header: str, budget: int) -> str:
+    """Render question/answer pairs as prompt context within a token budget.
+
+    Older answers are summarized first, then recent ones truncated, and as a
+    last resort the oldest answers are dropped with a note saying so.
+    """
+    if not answers:
+        return ""
+    items = [(str(k), " ".join(str(v).split())) for k, v in answers.items()]
+
+    def render(pairs, omitted=0):
+        lines = [header]
+        if omitted:
+            lines.append(f"- ({omitted} earlier answers omitted)")
+        lines += [f"- {k}: {v}" for k, v in pairs]
+        return "\n".join(lines) + "\n"
+
+    text = render(items)
+    if count_tokens(text) <= budget:
+        return text
+
+    older, recent = items[:-RECENT_ANSWERS], items[-RECENT_ANSWERS:]
+    for limit in OLDER_ANSWER_TOKENS:
+        older = [(k, summarize_answer(v, limit)) for k, v in older]
+        text = render(older + recent)
+        if count_tokens(text) <= budget:
+            return text
+
+    per_recent = max((budget - count_tokens(render(older))) // max(len(recent), 1), 20)
+    recent = [(k, truncate_tokens(v, per_recent)) for k, v in recent]
+    omitted = 0
+    while older and count_tokens(render(older + recent, omitted)) > budget:
+        older = older[1:]
+        omitted += 1
+    return render(older + recent, omitted)
+
+# Long scripts are generated in parts (see clients.script_completion); these steer each part
+FIRST_PART_NOTE = """
+
+The script is long, so it is written in {parts} parts. Write only part 1 now: about {words} words, \
+ending at a natural pause, without closing the session."""
+CONTINUATION = """Continue this script. This is part {part} of {parts}: write about {words} more words \
+in the same voice, pace and style, picking up right where it stops.{ending}
+
+The script so far ends with:
+{previous}
+
+Return only the new script text."""
+
+def part_messages(messages: List[Dict[str, str]], script: str, part: int, parts: int,
+                  words: int) -> List[Dict[str, str]]:
+    """Messages for part `part` (1-based) of a script generated in `parts` completions.
+
+    Part 1 is the original prompt with a note to stop early; later parts
+    keep its system prompt and continue from the end of `script`.
+    """
+    if part == 1:
+        note = FIRST_PART_NOTE.format(parts=parts, words=words)
+        return messages[:-1] + [{"role": "user", "content": messages[-1]["content"] + note}]
+    ending = " Bring the session to a gentle close." if part == parts else " Don't close the session yet."
+    # Only the tail is sent, so a continuation's prompt stays small however long the script gets
+    previous = " ".join(script.split(" ")[-CONTINUATION_CONTEXT_WORDS:])
+    content = CONTINUATION.format(part=part, parts=parts, words=words, ending=ending, previous=previous)
+    return [messages[0], {"role": "user", "content": content}]
+
+def _budget(name: str) -> int:
+    overrides = getattr(settings, "prompt_input_budgets", {}) or {}
+    return overrides.get(name, PROMPTS[name]["budget"])
+
+@tracing.traced()
+def build_messages(name: str, answers: Optional[Dict[str, Any]] = None,
+                   answers_header: str = "Previous answers:", **fields) -> List[Dict[str, str]]:
+    """Render a prompt template into chat messages that fit its input-token budget"""
+    template = PROMPTS[name]
+    fields = {k: truncate_tokens(str(v), FIELD_TOKEN_CAP) for k, v in fields.items()}
+    fixed = template["user"].format(context="", **fields)
+    context = format_answers(answers, answers_header, _budget(name) - count_tokens(fixed))
+    return [
+        {"role": "system", "content": template["system"]},
+        {"role": "user", "content": template["user"].format(context=context, **fields)},
+    ]
@@ -0,0 +1,156 @@
+from collections import Counter
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Callable, Optional
+from fastapi import Request, Response
+from fastapi.encoders import jsonable_encoder
+from pydantic import BaseModel
+from starlette.concurrency import run_in_threadpool
+from app.state import get_state
+from app import tracing
+import hashlib
+import inspect
+import json
+import threading
+
+# A mutable flag rather than a bool, so endpoints running in a threadpool (with a copied context) can set it
+_skip: ContextVar[Optional[list]] = ContextVar("skip_response_cache", default=None)
+
+# Lookups on this worker since start, per route and per cached key
+_hits: Counter = Counter()
+_misses: Counter = Counter()
+_key_hits: Counter = Counter()
+_stats_lock = threading.Lock()
+
+def _count(route: str, key: str, hit: bool) -> None:
+    with _stats_lock:
+        if hit:
+            _hits[route] += 1
+            _key_hits[key] += 1
+        else:
+            _misses[route] += 1
+
+def cache_stats() -> dict:
+    """Hit ratio per route on this worker"""
+    with _stats_lock:
+        routes = set(_hits) | set(_misses)
+        return {
+            route: {
+                "hits": _hits[route],
+                "misses": _misses[route],
+                "hitRatio": round(_hits[route] / (_hits[route] + _misses[route]), 4),
+            }
+            for route in sorted(routes)
+        }
+
+def top_keys(limit: int = 20) -> list:
+    with _stats_lock:
+        return [{"key": key, "hits": hits} for key, hits in _key_hits.most_common(limit)]
+
+def key_hits(key: str) -> int:
+    with _stats_lock:
+        return _key_hits.get(key, 0)
+
+def skip_response_cache() -> None:
+    """Called by an endpoint when this particular response must not be cached (fallbacks, partial results)"""
+    flag = _skip.get()
+    if flag is not None:
+        flag[0] = True
+
+def _normalize(arguments: dict) -> str:
+    plain = {
+        name: value.model_dump(mode="json") if isinstance(value, BaseModel) else value
+        for name, value in arguments.items()
+    }
+    return json.dumps(plain, sort_keys=True, separators=(",", ":"), default=str)
+
+def _response(body: bytes, etag: str, request: Request) -> Response:
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers={"ETag": etag})
+    return Response(content=body, media_type="application/json", headers={"ETag": etag})
+
+def cached_response(ttl: Optional[float] = None, key: Optional[Callable[..., Any]] = None):
+    """Cache an endpoint's serialized JSON per (route, normalized arguments).
+
+    Hits return the stored bytes directly, skipping the endpoint, response
+    model validation and serialization. Responses carry an ETag and a
+    matching If-None-Match gets a 304. The cache lives in shared state, so
+    every worker serves the others' entries. Works on sync and async
+    endpoints alike; async ones do the state lookups in the threadpool.
+
+    `key` gets the endpoint's arguments and returns what the response
+    actually depends on, for endpoints whose arguments carry free text the
+    response ignores; by default the whole arguments are the key.
+    """
+    def decorator(func):
+        signature = inspect.signature(func)
+        route = f"{func.__module__}.{func.__name__}"
+
+        def lookup(args, kwargs, request: Request):
+            arguments = signature.bind(*args, **kwargs).arguments
+            if key is not None:
+                arguments = {"key": key(**arguments)}
+            cache_key = "resp:" + route + ":" + hashlib.sha1(_normalize(arguments).encode()).hexdigest()
+            with tracing.span("cache.lookup", route=route) as lookup_span:
+                cached = get_state().get(cache_key)
+                if lookup_span:
+                    lookup_span.attrs["hit"] = cached is not None
+            _count(route, cache_key, cached is not None)
+            if cached is None:
+                return cache_key, None
+            etag, body = cached.split(b"\n", 1)
+            return cache_key, _response(body, etag.decode(), request)
+
+        def store(cache_key: str, result, skip: bool, request: Request):
+            if isinstance(result, Response):
+                return result
+            body = json.dumps(jsonable_encoder(result), separators=(",", ":")).encode()
+            etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+            if not skip:
+                get_state().set(cache_key, etag.encode() + b"\n" + body, ttl)
+            return _response(body, etag, request)
+
+        if inspect.iscoroutinefunction(func):
+            @wraps(func)
+            async def wrapper(*args, request: Request, **kwargs):
+                # Shared state may be Redis, so its round trips stay off the event loop
+                cache_key, hit = await run_in_threadpool(lookup, args, kwargs, request)
+                if hit is not None:
+                    return hit
+                flag = [False]
+                token = _skip.set(flag)
+                try:
+                    result = await func(*args, **kwargs)
+                finally:
+                    _skip.reset(token)
+                return await run_in_threadpool(store, cache_key, result, flag[0], request)
+        else:
+            @wraps(func)
+            def wrapper(*args, request: Request, **kwargs):
+                cache_key, hit = lookup(args, kwargs, request)
+                if hit is not None:
+                    return hit
+                flag = [False]
+                token = _skip.set(flag)
+                try:
+                    result = func(*args, **kwargs)
+                finally:
+                    _skip.reset(token)
+                return store(cache_key, result, flag[0], request)
+
+        params = list(signature.parameters.values())
+        params.append(inspect.Parameter("request", inspect.Parameter.KEYWORD_ONLY, annotation=Request))
+        wrapper.__signature__ = signature.replace(parameters=params)
+        return wrapper
+    return decorator
+
+def purge_response_cache(func=None, route: Optional[str] = None) -> int:
+    """Drop cached responses for one endpoint (or every route starting with `route`), or all when neither is given"""
+    prefix = "resp:" + (f"{func.__module__}.{func.__name__}:" if func else route or "")
+    state = get_state()
+    keys = list(state.scan(prefix))
+    state.delete(*keys)
+    with _stats_lock:
+        for key in keys:
+            _key_hits.pop(key, None)
+    return len(keys)
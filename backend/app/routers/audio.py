@@ -1,8 +1,11 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from pydantic import BaseModel
 from typing import List
 from app.config import settings
-import requests
+from app.state import rate_limited
+from app.tts import synthesize_speech
+from app.response_cache import cached_response
+from app import assets, hls
 import os
 import uuid
 
@@ -39,37 +42,42 @@ class AudioGenerationResponse(BaseModel):
     sessionId: str
 
 @router.get("/voices", response_model=List[dict])
+@cached_response()
 def get_voices():
     return MOCK_VOICES
 
-@router.post("/generate", response_model=AudioGenerationResponse)
+@router.post("/generate", response_model=AudioGenerationResponse,
+             dependencies=[Depends(rate_limited("audio-generate"))])
 def generate_audio(req: AudioGenerationRequest):
-    url = f"{settings.eleven_labs_base_url}/text-to-speech/{req.voiceId}"
-    headers = {
-        "Accept": "audio/mpeg",
-        "Content-Type": "application/json",
-        "xi-api-key": settings.eleven_labs_api_key
-    }
-    data = {
-        "text": req.text,
-        "model_id": settings.eleven_labs_model,
-        "voice_settings": {
-            "stability": 0.5,
-            "similarity_boost": 0.75
-        }
-    }
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code != 200:
+    audio = synthesize_speech(req.text, req.voiceId)
+    if not audio:
         raise HTTPException(status_code=500, detail="Failed to generate audio from ElevenLabs")
     session_id = str(uuid.uuid4())
     filename = f"{session_id}.mp3"
     file_path = os.path.join(settings.upload_dir, filename)
     with open(file_path, "wb") as f:
-        f.write(response.content)
+        f.write(audio)
+    assets.record(filename, sessionType=req.sessionType, voiceId=req.voiceId)
     audio_url = f"/uploads/{filename}"
     return AudioGenerationResponse(
         audioUrl=audio_url,
         duration=120.0,
         voiceId=req.voiceId,
         sessionId=session_id
-    ) 
\ No newline at end of file
+    )
+
+@router.get("/playlist/{name}.m3u8")
+def get_playlist(name: str):
+    """HLS playlist for a progressively synthesized session; segments are served from /uploads"""
+    if not name.replace("-", "").isalnum():
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    playlist = hls.read_playlist(name)
+    if playlist is None:
+        raise HTTPException(status_code=404, detail="Playlist not found")
+    # A live playlist grows as segments land; a finished one never changes again
+    ended = "#EXT-X-ENDLIST" in playlist
+    return Response(
+        content=playlist,
+        media_type="application/vnd.apple.mpegurl",
+        headers={"Cache-Control": "public, max-age=86400" if ended else "no-cache"}
+    )
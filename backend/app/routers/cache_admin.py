@@ -0,0 +1,142 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from itertools import islice
+from pydantic import BaseModel
+from typing import Dict, Optional, Set
+from app.auth import require_admin
+from app.state import get_state
+from app.response_cache import cache_stats, key_hits, purge_response_cache, top_keys
+from app.routers.one_tap import ONE_TAP_SCRIPTS, start_one_tap
+from app import admission, assets, metering, one_tap_audio, prefetch
+import threading
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+class AssetFilter(BaseModel):
+    voiceId: Optional[str] = None
+    sessionType: Optional[str] = None
+    model: Optional[str] = None  # TTS model or provider name, e.g. eleven_monolingual_v1 or openai
+
+    def filters(self) -> dict:
+        return {"voice_id": self.voiceId, "session_type": self.sessionType, "model": self.model}
+
+class PurgeRequest(AssetFilter):
+    rewarm: bool = True
+    dryRun: bool = False
+
+@router.get("")
+def get_cache_summary():
+    """Sizes of every cache, response-cache hit ratios on this worker and its most requested keys"""
+    return {
+        "responseCache": {
+            "entries": sum(1 for _ in get_state().scan("resp:")),
+            "routes": cache_stats(),
+            "topKeys": top_keys(10),
+        },
+        "assets": assets.summary(),
+        "pinned": len(assets.pinned()),
+        "prefetch": prefetch.metrics(),
+    }
+
+@router.get("/responses")
+def list_cached_responses(
+    route: str = "",
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """One page of response-cache keys, optionally for routes starting with `route` (module.function)"""
+    keys = islice(get_state().scan("resp:" + route), offset, offset + limit)
+    return {"offset": offset, "items": [{"key": key, "hits": key_hits(key)} for key in keys]}
+
+@router.delete("/responses")
+def purge_cached_responses(route: str = ""):
+    """Drop cached responses for routes starting with `route`, or all of them"""
+    return {"purged": purge_response_cache(route=route)}
+
+@router.get("/top")
+def get_top_keys(limit: int = Query(20, ge=1, le=200)):
+    return {"items": top_keys(limit)}
+
+@router.get("/assets")
+def list_assets(
+    voiceId: Optional[str] = None,
+    sessionType: Optional[str] = None,
+    model: Optional[str] = None,
+    offset: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """One page of generated audio in the upload dir with what produced it and whether it is pinned"""
+    items = assets.list_assets(offset, limit, voice_id=voiceId, session_type=sessionType, model=model)
+    return {"offset": offset, "items": items}
+
+@router.put("/assets/{filename}/pin")
+def pin_asset(filename: str):
+    """Keep an asset through purges"""
+    if not assets.exists(filename):
+        raise HTTPException(status_code=404, detail="Asset not found")
+    assets.pin(filename)
+    return {"filename": filename, "pinned": True}
+
+@router.delete("/assets/{filename}/pin")
+def unpin_asset(filename: str):
+    assets.unpin(filename)
+    return {"filename": filename, "pinned": False}
+
+@router.post("/pin")
+def pin_matching(req: AssetFilter):
+    """Pin every asset matching the filter, e.g. all clips of one sessionType and voice"""
+    if not any(req.filters().values()):
+        raise HTTPException(status_code=400, detail="Give voiceId, sessionType or model")
+    names = [a["filename"] for a in assets.iter_assets() if a["kind"] != "other" and assets.matches(a, **req.filters())]
+    for name in names:
+        assets.pin(name)
+    return {"pinned": names}
+
+@router.post("/purge")
+def purge_assets(req: PurgeRequest):
+    """Delete unpinned audio by voice, model or sessionType.
+
+    One-tap clips and tracks that were removed are synthesized again in the
+    background (only those, not everything that matches the filter); personal
+    session audio is not, since nobody will ask for it again.
+    """
+    if not any(req.filters().values()):
+        raise HTTPException(status_code=400, detail="Give voiceId, sessionType or model")
+    result = assets.purge(dry_run=req.dryRun, **req.filters())
+    targets: Dict[tuple, Set[int]] = {}
+    for asset in result["removed"]:
+        if asset["kind"] in ("one_tap_step", "one_tap_full") and asset["sessionType"] in ONE_TAP_SCRIPTS:
+            steps = targets.setdefault((asset["sessionType"], asset["voiceId"]), set())
+            if asset["kind"] == "one_tap_step":
+                steps.add(asset["stepIndex"])
+            else:
+                steps.add(-1)
+    if targets and not req.dryRun:
+        # Cached /one-tap/start responses point at the removed tracks
+        purge_response_cache(start_one_tap)
+        for session_type, voice_id in targets:
+            one_tap_audio.forget_timing_index(session_type, voice_id)
+        if req.rewarm:
+            threading.Thread(target=_rewarm, args=(targets,), daemon=True).start()
+    return {
+        "removed": [a["filename"] for a in result["removed"]],
+        "skippedPinned": result["skippedPinned"],
+        "bytes": result["bytes"],
+        "dryRun": req.dryRun,
+        "rewarming": [
+            {"sessionType": s, "voiceId": v, "steps": sorted(i for i in steps if i >= 0), "fullTrack": -1 in steps}
+            for (s, v), steps in targets.items()
+        ] if req.rewarm and not req.dryRun else [],
+    }
+
+def _rewarm(targets: Dict[tuple, Set[int]]) -> None:
+    with metering.attributed("admin.rewarm"):
+        for (session_type, voice_id), steps in targets.items():
+            script = ONE_TAP_SCRIPTS[session_type]
+            for index in sorted(i for i in steps if i >= 0):
+                if admission.overall_level() > admission.NORMAL:
+                    print("Skipping cache re-warm under load")
+                    return
+                one_tap_audio.ensure_step_clip(session_type, index, voice_id, script[index])
+            if -1 in steps:
+                one_tap_audio.stitch_full_track(session_type, voice_id, script)
+        print(f"Re-warmed {len(targets)} one-tap voice(s) after purge")
@@ -1,11 +1,32 @@
-from fastapi import APIRouter
+from fastapi import APIRouter, Depends
 from datetime import datetime
+from app.auth import require_admin
+from app.response_cache import cached_response
+from app import admission, fairness, hedging
+from app.tts import get_tts_router
 
 router = APIRouter()
 
+# Served on the event loop: the snapshots only take short locks, and the check
+# must answer even while every threadpool thread is busy generating sessions
 @router.get("/health")
-def health_check():
+@cached_response(ttl=1)
+async def health_check():
+    load = admission.tracker.snapshot()
     return {
-        "status": "healthy",
+        "status": "degraded" if any(c["level"] for c in load.values()) else "healthy",
         "timestamp": datetime.utcnow().isoformat()
-    } 
\ No newline at end of file
+    }
+
+@router.get("/health/details", dependencies=[Depends(require_admin)])
+async def health_details():
+    """Load per route class, fair-share slots, TTS provider ranking and hedging stats, for operators"""
+    load = admission.tracker.snapshot()
+    return {
+        "status": "degraded" if any(c["level"] for c in load.values()) else "healthy",
+        "timestamp": datetime.utcnow().isoformat(),
+        "load": load,
+        "fairShare": fairness.scheduler.snapshot(),
+        "tts": get_tts_router().snapshot(),
+        "hedging": hedging.hedger.snapshot()
+    }
@@ -0,0 +1,29 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import Optional
+from app.auth import require_user
+
+router = APIRouter()
+
+@router.get("/{user_id}")
+def get_session_history(
+    user_id: str,
+    limit: int = Query(20, ge=1, le=100),
+    cursor: Optional[str] = Query(None, description="nextCursor from the previous page"),
+    sessionType: Optional[str] = Query(None, description="meditation or visualization")
+):
+    """Get a user's completed sessions, newest first; only for that user's own token"""
+    require_user(user_id)
+    from app import history  # Deferred so SQLAlchemy is not imported at startup
+    
+    try:
+        return history.get_history(user_id, limit=limit, cursor=cursor, session_type=sessionType)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
+@router.get("/{user_id}/stats")
+def get_session_stats(user_id: str):
+    """Get a user's precomputed streaks and average scores; only for that user's own token"""
+    require_user(user_id)
+    from app import history
+    
+    return history.get_stats(user_id)
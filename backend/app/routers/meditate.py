@@ -1,15 +1,17 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Dict, Any, List
 from datetime import datetime
 from app.config import settings
-import openai
+from app.clients import chat_completion, get_tts_client, script_completion
+from app.tts import sticky_synthesizer, synthesize_speech
+from app.state import get_state, rate_limited
+from app import admission, assets, auth, calibration, classifier, fairness, hls, mp3, music, prompts, similarity, tracing
 import uuid
-import requests
 import os
+import threading
 
 router = APIRouter()
-openai.api_key = settings.openai_api_key
 
 class MeditationQuestionRequest(BaseModel):
     mood: str
@@ -26,36 +28,18 @@ class DynamicQuestionResponse(BaseModel):
 @router.post("/questions", response_model=DynamicQuestionResponse)
 def get_next_meditation_question(req: MeditationQuestionRequest):
     try:
-        # Create context from previous answers
-        context = ""
-        if req.previousAnswers:
-            context = "Previous answers:\n"
-            for question_id, answer in req.previousAnswers.items():
-                context += f"- {question_id}: {answer}\n"
-        
         # Generate dynamic question based on mood and previous answers
-        prompt = f"""
-        You are a meditation coach conducting an intake session. The user feels {req.mood}.
-        
-        {context}
-        
-        Current question number: {req.currentQuestionIndex + 1} of 5
-        
-        Generate the next personalized question for meditation intake. The question should:
-        - Be relevant to their mood: {req.mood}
-        - Build upon their previous answers
-        - Help understand their meditation needs
-        - Be conversational and empathetic
-        
-        Return only the question text, nothing else.
-        """
+        messages = prompts.build_messages(
+            "meditation_question",
+            answers=req.previousAnswers,
+            mood=req.mood,
+            question_number=req.currentQuestionIndex + 1
+        )
         
-        response = openai.chat.completions.create(
+        response = chat_completion(
+            hedge=True,
             model=settings.openai_model,
-            messages=[
-                {"role": "system", "content": "You are a meditation expert who asks thoughtful, personalized questions to understand a person's meditation needs."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             max_tokens=100,
             temperature=0.7,
         )
@@ -63,15 +47,7 @@ def get_next_meditation_question(req: MeditationQuestionRequest):
         question = response.choices[0].message.content.strip()
         
         # Determine question type based on content
-        question_type = "text"
-        if any(word in question.lower() for word in ["how long", "how much", "how many"]):
-            question_type = "number"
-        elif any(word in question.lower() for word in ["where", "location", "place"]):
-            question_type = "text"
-        elif any(word in question.lower() for word in ["yes", "no", "are you", "do you"]):
-            question_type = "single"
-        elif len(question) > 100:
-            question_type = "textarea"
+        question_type = classifier.meditation_question_type(question)
         
         return DynamicQuestionResponse(
             nextQuestion=question,
@@ -110,13 +86,16 @@ class MeditationStartRequest(BaseModel):
     voiceId: str
     duration: int = 600
     allAnswers: Dict[str, Any]
+    backgroundMusic: str = ""  # Bed style to mix under the voice (see music.BED_STYLES); none unless asked for
+    stream: bool = False  # Long sessions return a playlistUrl as soon as the first segment is ready
 
 class MeditationResponse(BaseModel):
     sessionId: str
     audioUrl: str
     script: str
     duration: int
-    backgroundMusic: str = ""
+    backgroundMusic: str = ""  # Bed used; audioUrl already has it mixed in when ffmpeg is available
+    playlistUrl: str = ""  # HLS playlist when streamed; audioUrl is complete once it ends
     mood: str
     createdAt: str
     voiceId: str
@@ -131,13 +110,7 @@ class VoiceOption(BaseModel):
 def get_available_voices():
     """Get available voices for meditation guidance"""
     try:
-        url = "https://api.elevenlabs.io/v1/voices"
-        headers = {
-            "Accept": "application/json",
-            "xi-api-key": settings.eleven_labs_api_key
-        }
-        
-        response = requests.get(url, headers=headers)
+        response = get_tts_client().get("/voices")
         
         if response.status_code == 200:
             voices_data = response.json()
@@ -206,29 +179,13 @@ def get_available_voices():
             )
         ]
 
+@tracing.traced()
 def generate_audio_with_elevenlabs(text: str, voice_id: str) -> str:
     """Generate audio using ElevenLabs API"""
     try:
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-        
-        headers = {
-            "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": settings.eleven_labs_api_key
-        }
+        audio = synthesize_speech(text, voice_id, similarity_boost=0.5)
         
-        data = {
-            "text": text,
-            "model_id": "eleven_monolingual_v1",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.5
-            }
-        }
-        
-        response = requests.post(url, json=data, headers=headers)
-        
-        if response.status_code == 200:
+        if audio:
             # Save audio file
             session_id = str(uuid.uuid4())
             audio_filename = f"{session_id}.mp3"
@@ -237,101 +194,188 @@ def generate_audio_with_elevenlabs(text: str, voice_id: str) -> str:
             # Ensure uploads directory exists
             os.makedirs("uploads", exist_ok=True)
             
-            with open(audio_path, "wb") as f:
-                f.write(response.content)
+            with tracing.span("disk.write", bytes=len(audio)), open(audio_path, "wb") as f:
+                f.write(audio)
+            assets.record(audio_filename, sessionType="meditation", voiceId=voice_id)
             
             return f"/uploads/{audio_filename}"
         else:
-            print(f"ElevenLabs API error: {response.status_code} - {response.text}")
             return None
             
     except Exception as e:
         print(f"Error generating audio: {e}")
         return None
 
-@router.post("/start", response_model=MeditationResponse)
-def start_meditation(req: MeditationStartRequest):
-    try:
-        # Create detailed context from all answers
-        answers_context = ""
-        if req.allAnswers:
-            answers_context = "User's detailed responses:\n"
-            for question_id, answer in req.allAnswers.items():
-                answers_context += f"- {question_id}: {answer}\n"
-        
-        # Generate personalized meditation script using OpenAI
-        prompt = f"""
-        Create a {req.duration//60}-minute personalized meditation script for someone feeling {req.mood}.
+@tracing.traced()
+def generate_meditation_script(req: MeditationStartRequest) -> str:
+    """Generate a personalized meditation script using OpenAI, sized to the voice's speaking rate"""
+    words = calibration.target_words(req.duration, req.voiceId)
+    messages = prompts.build_messages(
+        "meditation_script",
+        answers=req.allAnswers,
+        answers_header="User's detailed responses:",
+        mood=req.mood,
+        minutes=req.duration//60,
+        words=words
+    )
+    
+    script = script_completion(messages, words, model=settings.openai_model, temperature=0.7)
+    return calibration.trim_script(script, words)
+
+def fallback_meditation_script(req: MeditationStartRequest) -> str:
+    """Template script for when OpenAI fails or is skipped"""
+    return f"""
+        Welcome to your {req.duration//60}-minute meditation session for feeling {req.mood}.
         
-        {answers_context}
+        Take a deep breath in... and let it out slowly...
         
-        The script should be:
-        - Deeply personalized based on their mood ({req.mood}) and all their answers
-        - Include specific references to their stressors, body tension, and desired outcomes
-        - Use calming, soothing language that matches their emotional state
-        - Include breathing guidance and relaxation techniques
-        - Written in a conversational, empathetic tone
-        - Approximately {req.duration//60} minutes when spoken at a calm pace
-        - Include natural pauses for breathing (indicated by "...")
-        - Address their specific needs mentioned in the intake
+        As you settle into this moment, remember that you are safe and supported. 
+        This time is yours to find peace and clarity.
         
-        Make it feel like you truly understand their situation and are speaking directly to them.
-        Return only the meditation script text.
+        Continue breathing deeply and allow yourself to be present in this moment...
         """
-        
-        response = openai.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {"role": "system", "content": "You are a meditation expert who creates deeply personalized, calming meditation scripts that address specific user needs and emotions."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=1200,
-            temperature=0.7,
+
+def record_session_job(session_id: str, req: MeditationStartRequest, audio_url: str, created_at: str) -> None:
+    get_state().set_job(
+        session_id, status="ready", sessionType="meditation", mood=req.mood,
+        voiceId=req.voiceId, audioUrl=audio_url, createdAt=created_at, owner=auth.current_identity()
+    )
+
+@tracing.traced()
+def generate_progressive_audio(text: str, voice_id: str, listener=None):
+    """Synthesize a long script chunk by chunk into an HLS playlist.
+
+    Returns (audio_url, playlist_url) once the first segment is ready, or
+    (None, "") if synthesis failed. The full mp3 at audio_url is written
+    when the last chunk is done; listener gets every playlist event.
+    """
+    name = str(uuid.uuid4())
+    finished = threading.Event()
+    ready = hls.synthesize_progressive(
+        name, text,
+        sticky_synthesizer(voice_id, similarity_boost=0.5),
+        os.path.join("uploads", f"{name}.mp3"),
+        listener=listener,
+        finished=finished
+    )
+    # The rest of the track (or an abandoned first chunk) is still synthesizing: it keeps the request's slot
+    fairness.hold_until(finished)
+    if not ready:
+        return None, ""
+    assets.record(f"{name}.mp3", sessionType="meditation", voiceId=voice_id)
+    return f"/uploads/{name}.mp3", hls.playlist_url(name)
+
+def _reuse_partition(req: MeditationStartRequest) -> str:
+    return f"meditation|{req.mood.strip().lower()}|{req.voiceId}|{req.duration}"
+
+@tracing.traced()
+def find_reusable_session(req: MeditationStartRequest, max_distance: float = None):
+    """Serve a previously generated script and audio when a near-identical request was seen before.
+
+    Returns (script, audio_url) or None. The stored audio is reused only when
+    the stored script held nothing of its original user's answers; otherwise
+    just the LLM call is saved and the personalized script is synthesized.
+    """
+    if not settings.script_reuse_enabled:
+        return None
+    match = similarity.get_index().find(
+        _reuse_partition(req),
+        similarity.request_text(req.mood, req.allAnswers),
+        max_distance or settings.script_reuse_max_distance
+    )
+    if not match:
+        return None
+    print(f"Reusing meditation script at distance {match['distance']}")
+    script = similarity.personalize(match["template"], req.allAnswers)
+    audio_path = os.path.join("uploads", match["audioUrl"].rsplit("/", 1)[-1])
+    if match.get("verbatim") and os.path.exists(audio_path):
+        return script, match["audioUrl"]
+    return script, generate_audio_with_elevenlabs(script, req.voiceId)
+
+def add_background_music(req: MeditationStartRequest, audio_url: str, playlist_url: str) -> tuple:
+    """Returns (audio_url, bed_url); a failed mix keeps the voice track rather than losing the session"""
+    try:
+        if playlist_url:
+            # Segments are published before the track is complete, so the client layers the bed itself
+            bed = music.get_bed(req.backgroundMusic, music.bed_length_for(req.duration))
+            return audio_url, music.to_url(bed) if bed else ""
+        voice_path = os.path.join("uploads", audio_url.rsplit("/", 1)[-1])
+        return music.mix_with_bed(audio_url, mp3.file_duration(voice_path), req.backgroundMusic)
+    except Exception as e:
+        print(f"Error adding background music: {e}")
+        return audio_url, ""
+
+@router.post("/start", response_model=MeditationResponse,
+             dependencies=[Depends(rate_limited("meditate-start"))])
+@fairness.fair_share(cost=lambda req: req.duration / 60)
+def start_meditation(req: MeditationStartRequest):
+    background_music = ""
+    playlist_url = ""
+    stream = req.stream and req.duration >= settings.hls_min_duration
+    try:
+        # Under load the LLM is skipped, so a somewhat less similar stored script still beats the template
+        reused = find_reusable_session(
+            req, max_distance=None if admission.allow_llm() else settings.script_reuse_degraded_max_distance
         )
-        script = response.choices[0].message.content.strip()
-        
-        # Generate audio using ElevenLabs
-        audio_url = generate_audio_with_elevenlabs(script, req.voiceId)
+        if reused:
+            script, audio_url = reused
+            if stream and audio_url:
+                name = audio_url.rsplit("/", 1)[-1][:-len(".mp3")]
+                playlist_url = hls.segment_file(name, os.path.join("uploads", f"{name}.mp3")) or ""
+        else:
+            script = generate_meditation_script(req)
+            
+            # Generate audio using ElevenLabs
+            if stream:
+                audio_url, playlist_url = generate_progressive_audio(script, req.voiceId)
+            else:
+                audio_url = generate_audio_with_elevenlabs(script, req.voiceId)
+            if audio_url and settings.script_reuse_enabled:
+                similarity.get_index().add(
+                    _reuse_partition(req), similarity.request_text(req.mood, req.allAnswers),
+                    script, audio_url, req.allAnswers
+                )
         
         if not audio_url:
             # Fallback if audio generation fails
             audio_url = f"/uploads/fallback_{str(uuid.uuid4())}.mp3"
+        elif req.backgroundMusic:
+            audio_url, background_music = add_background_music(req, audio_url, playlist_url)
             
     except Exception as e:
         print(f"Error in meditation generation: {e}")
-        # Fallback script if OpenAI fails
-        script = f"""
-        Welcome to your {req.duration//60}-minute meditation session for feeling {req.mood}.
-        
-        Take a deep breath in... and let it out slowly...
-        
-        As you settle into this moment, remember that you are safe and supported. 
-        This time is yours to find peace and clarity.
-        
-        Continue breathing deeply and allow yourself to be present in this moment...
-        """
-        audio_url = f"/uploads/fallback_{str(uuid.uuid4())}.mp3"
+        script = fallback_meditation_script(req)
+        # Skipped only for load, synthesis may still be allowed for the template script
+        audio_url = generate_audio_with_elevenlabs(script, req.voiceId) if isinstance(e, admission.Degraded) else None
+        audio_url = audio_url or f"/uploads/fallback_{str(uuid.uuid4())}.mp3"
     
     session_id = str(uuid.uuid4())
+    created_at = datetime.utcnow().isoformat()
+    record_session_job(session_id, req, audio_url, created_at)
     
     return MeditationResponse(
         sessionId=session_id,
         audioUrl=audio_url,
         script=script,
         duration=req.duration,
-        backgroundMusic="",
+        backgroundMusic=background_music,
+        playlistUrl=playlist_url,
         mood=req.mood,
-        createdAt=datetime.utcnow().isoformat(),
+        createdAt=created_at,
         voiceId=req.voiceId
     ) 
 
 class SessionCompleteRequest(BaseModel):
     rating: int | None = None
     notes: str | None = None
+    userId: str | None = None  # Record in the user's session history when set
 
 @router.post("/session/{session_id}/complete")
 def complete_meditation_session(session_id: str, req: SessionCompleteRequest):
     """Complete a meditation session with optional rating and notes"""
+    if req.userId:
+        # History is only recorded for the signed-in user it belongs to
+        auth.require_user(req.userId, owner=(get_state().get_job(session_id) or {}).get("owner"))
     try:
         # In a real application, you would save this to a database
         # For now, we'll just return a success response
@@ -345,6 +389,16 @@ def complete_meditation_session(session_id: str, req: SessionCompleteRequest):
         
         print(f"Session completed: {completion_data}")
         
+        if req.userId:
+            from app import history  # SQLAlchemy loads on first completion, not at startup
+            
+            job = get_state().get_job(session_id) or {}
+            history.record_completion(
+                session_id, req.userId, "meditation", created_at=job.get("createdAt"),
+                rating=req.rating, notes=req.notes, mood=job.get("mood"),
+                voiceId=job.get("voiceId"), audioUrl=job.get("audioUrl")
+            )
+        
         return {
             "success": True,
             "message": "Session completed successfully",
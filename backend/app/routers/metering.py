@@ -0,0 +1,10 @@
+from fastapi import APIRouter, Depends
+from app.auth import require_admin
+from app import metering
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("")
+def get_usage():
+    """Today's (UTC) OpenAI tokens and synthesized characters per endpoint, across workers, with budgets"""
+    return {"endpoints": metering.meter.report()}
@@ -1,7 +1,10 @@
-from fastapi import APIRouter, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel
 from app.config import settings
-import requests
+from app.auth import require_admin
+from app import fairness, one_tap_audio, prefetch, tracing
+from app.response_cache import cached_response, skip_response_cache
+from typing import Optional
 import os
 import uuid
 import random
@@ -9,6 +12,9 @@ import json
 
 router = APIRouter()
 
+# Audio minutes charged to the user's quota per step that has to be synthesized
+STEP_COST_MINUTES = one_tap_audio.STEP_COST_MINUTES
+
 class OneTapRequest(BaseModel):
     sessionType: str  # 'quick-relief', 'daily-practice', 'deep-dive'
     voiceId: str = "21m00Tcm4TlvDq8ikWAM"  # Default voice
@@ -17,6 +23,7 @@ class OneTapResponse(BaseModel):
     audioUrl: str
     script: str
     steps: list[str]  # Individual steps for frontend
+    stepTimings: Optional[list[dict]] = None  # Offsets of each step within audioUrl
 
 # Fixed scripts for each session type
 ONE_TAP_SCRIPTS = {
@@ -49,6 +56,7 @@ ONE_TAP_SCRIPTS = {
     ],
 }
 
+@tracing.traced("disk.fallback_scan")
 def get_random_existing_audio_url():
     upload_dir = getattr(settings, "upload_dir", "uploads")
     try:
@@ -61,111 +69,98 @@ def get_random_existing_audio_url():
         print(f"Error selecting fallback audio: {e}")
         return None
 
+def _missing_steps(session_type: str, voice_id: str) -> int:
+    steps = ONE_TAP_SCRIPTS.get(session_type) or []
+    if os.path.exists(one_tap_audio.asset_path(one_tap_audio.full_filename(session_type, voice_id))):
+        return 0
+    return sum(
+        not os.path.exists(one_tap_audio.asset_path(one_tap_audio.step_filename(session_type, i, voice_id)))
+        for i in range(len(steps))
+    )
+
+def _step_cost(req, stepIndex: int, **_) -> float:
+    """Free when the clip is on disk, or being prefetched: the prefetch was already charged, and the request waits for it"""
+    filename = one_tap_audio.step_filename(req.sessionType, stepIndex, req.voiceId)
+    if os.path.exists(one_tap_audio.asset_path(filename)) or prefetch.get_prefetcher().is_in_flight(filename):
+        return 0
+    return STEP_COST_MINUTES
+
 @router.post("/one-tap/start", response_model=OneTapResponse)
+@cached_response()
+@fairness.fair_share(cost=lambda req: _missing_steps(req.sessionType, req.voiceId) * STEP_COST_MINUTES)
 def start_one_tap(req: OneTapRequest):
     steps = ONE_TAP_SCRIPTS.get(req.sessionType)
     if not steps:
         raise HTTPException(status_code=400, detail="Invalid sessionType")
     
     full_script = "\n".join(steps)
-    safe_voice = req.voiceId.replace("/", "_")
-    filename = f"{req.sessionType}_full_{safe_voice}.mp3"
-    upload_dir = getattr(settings, "upload_dir", "uploads")
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, filename)
+    filename = one_tap_audio.full_filename(req.sessionType, req.voiceId)
+    file_path = os.path.join(one_tap_audio.upload_dir(), filename)
     audio_url = f"/uploads/{filename}"
 
-    # **Add these lines to log directory status**
-    print(f"UPLOAD DIR: {upload_dir}")
-    print(f"ABSOLUTE PATH: {os.path.abspath(upload_dir)}")
-    print(f"EXISTS: {os.path.exists(upload_dir)}")
-    print(f"WRITABLE: {os.access(upload_dir, os.W_OK)}")
-    print(f"FILES: {os.listdir(upload_dir) if os.path.exists(upload_dir) else 'N/A'}")
-
     # If audio exists, return it
     if os.path.exists(file_path):
-        return OneTapResponse(audioUrl=audio_url, script=full_script, steps=steps)
-    
-    # Generate audio for full script
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{req.voiceId}"
-    headers = {
-        "Accept": "audio/mpeg",
-        "Content-Type": "application/json",
-        "xi-api-key": settings.eleven_labs_api_key
-    }
-    data = {
-        "text": full_script,
-        "model_id": getattr(settings, "eleven_labs_model", "eleven_monolingual_v1"),
-        "voice_settings": {
-            "stability": 0.5,
-            "similarity_boost": 0.75
-        }
-    }
+        timings = one_tap_audio.get_timing_index(req.sessionType, req.voiceId)
+        if timings is None:
+            timings = one_tap_audio.build_timing_index(req.sessionType, req.voiceId, steps)
+        if not timings or any(t["estimated"] for t in timings):
+            skip_response_cache()
+        return OneTapResponse(audioUrl=audio_url, script=full_script, steps=steps, stepTimings=timings)
     
-    print("Sending request to ElevenLabs API...")
-    response = requests.post(url, json=data, headers=headers)
-    print(f"ElevenLabs response status: {response.status_code}")
-    print(f"ElevenLabs response content: {response.content[:500]}")  # Print first 500 bytes
-
-    if response.status_code == 200:
-        print("Writing audio file...")
-        with open(file_path, "wb") as f:
-            f.write(response.content)
-        print("Audio file written successfully.")
-        return OneTapResponse(audioUrl=audio_url, script=full_script, steps=steps)
-    else:
-        print("ElevenLabs API call failed.")
-        # Fallback: use a random existing audio file if available
-        fallback_url = get_random_existing_audio_url()
-        if not fallback_url:
-            print("No fallback audio available.")
-            raise HTTPException(status_code=500, detail="Failed to generate audio from ElevenLabs and no fallback audio available")
-        print("Returning fallback audio.")
-        return OneTapResponse(audioUrl=fallback_url, script=full_script, steps=steps)
+    # Stitch the full track from cached step clips, synthesizing only missing steps
+    stitched = one_tap_audio.stitch_full_track(req.sessionType, req.voiceId, steps)
+    if stitched is not None:
+        stitched_name, timings = stitched
+        if stitched_name != filename:
+            # Spoken by a fallback provider: serve it now, but try the primary voice again next time
+            skip_response_cache()
+        return OneTapResponse(audioUrl=f"/uploads/{stitched_name}", script=full_script, steps=steps, stepTimings=timings)
+
+    print("Stitching full session audio failed.")
+    skip_response_cache()
+    # Fallback: use a random existing audio file if available
+    fallback_url = get_random_existing_audio_url()
+    if not fallback_url:
+        print("No fallback audio available.")
+        raise HTTPException(status_code=500, detail="Failed to generate audio from ElevenLabs and no fallback audio available")
+    print("Returning fallback audio.")
+    return OneTapResponse(audioUrl=fallback_url, script=full_script, steps=steps)
 
 @router.post("/one-tap/step-audio")
+@fairness.fair_share(cost=_step_cost)
 def one_tap_step_audio(
     req: OneTapRequest,
-    stepIndex: int = Query(..., description="Index of the script step (0-based)")
+    stepIndex: int = Query(..., description="Index of the script step (0-based)"),
+    sessionId: Optional[str] = Query(None, description="Client session, so prefetch stops when it is abandoned")
 ):
-    script = ONE_TAP_SCRIPTS.get(req.sessionType)
-    if not script:
+    steps = ONE_TAP_SCRIPTS.get(req.sessionType)
+    if not steps:
         raise HTTPException(status_code=400, detail="Invalid sessionType")
-    # Split script into steps by line breaks
-    steps = [s.strip() for s in script.split("\n") if s.strip()]
     if stepIndex < 0 or stepIndex >= len(steps):
         raise HTTPException(status_code=400, detail="Invalid stepIndex")
     step_text = steps[stepIndex]
     # Cache filename
-    safe_voice = req.voiceId.replace("/", "_")
-    filename = f"{req.sessionType}_{stepIndex}_{safe_voice}.mp3"
-    upload_dir = getattr(settings, "upload_dir", "uploads")
-    os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, filename)
+    filename = one_tap_audio.step_filename(req.sessionType, stepIndex, req.voiceId)
+    file_path = os.path.join(one_tap_audio.upload_dir(), filename)
     audio_url = f"/uploads/{filename}"
+    prefetcher = prefetch.get_prefetcher()
+    prefetcher.record_request(filename)
+    session_key = sessionId or f"{req.sessionType}:{req.voiceId}"
     # If file exists, return it
     if os.path.exists(file_path):
+        prefetcher.schedule(session_key, req.sessionType, req.voiceId, steps, stepIndex)
         return {"audioUrl": audio_url, "scriptStep": step_text}
     # Otherwise, generate audio for this step
-    url = f"https://api.elevenlabs.io/v1/text-to-speech/{req.voiceId}"
-    headers = {
-        "Accept": "audio/mpeg",
-        "Content-Type": "application/json",
-        "xi-api-key": settings.eleven_labs_api_key
-    }
-    data = {
-        "text": step_text,
-        "model_id": getattr(settings, "eleven_labs_model", "eleven_monolingual_v1"),
-        "voice_settings": {
-            "stability": 0.5,
-            "similarity_boost": 0.75
-        }
-    }
-    response = requests.post(url, json=data, headers=headers)
-    if response.status_code == 200:
-        with open(file_path, "wb") as f:
-            f.write(response.content)
-        return {"audioUrl": audio_url, "scriptStep": step_text}
+    path = one_tap_audio.ensure_step_clip(req.sessionType, stepIndex, req.voiceId, step_text, hedge=True)
+    if path:
+        # Replace the estimated offset for this step with a measured one
+        timings = one_tap_audio.get_timing_index(req.sessionType, req.voiceId)
+        if timings and timings[stepIndex]["estimated"]:
+            one_tap_audio.build_timing_index(req.sessionType, req.voiceId, steps)
+        # Queued after this step's own synthesis, so prefetch never delays the step being waited on
+        prefetcher.schedule(session_key, req.sessionType, req.voiceId, steps, stepIndex)
+        # A fallback provider's clip has its own filename
+        return {"audioUrl": f"/uploads/{os.path.basename(path)}", "scriptStep": step_text}
     else:
         # Fallback: use a random existing audio file if available
         fallback_url = get_random_existing_audio_url()
@@ -173,19 +168,41 @@ def one_tap_step_audio(
             raise HTTPException(status_code=500, detail="Failed to generate audio and no fallback available")
         return {"audioUrl": fallback_url, "scriptStep": step_text}
 
+@router.post("/one-tap/session/{session_id}/stop")
+def stop_one_tap_session(session_id: str):
+    """Cancel step prefetch for a session the user has left"""
+    prefetch.get_prefetcher().stop(session_id)
+    return {"success": True, "sessionId": session_id}
+
+@router.get("/one-tap/prefetch/metrics", dependencies=[Depends(require_admin)])
+def get_prefetch_metrics():
+    """Prefetch counters shared across workers; hitRate is hits over hits plus misses"""
+    return prefetch.metrics()
+
+def _load_step_timings(session_type: str, voice_id: str) -> list[dict]:
+    steps = ONE_TAP_SCRIPTS.get(session_type)
+    if not steps:
+        raise HTTPException(status_code=400, detail="Invalid sessionType")
+    timings = one_tap_audio.get_timing_index(session_type, voice_id)
+    if timings is None:
+        timings = one_tap_audio.build_timing_index(session_type, voice_id, steps)
+    if timings is None:
+        raise HTTPException(status_code=404, detail="Session audio has not been generated for this voice")
+    return timings
+
+@router.get("/one-tap/timing/{session_type}")
+def get_session_timing(session_type: str, voice_id: str = Query(..., alias="voiceId")):
+    """Get start/end offsets of every step within the full session audio"""
+    timings = _load_step_timings(session_type, voice_id)
+    return {
+        "audioUrl": f"/uploads/{one_tap_audio.full_filename(session_type, voice_id)}",
+        "steps": timings
+    }
+
 @router.get("/one-tap/step-timing/{session_type}/{step_index}")
 def get_step_timing(session_type: str, step_index: int, voice_id: str = Query(..., alias="voiceId")):
     """Get timing information for a specific step"""
-    script = ONE_TAP_SCRIPTS.get(session_type)
-    if not script:
-        raise HTTPException(status_code=400, detail="Invalid sessionType")
-    
-    steps = [s.strip() for s in script.split("\n") if s.strip()]
-    if step_index < 0 or step_index >= len(steps):
+    timings = _load_step_timings(session_type, voice_id)
+    if step_index < 0 or step_index >= len(timings):
         raise HTTPException(status_code=400, detail="Invalid stepIndex")
-    
-    step_timings = estimate_step_timings(script)
-    if step_index < len(step_timings):
-        return step_timings[step_index]
-    
-    raise HTTPException(status_code=404, detail="Step timing not found")
+    return timings[step_index]
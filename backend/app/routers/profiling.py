@@ -0,0 +1,60 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+from app.auth import require_admin
+from app import profiling
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+class ProfileRequest(BaseModel):
+    path: str  # Route template, e.g. /api/meditate/start or /api/history/{user_id}
+    requests: int = 5
+    intervalMs: float = 5.0
+    allocations: bool = False
+
+@router.post("")
+def start_profile(req: ProfileRequest, request: Request):
+    """Profile the next N requests to a route; poll GET for progress and results"""
+    if not 1 <= req.requests <= 1000 or not 1 <= req.intervalMs <= 1000:
+        raise HTTPException(status_code=400, detail="requests must be 1-1000 and intervalMs 1-1000")
+    try:
+        session = profiling.start_session(request.app, req.path, req.requests, req.intervalMs, req.allocations)
+    except RuntimeError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    except LookupError as e:
+        raise HTTPException(status_code=404, detail=str(e))
+    return session.summary()
+
+def _session() -> profiling.ProfileSession:
+    session = profiling.get_session()
+    if session is None:
+        raise HTTPException(status_code=404, detail="No profiling session")
+    return session
+
+@router.get("")
+def get_profile():
+    return _session().summary()
+
+@router.delete("")
+def cancel_profile():
+    session = _session()
+    session.cancel()
+    return session.summary()
+
+@router.get("/cpu", response_class=PlainTextResponse)
+def get_cpu_profile():
+    """Sampled stacks in collapsed format (flamegraph.pl, speedscope), one sample per interval"""
+    return profiling.collapse(_session().samples)
+
+@router.get("/allocations", response_class=PlainTextResponse)
+def get_allocation_profile():
+    """Bytes allocated and still live per stack, in collapsed format"""
+    return profiling.collapse(_session().memory)
+
+@router.get("/loop-lag")
+def get_loop_lag():
+    """Times the event loop was blocked past LOOP_LAG_THRESHOLD_MS, with what it was running"""
+    report = profiling.loop_lag_report()
+    if report is None:
+        raise HTTPException(status_code=404, detail="Loop lag monitor is disabled")
+    return report
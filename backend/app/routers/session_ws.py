@@ -0,0 +1,329 @@
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect
+from typing import Any, Dict, Optional
+from datetime import datetime
+from app.config import settings
+from app.state import allow_call, get_state
+from app import admission, auth, fairness, one_tap_audio, similarity
+from app.routers import meditate, visualize, one_tap
+import asyncio
+import json
+import os
+import uuid
+
+router = APIRouter()
+
+SESSION_TTL = 3600  # Seconds a disconnected session can still be resumed
+# Wait this long after the last keystroke before generating the next question speculatively
+SPECULATION_DELAY = 0.8
+
+def _normalize(text: str) -> str:
+    return " ".join(str(text).split())
+
+class IntakeSession:
+    """Server-side state of one interactive session.
+
+    Holds the answers given so far and the current question, so clients send
+    only the new answer instead of the whole context. Saved to shared state
+    after every change so a dropped connection can resume on any worker.
+    """
+
+    def __init__(self, session_id: str, kind: str, fields: Dict[str, Any],
+                 answers: Optional[Dict[str, Any]] = None, index: int = 0, question: Optional[dict] = None,
+                 owner: Optional[str] = None):
+        self.session_id = session_id
+        self.kind = kind
+        self.owner = owner or auth.current_identity()
+        self.fields = fields
+        self.answers = answers or {}
+        self.index = index
+        self.question = question
+        self.speculation: Optional[asyncio.Task] = None
+        self.speculation_key = None
+        # Held for the whole of a speculative LLM call, so superseded drafts never stack up calls
+        self.upstream = asyncio.Lock()
+
+    @classmethod
+    def load(cls, session_id: str) -> Optional["IntakeSession"]:
+        """The stored session, only for the identity that started it: its answers are private"""
+        data = get_state().get_json(f"ws:{session_id}")
+        if not data or data.get("owner") != auth.current_identity():
+            return None
+        return cls(session_id, **data)
+
+    def save(self) -> None:
+        get_state().set_json(f"ws:{self.session_id}", {
+            "kind": self.kind, "fields": self.fields, "answers": self.answers,
+            "index": self.index, "question": self.question, "owner": self.owner,
+        }, ttl=SESSION_TTL)
+
+    def question_for(self, answers: Dict[str, Any], index: int) -> dict:
+        """Generate question `index` with the router's question code (blocking)"""
+        if self.kind == "meditation":
+            return meditate.get_next_meditation_question(meditate.MeditationQuestionRequest(
+                mood=self.fields.get("mood", ""),
+                previousAnswers=answers,
+                currentQuestionIndex=index
+            )).model_dump()
+        return visualize.get_next_visualization_question(visualize.VisualizationQuestionRequest(
+            goal=self.fields.get("goal", ""),
+            goalCategory=self.fields.get("goalCategory", ""),
+            goalComplexity=self.fields.get("goalComplexity", "Moderate"),
+            previousAnswers=answers,
+            currentQuestionIndex=index,
+            userExperienceLevel=self.fields.get("userExperienceLevel", "beginner")
+        )).model_dump()
+
+    def cancel_speculation(self) -> None:
+        if self.speculation:
+            self.speculation.cancel()
+        self.speculation, self.speculation_key = None, None
+
+    async def _speculate(self, answers: Dict[str, Any], index: int) -> Optional[dict]:
+        # Debounced: a newer draft cancels this task before it reaches the LLM
+        await asyncio.sleep(SPECULATION_DELAY)
+        async with self.upstream:
+            # Speculation is optional work, so it stops as soon as the LLM routes degrade at all
+            if admission.tracker.level("llm") > admission.NORMAL:
+                return None
+            if not _allowed("ws-speculation", getattr(settings, "ws_speculation_per_minute", 20)):
+                return None
+            with admission.step("llm"):
+                call = asyncio.ensure_future(asyncio.to_thread(self.question_for, answers, index))
+                try:
+                    return await asyncio.shield(call)
+                except asyncio.CancelledError:
+                    # Superseded mid-call: the request can't be aborted, so the next draft waits for it to end
+                    await asyncio.wait([call])
+                    raise
+
+    def draft(self, question_id: str, text: str) -> None:
+        """Start generating the next question from a partly typed answer"""
+        if not self.question or self.question["isLastQuestion"] or question_id != self.question["questionId"]:
+            return
+        key = (question_id, _normalize(text))
+        if not key[1] or key == self.speculation_key:
+            return
+        self.cancel_speculation()
+        self.speculation_key = key
+        self.speculation = asyncio.create_task(
+            self._speculate({**self.answers, question_id: text}, self.index + 1)
+        )
+
+    async def answer(self, question_id: str, text: str) -> Optional[dict]:
+        """Record an answer and return the next question, or None when the intake is complete"""
+        self.answers[question_id] = text
+        if self.question and self.question["isLastQuestion"]:
+            self.cancel_speculation()
+            self.question = None
+            self.save()
+            return None
+        question = None
+        if self.speculation and self.speculation_key == (question_id, _normalize(text)):
+            try:
+                question = await self.speculation
+            except (asyncio.CancelledError, Exception):
+                question = None
+            if question:
+                get_state().incr("metrics:ws:speculation_hit")
+        else:
+            self.cancel_speculation()
+        if question is None:
+            get_state().incr("metrics:ws:speculation_miss")
+            with admission.step("llm"):
+                question = await asyncio.to_thread(self.question_for, dict(self.answers), self.index + 1)
+        self.speculation, self.speculation_key = None, None
+        self.index += 1
+        self.question = question
+        self.save()
+        return question
+
+def _allowed(name: str, per_minute: Optional[int] = None) -> bool:
+    """Same buckets as state.rate_limited, so the socket and the HTTP routes share one limit"""
+    return allow_call(name, per_minute)
+
+async def _generate_meditation(websocket: WebSocket, session: IntakeSession) -> None:
+    req = meditate.MeditationStartRequest(
+        mood=session.fields.get("mood", ""),
+        voiceId=session.fields.get("voiceId", ""),
+        duration=session.fields.get("duration", 600),
+        allAnswers=session.answers,
+        backgroundMusic=session.fields.get("backgroundMusic", "")
+    )
+    playlist_url = ""
+    reused = await asyncio.to_thread(meditate.find_reusable_session, req)
+    if reused:
+        script, audio_url = reused
+        await websocket.send_json({"type": "script", "script": script})
+    else:
+        try:
+            script = await asyncio.to_thread(meditate.generate_meditation_script, req)
+        except Exception as e:
+            # Same template as the HTTP route; only the script failed, so it is still synthesized
+            print(f"Error in meditation generation: {e}")
+            script = meditate.fallback_meditation_script(req)
+        await websocket.send_json({"type": "script", "script": script})
+
+        # Segments are published from the synthesis thread; hand them to this loop as they land
+        loop = asyncio.get_running_loop()
+        events: asyncio.Queue = asyncio.Queue()
+        listener = lambda event: loop.call_soon_threadsafe(events.put_nowait, event)
+        audio_url, playlist_url = await asyncio.to_thread(
+            meditate.generate_progressive_audio, script, req.voiceId, listener
+        )
+        while audio_url:
+            event = await events.get()
+            if event["type"] == "ended":
+                break
+            await websocket.send_json({"type": "audio", **{k: v for k, v in event.items() if k != "type"}})
+        if audio_url and settings.script_reuse_enabled:
+            similarity.get_index().add(
+                meditate._reuse_partition(req), similarity.request_text(req.mood, req.allAnswers),
+                script, audio_url, req.allAnswers
+            )
+
+    if not audio_url:
+        await websocket.send_json({"type": "error", "detail": "Failed to generate audio"})
+        return
+    background_music = ""
+    if req.backgroundMusic:
+        audio_url, background_music = await asyncio.to_thread(
+            meditate.add_background_music, req, audio_url, playlist_url
+        )
+    created_at = datetime.utcnow().isoformat()
+    meditate.record_session_job(session.session_id, req, audio_url, created_at)
+    await websocket.send_json({
+        "type": "complete", "sessionId": session.session_id, "audioUrl": audio_url,
+        "playlistUrl": playlist_url, "backgroundMusic": background_music, "createdAt": created_at
+    })
+
+async def _generate_visualization(websocket: WebSocket, session: IntakeSession) -> None:
+    # Fair-shared like the HTTP route: waits for a slot and charges the quota
+    response = await visualize.start_visualization(visualize.VisualizationStartRequest(
+        goal=session.fields.get("goal", ""),
+        goalCategory=session.fields.get("goalCategory", ""),
+        goalComplexity=session.fields.get("goalComplexity", "Moderate"),
+        voiceId=session.fields.get("voiceId", ""),
+        allAnswers=session.answers,
+        identifiedChallenges=session.fields.get("identifiedChallenges", []),
+        userExperienceLevel=session.fields.get("userExperienceLevel", "beginner"),
+        sessionType=session.fields.get("sessionType", "goal_achievement")
+    ))
+    await websocket.send_json({"type": "script", "script": response.script})
+    await websocket.send_json({"type": "complete", **response.model_dump()})
+
+async def _stream_one_tap(websocket: WebSocket, req: one_tap.OneTapRequest) -> None:
+    """Push each one-tap step's audio as soon as it is synthesized, instead of the client polling step-audio"""
+    session_type, voice_id = req.sessionType, req.voiceId
+    steps = one_tap.ONE_TAP_SCRIPTS.get(session_type)
+    if not steps:
+        await websocket.send_json({"type": "error", "detail": "Invalid sessionType"})
+        return
+    for index, text in enumerate(steps):
+        path = await asyncio.to_thread(one_tap_audio.ensure_step_clip, session_type, index, voice_id, text)
+        if not path:
+            await websocket.send_json({"type": "error", "detail": f"Failed to generate audio for step {index}"})
+            return
+        await websocket.send_json({
+            "type": "step_audio", "stepIndex": index, "scriptStep": text,
+            "audioUrl": f"/uploads/{os.path.basename(path)}"
+        })
+    await websocket.send_json({"type": "complete", "steps": steps})
+
+@router.websocket("/session")
+async def session_channel(websocket: WebSocket):
+    """Interactive session over one connection, replacing the /questions -> /start -> step-audio round trips.
+
+    Client messages (JSON):
+      {"type": "start", "kind": "meditation" | "visualization", ...start fields}
+      {"type": "start", "sessionId": "..."}                 resume a session
+      {"type": "start", "kind": "one-tap", "sessionType": "...", "voiceId": "..."}
+      {"type": "draft", "questionId": "q1", "text": "..."}  answer as it is typed
+      {"type": "answer", "questionId": "q1", "text": "..."}
+      {"type": "generate"}                                  after the last answer
+
+    Server messages: session, question, intake_complete, script, audio (one
+    per playlist segment), step_audio, complete and error.
+    """
+    await websocket.accept()
+    session: Optional[IntakeSession] = None
+    try:
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                kind = message.get("type")
+            except (ValueError, AttributeError):
+                await websocket.send_json({"type": "error", "detail": "Messages must be JSON objects"})
+                continue
+
+            try:
+                if kind == "start":
+                    if session:
+                        session.cancel_speculation()
+                    if message.get("kind") == "one-tap":
+                        req = one_tap.OneTapRequest(
+                            **{k: v for k, v in message.items() if k in ("sessionType", "voiceId")}
+                        )
+                        missing = one_tap._missing_steps(req.sessionType, req.voiceId)
+                        with admission.step("one_tap", exempt=not missing):
+                            async with fairness.share(missing * one_tap.STEP_COST_MINUTES):
+                                await _stream_one_tap(websocket, req)
+                        continue
+                    session = IntakeSession.load(message["sessionId"]) if message.get("sessionId") else None
+                    if session is None and message.get("sessionId") and not message.get("kind"):
+                        # Expired, or started by someone else: the same answer either way
+                        await websocket.send_json({"type": "error", "detail": "Session not found"})
+                        continue
+                    if session is None:
+                        if message.get("kind") not in ("meditation", "visualization"):
+                            await websocket.send_json({"type": "error", "detail": "Unknown session kind"})
+                            continue
+                        fields = {k: v for k, v in message.items() if k not in ("type", "kind", "sessionId")}
+                        session = IntakeSession(str(uuid.uuid4()), message["kind"], fields)
+                        with admission.step("llm"):
+                            session.question = await asyncio.to_thread(session.question_for, {}, 0)
+                        session.save()
+                    await websocket.send_json({"type": "session", "sessionId": session.session_id,
+                                               "kind": session.kind, "answers": session.answers})
+                    if session.question:
+                        await websocket.send_json({"type": "question", **session.question})
+                    else:
+                        await websocket.send_json({"type": "intake_complete"})
+
+                elif session is None:
+                    await websocket.send_json({"type": "error", "detail": "Send a start message first"})
+
+                elif kind == "draft":
+                    session.draft(message.get("questionId", ""), message.get("text", ""))
+
+                elif kind == "answer":
+                    question = await session.answer(message.get("questionId", ""), message.get("text", ""))
+                    if question:
+                        await websocket.send_json({"type": "question", **question})
+                    else:
+                        await websocket.send_json({"type": "intake_complete"})
+
+                elif kind == "generate":
+                    if not _allowed(f"{session.kind}-start"):
+                        await websocket.send_json({"type": "error", "detail": "Too many requests, please slow down"})
+                    elif session.kind == "meditation":
+                        with admission.step("session"):
+                            async with fairness.share(session.fields.get("duration", 600) / 60):
+                                await _generate_meditation(websocket, session)
+                    else:
+                        with admission.step("session"):
+                            await _generate_visualization(websocket, session)
+
+                else:
+                    await websocket.send_json({"type": "error", "detail": f"Unknown message type: {kind}"})
+
+            except WebSocketDisconnect:
+                raise
+            except HTTPException as e:
+                # Fair-share and admission refusals: not signed in, no slot in time, quota used up, shedding
+                await websocket.send_json({"type": "error", "status": e.status_code, "detail": e.detail})
+            except Exception as e:
+                print(f"Error in session channel: {e}")
+                await websocket.send_json({"type": "error", "detail": "Failed to process message"})
+    except WebSocketDisconnect:
+        if session:
+            session.cancel_speculation()
@@ -0,0 +1,21 @@
+from fastapi import APIRouter, Depends
+from pydantic import BaseModel
+from typing import Optional
+from app.auth import create_access_token, require_admin
+from app.config import settings
+
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+class TokenRequest(BaseModel):
+    userId: str
+    expiresMinutes: Optional[int] = None
+
+@router.post("")
+def issue_token(req: TokenRequest):
+    """Issue an access token for a user, for the sign-in service and for testing"""
+    minutes = req.expiresMinutes or settings.access_token_expire_minutes
+    return {
+        "accessToken": create_access_token(req.userId, minutes),
+        "tokenType": "bearer",
+        "expiresIn": minutes * 60,
+    }
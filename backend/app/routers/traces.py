@@ -0,0 +1,23 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from typing import Optional
+from app import tracing
+from app.auth import require_admin
+
+# Traces carry request paths and timings of every user, so they are for operators only
+router = APIRouter(dependencies=[Depends(require_admin)])
+
+@router.get("")
+def list_slow_traces(
+    limit: int = Query(20, ge=1, le=200),
+    minMs: float = Query(0, ge=0),
+    path: Optional[str] = None
+):
+    """Span trees of recent requests slower than TRACE_SLOW_MS on this worker, newest first"""
+    return {"traces": tracing.slow_traces(limit, minMs, path)}
+
+@router.get("/{trace_id}")
+def get_trace(trace_id: str):
+    trace = tracing.get_slow_trace(trace_id)
+    if trace is None:
+        raise HTTPException(status_code=404, detail="Trace not found (only slow requests are kept)")
+    return trace
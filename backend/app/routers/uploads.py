@@ -0,0 +1,187 @@
+from fastapi import APIRouter, Depends, HTTPException, Request
+from app.config import settings
+from app.state import rate_limited
+import hashlib
+import os
+import uuid
+
+router = APIRouter()
+
+UPLOAD_KINDS = ("ambient", "voice")
+CHUNK_SIZE = 64 * 1024
+SNIFF_BYTES = 2048
+# Room for the multipart boundaries and part headers around the file itself
+MULTIPART_OVERHEAD = 16 * 1024
+
+ALLOWED_TYPES = {
+    "audio/mpeg": ".mp3",
+    "audio/wav": ".wav",
+    "audio/x-wav": ".wav",
+    "audio/ogg": ".ogg",
+    "audio/flac": ".flac",
+    "audio/x-flac": ".flac",
+    "audio/mp4": ".m4a",
+    "audio/x-m4a": ".m4a",
+}
+
+def library_dir() -> str:
+    directory = os.path.join(getattr(settings, "upload_dir", "uploads"), "library")
+    os.makedirs(directory, exist_ok=True)
+    return directory
+
+def sniff_mime(head: bytes) -> str:
+    """MIME type from a file's first bytes, via libmagic when python-magic is installed"""
+    try:
+        import magic
+
+        return magic.from_buffer(head, mime=True)
+    except Exception:
+        pass
+    if head[:3] == b"ID3" or (len(head) > 1 and head[0] == 0xFF and (head[1] & 0xE0) == 0xE0):
+        return "audio/mpeg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WAVE":
+        return "audio/wav"
+    if head[:4] == b"OggS":
+        return "audio/ogg"
+    if head[:4] == b"fLaC":
+        return "audio/flac"
+    if head[4:8] == b"ftyp":
+        return "audio/mp4"
+    return "application/octet-stream"
+
+class _FilePart:
+    """Collects the bytes of the multipart "file" part as the parser emits them"""
+
+    def __init__(self):
+        self.header_field = b""
+        self.header_value = b""
+        self.disposition = b""
+        self.in_file = False
+        self.seen_file = False
+        self.pending = []
+
+    def callbacks(self) -> dict:
+        return {
+            "on_part_begin": self.on_part_begin,
+            "on_header_field": lambda data, start, end: self._add("header_field", data[start:end]),
+            "on_header_value": lambda data, start, end: self._add("header_value", data[start:end]),
+            "on_header_end": self.on_header_end,
+            "on_headers_finished": self.on_headers_finished,
+            "on_part_data": self.on_part_data,
+            "on_part_end": self.on_part_end,
+        }
+
+    def _add(self, name: str, data: bytes) -> None:
+        setattr(self, name, getattr(self, name) + data)
+
+    def on_part_begin(self) -> None:
+        self.disposition = b""
+
+    def on_header_end(self) -> None:
+        if self.header_field.lower() == b"content-disposition":
+            self.disposition = self.header_value
+        self.header_field, self.header_value = b"", b""
+
+    def on_headers_finished(self) -> None:
+        from multipart.multipart import parse_options_header
+
+        _, options = parse_options_header(self.disposition)
+        self.in_file = options.get(b"name") == b"file" and not self.seen_file
+
+    def on_part_data(self, data: bytes, start: int, end: int) -> None:
+        if self.in_file:
+            self.pending.append(data[start:end])
+
+    def on_part_end(self) -> None:
+        if self.in_file:
+            self.seen_file = True
+        self.in_file = False
+
+    def take(self) -> bytes:
+        data = b"".join(self.pending)
+        self.pending = []
+        return data
+
+@router.post("/{kind}", dependencies=[Depends(rate_limited("upload", per_minute=10))])
+async def upload_audio(kind: str, request: Request):
+    """Upload a custom ambient track or voice sample as multipart/form-data with a "file" field.
+
+    The body is streamed to disk in fixed-size chunks and hashed as it is
+    written, so it is never held in memory. Oversized bodies are rejected as
+    soon as they cross MAX_FILE_SIZE, and the type is sniffed from the first
+    bytes. Identical content is stored once, under its SHA-256.
+    """
+    import aiofiles
+    from multipart.multipart import MultipartParser, parse_options_header
+
+    if kind not in UPLOAD_KINDS:
+        raise HTTPException(status_code=404, detail="Unknown upload kind")
+    content_type, options = parse_options_header(request.headers.get("content-type", ""))
+    if content_type != b"multipart/form-data" or b"boundary" not in options:
+        raise HTTPException(status_code=400, detail="Expected multipart/form-data")
+    max_size = settings.max_file_size
+    declared = request.headers.get("content-length")
+    if declared and declared.isdigit() and int(declared) > max_size + MULTIPART_OVERHEAD:
+        raise HTTPException(status_code=413, detail=f"File exceeds {max_size} bytes")
+
+    part = _FilePart()
+    parser = MultipartParser(options[b"boundary"], part.callbacks())
+    digest = hashlib.sha256()
+    directory = library_dir()
+    tmp_path = os.path.join(directory, f".{uuid.uuid4()}.part")
+    size = 0
+    head = b""
+    mime = None
+    try:
+        async with aiofiles.open(tmp_path, "wb") as f:
+            async for chunk in request.stream():
+                # Re-slice so a large network read is still written in fixed-size pieces
+                for offset in range(0, len(chunk), CHUNK_SIZE):
+                    parser.write(chunk[offset:offset + CHUNK_SIZE])
+                    data = part.take()
+                    if not data:
+                        continue
+                    size += len(data)
+                    if size > max_size:
+                        raise HTTPException(status_code=413, detail=f"File exceeds {max_size} bytes")
+                    if mime is None:
+                        head += data[:SNIFF_BYTES - len(head)]
+                        if len(head) >= SNIFF_BYTES:
+                            mime = sniff_mime(head)
+                            if mime not in ALLOWED_TYPES:
+                                raise HTTPException(status_code=415, detail=f"Unsupported file type: {mime}")
+                    digest.update(data)
+                    await f.write(data)
+            parser.finalize()
+        if not part.seen_file or size == 0:
+            raise HTTPException(status_code=400, detail="No file field in upload")
+        if mime is None:
+            mime = sniff_mime(head)
+            if mime not in ALLOWED_TYPES:
+                raise HTTPException(status_code=415, detail=f"Unsupported file type: {mime}")
+
+        filename = digest.hexdigest() + ALLOWED_TYPES[mime]
+        final_path = os.path.join(directory, filename)
+        duplicate = os.path.exists(final_path)
+        if duplicate:
+            os.remove(tmp_path)
+        else:
+            os.replace(tmp_path, final_path)
+    except HTTPException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    except Exception as e:
+        print(f"Error receiving upload: {e}")
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise HTTPException(status_code=400, detail="Malformed upload")
+
+    return {
+        "kind": kind,
+        "uploadId": filename.rsplit(".", 1)[0],
+        "url": f"/uploads/library/{filename}",
+        "size": size,
+        "mimeType": mime,
+        "duplicate": duplicate,
+    }
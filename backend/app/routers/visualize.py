@@ -1,21 +1,29 @@
-from fastapi import APIRouter, HTTPException
+from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
 from typing import Dict, Any, List, Optional
 from datetime import datetime
 from app.config import settings
-import openai
+from app.clients import chat_completion, get_tts_client, script_completion
+from app.tts import synthesize_speech
+from app.state import get_state, rate_limited
+from app.response_cache import cached_response
+from app.goal_categories import GOAL_CATEGORIES
+from app import assets, auth, calibration, classifier, fairness, prompts, tracing
 import uuid
-import requests
 import os
 import random
 
 router = APIRouter()
-openai.api_key = settings.openai_api_key
+
+# The visualization prompt asks for 5-7 minutes; scripts are sized for the middle of that
+VISUALIZATION_SECONDS = 360
+# Goal analysis and challenges only vary by category, so entries can live long; the TTL bounds stale timelines
+CATEGORY_CACHE_TTL = 24 * 3600
 
 # Enhanced Models for Visualization Coach
 class GoalAnalysisRequest(BaseModel):
     goal: str
-    category: str
+    category: str = ""  # Inferred from the goal text when empty or unknown
     timeline: str
     currentEmotionalState: str
     desiredEmotionalState: str
@@ -26,6 +34,7 @@ class GoalAnalysisResponse(BaseModel):
     recommendedApproach: str
     successFactors: List[str]
     estimatedTimeline: str
+    category: Optional[str] = None  # Category the analysis was based on
 
 class VisualizationQuestionRequest(BaseModel):
     goal: str
@@ -84,137 +93,49 @@ class SessionCompleteRequest(BaseModel):
     notes: Optional[str] = None
     clarityScore: Optional[int] = None
     confidenceScore: Optional[int] = None
-
-# Goal Categories and their characteristics
-GOAL_CATEGORIES = {
-    "career": {
-        "keywords": ["job", "career", "business", "work", "professional", "promotion", "startup"],
-        "common_challenges": ["imposter syndrome", "work-life balance", "skill gaps", "networking"],
-        "success_factors": ["clear planning", "skill development", "networking", "persistence"]
-    },
-    "health": {
-        "keywords": ["health", "fitness", "weight", "exercise", "diet", "wellness", "medical"],
-        "common_challenges": ["motivation", "time management", "consistency", "plateaus"],
-        "success_factors": ["habit formation", "realistic goals", "support system", "tracking"]
-    },
-    "relationships": {
-        "keywords": ["relationship", "love", "marriage", "family", "friendship", "dating"],
-        "common_challenges": ["communication", "trust issues", "time investment", "expectations"],
-        "success_factors": ["open communication", "patience", "understanding", "quality time"]
-    },
-    "personal_growth": {
-        "keywords": ["growth", "development", "learning", "self-improvement", "confidence", "mindset"],
-        "common_challenges": ["self-doubt", "fear of failure", "comfort zone", "comparison"],
-        "success_factors": ["self-awareness", "continuous learning", "resilience", "authenticity"]
-    },
-    "financial": {
-        "keywords": ["money", "finance", "wealth", "investment", "savings", "debt", "income"],
-        "common_challenges": ["financial literacy", "discipline", "market volatility", "debt"],
-        "success_factors": ["education", "discipline", "diversification", "long-term thinking"]
-    },
-    "creative": {
-        "keywords": ["creative", "art", "music", "writing", "design", "innovation", "expression"],
-        "common_challenges": ["creative blocks", "perfectionism", "criticism", "consistency"],
-        "success_factors": ["regular practice", "experimentation", "feedback", "authenticity"]
-    }
-}
+    userId: Optional[str] = None  # Record in the user's session history when set
 
 @router.post("/goal-analysis", response_model=GoalAnalysisResponse)
+@cached_response(ttl=CATEGORY_CACHE_TTL, key=lambda req: {
+    "category": classifier.resolve_goal_category(req.category, req.goal), "timeline": req.timeline})
 def analyze_goal(req: GoalAnalysisRequest):
-    """Analyze goal complexity and identify potential challenges"""
-    try:
-        # Create context for goal analysis
-        context = f"""
-        Goal: {req.goal}
-        Category: {req.category}
-        Timeline: {req.timeline}
-        Current Emotional State: {req.currentEmotionalState}
-        Desired Emotional State: {req.desiredEmotionalState}
-        
-        Analyze this goal and provide:
-        1. Complexity level (Simple/Moderate/Complex)
-        2. 3-5 potential challenges
-        3. Recommended approach
-        4. 3-5 success factors
-        5. Realistic timeline estimate
-        
-        Return as JSON format.
-        """
-        
-        response = openai.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {"role": "system", "content": "You are a goal analysis expert. Analyze goals and provide structured insights. Return responses in JSON format."},
-                {"role": "user", "content": context}
-            ],
-            max_tokens=400,
-            temperature=0.7,
-        )
-        
-        # Parse the response (in a real app, you'd use proper JSON parsing)
-        analysis_text = response.choices[0].message.content.strip()
-        
-        # Fallback analysis based on category
-        category_info = GOAL_CATEGORIES.get(req.category.lower(), GOAL_CATEGORIES["personal_growth"])
-        
-        return GoalAnalysisResponse(
-            goalComplexity="Moderate",  # Default, would be parsed from AI response
-            potentialChallenges=category_info["common_challenges"][:3],
-            recommendedApproach=f"Focus on {category_info['success_factors'][0]} and {category_info['success_factors'][1]}",
-            successFactors=category_info["success_factors"],
-            estimatedTimeline=req.timeline
-        )
-        
-    except Exception as e:
-        print(f"Error analyzing goal: {e}")
-        # Fallback response
-        category_info = GOAL_CATEGORIES.get(req.category.lower(), GOAL_CATEGORIES["personal_growth"])
-        return GoalAnalysisResponse(
-            goalComplexity="Moderate",
-            potentialChallenges=category_info["common_challenges"][:3],
-            recommendedApproach=f"Focus on {category_info['success_factors'][0]} and {category_info['success_factors'][1]}",
-            successFactors=category_info["success_factors"],
-            estimatedTimeline=req.timeline
-        )
+    """Analyze goal complexity and identify potential challenges.
+
+    Built from the category defaults without an LLM call; the category is
+    inferred from the goal text when not given. Cached per resolved
+    category and timeline, not per user, so every goal in a category
+    shares an entry without seeing anything another user sent.
+    """
+    category = classifier.resolve_goal_category(req.category, req.goal)
+    category_info = GOAL_CATEGORIES[category]
+    return GoalAnalysisResponse(
+        goalComplexity="Moderate",
+        potentialChallenges=category_info["common_challenges"][:3],
+        recommendedApproach=f"Focus on {category_info['success_factors'][0]} and {category_info['success_factors'][1]}",
+        successFactors=category_info["success_factors"],
+        estimatedTimeline=req.timeline,
+        category=category
+    )
 
 @router.post("/questions", response_model=DynamicQuestionResponse)
 def get_next_visualization_question(req: VisualizationQuestionRequest):
     """Generate dynamic questions based on goal analysis and previous answers"""
     try:
-        # Create context from previous answers
-        context = ""
-        if req.previousAnswers:
-            context = "Previous answers:\n"
-            for question_id, answer in req.previousAnswers.items():
-                context += f"- {question_id}: {answer}\n"
-        
         # Generate personalized question based on goal and context
-        prompt = f"""
-        You are a visualization coach conducting a goal-setting session.
-        
-        Goal: {req.goal}
-        Category: {req.goalCategory}
-        Complexity: {req.goalComplexity}
-        User Experience: {req.userExperienceLevel}
-        Current Question: {req.currentQuestionIndex + 1} of 5
-        
-        {context}
-        
-        Generate the next personalized question that:
-        - Builds upon previous answers
-        - Is appropriate for {req.userExperienceLevel} level
-        - Helps identify challenges or solutions
-        - Moves toward creating a vivid visualization
-        
-        Return only the question text.
-        """
+        messages = prompts.build_messages(
+            "visualization_question",
+            answers=req.previousAnswers,
+            goal=req.goal,
+            category=req.goalCategory,
+            complexity=req.goalComplexity,
+            experience=req.userExperienceLevel,
+            question_number=req.currentQuestionIndex + 1
+        )
         
-        response = openai.chat.completions.create(
+        response = chat_completion(
+            hedge=True,
             model=settings.openai_model,
-            messages=[
-                {"role": "system", "content": "You are a visualization expert who asks thoughtful, personalized questions to help people achieve their goals."},
-                {"role": "user", "content": prompt}
-            ],
+            messages=messages,
             max_tokens=100,
             temperature=0.7,
         )
@@ -222,13 +143,7 @@ def get_next_visualization_question(req: VisualizationQuestionRequest):
         question = response.choices[0].message.content.strip()
         
         # Determine question type based on content
-        question_type = "text"
-        if any(word in question.lower() for word in ["how long", "how much", "how many", "rate", "scale"]):
-            question_type = "scale"
-        elif any(word in question.lower() for word in ["describe", "explain", "tell me about"]):
-            question_type = "textarea"
-        elif any(word in question.lower() for word in ["yes", "no", "are you", "do you"]):
-            question_type = "single"
+        question_type = classifier.visualization_question_type(question)
         
         return DynamicQuestionResponse(
             nextQuestion=question,
@@ -265,115 +180,45 @@ def get_next_visualization_question(req: VisualizationQuestionRequest):
         )
 
 @router.post("/challenges", response_model=ChallengeResponse)
+@cached_response(ttl=CATEGORY_CACHE_TTL,
+                 key=lambda req: classifier.resolve_goal_category(req.goalCategory, req.goal))
 def identify_challenges(req: ChallengeIdentificationRequest):
-    """Identify potential challenges and generate solutions"""
-    try:
-        # Create context from all answers
-        answers_context = ""
-        if req.allAnswers:
-            answers_context = "User's responses:\n"
-            for question_id, answer in req.allAnswers.items():
-                answers_context += f"- {question_id}: {answer}\n"
-        
-        prompt = f"""
-        Analyze this goal and identify challenges and solutions:
-        
-        Goal: {req.goal}
-        Category: {req.goalCategory}
-        {answers_context}
-        
-        Provide:
-        1. 3-4 primary challenges
-        2. 2-3 secondary challenges
-        3. Specific solutions for each challenge
-        4. Helpful resources (books, tools, people)
-        5. Mindset shifts needed
-        
-        Return as structured analysis.
-        """
-        
-        response = openai.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {"role": "system", "content": "You are a problem-solving expert who identifies challenges and provides practical solutions."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=600,
-            temperature=0.7,
-        )
-        
-        analysis_text = response.choices[0].message.content.strip()
-        
-        # Fallback challenges based on category
-        category_info = GOAL_CATEGORIES.get(req.goalCategory.lower(), GOAL_CATEGORIES["personal_growth"])
-        
-        return ChallengeResponse(
-            primaryChallenges=category_info["common_challenges"][:3],
-            secondaryChallenges=["Time management", "Consistency"],
-            solutions=[
-                {"challenge": "Motivation", "solution": "Create a clear vision and break goals into smaller steps"},
-                {"challenge": "Time management", "solution": "Schedule dedicated time blocks and eliminate distractions"},
-                {"challenge": "Consistency", "solution": "Build habits and track progress regularly"}
-            ],
-            resources=[
-                {"type": "Book", "resource": "Atomic Habits by James Clear"},
-                {"type": "Tool", "resource": "Goal tracking app"},
-                {"type": "Support", "resource": "Accountability partner or coach"}
-            ],
-            mindsetShifts=[
-                "Focus on progress over perfection",
-                "Embrace challenges as growth opportunities",
-                "Trust the process and stay patient"
-            ]
-        )
-        
-    except Exception as e:
-        print(f"Error identifying challenges: {e}")
-        # Fallback response
-        category_info = GOAL_CATEGORIES.get(req.goalCategory.lower(), GOAL_CATEGORIES["personal_growth"])
-        return ChallengeResponse(
-            primaryChallenges=category_info["common_challenges"][:3],
-            secondaryChallenges=["Time management", "Consistency"],
-            solutions=[
-                {"challenge": "Motivation", "solution": "Create a clear vision and break goals into smaller steps"},
-                {"challenge": "Time management", "solution": "Schedule dedicated time blocks and eliminate distractions"}
-            ],
-            resources=[
-                {"type": "Book", "resource": "Atomic Habits by James Clear"},
-                {"type": "Tool", "resource": "Goal tracking app"}
-            ],
-            mindsetShifts=[
-                "Focus on progress over perfection",
-                "Embrace challenges as growth opportunities"
-            ]
-        )
+    """Identify potential challenges and generate solutions.
+
+    Category defaults without an LLM call, cached per resolved category
+    like analyze_goal: the response never holds another user's data.
+    """
+    category = classifier.resolve_goal_category(req.goalCategory, req.goal)
+    category_info = GOAL_CATEGORIES[category]
+    return ChallengeResponse(
+        primaryChallenges=category_info["common_challenges"][:3],
+        secondaryChallenges=["Time management", "Consistency"],
+        solutions=[
+            {"challenge": "Motivation", "solution": "Create a clear vision and break goals into smaller steps"},
+            {"challenge": "Time management", "solution": "Schedule dedicated time blocks and eliminate distractions"},
+            {"challenge": "Consistency", "solution": "Build habits and track progress regularly"}
+        ],
+        resources=[
+            {"type": "Book", "resource": "Atomic Habits by James Clear"},
+            {"type": "Tool", "resource": "Goal tracking app"},
+            {"type": "Support", "resource": "Accountability partner or coach"}
+        ],
+        mindsetShifts=[
+            "Focus on progress over perfection",
+            "Embrace challenges as growth opportunities",
+            "Trust the process and stay patient"
+        ]
+    )
 
+@tracing.traced()
 def generate_audio_with_elevenlabs(text: str, voice_id: str) -> str:
     """Generate audio using ElevenLabs API"""
     try:
         print(f"Starting audio generation for voice_id: {voice_id}")
-        url = f"https://api.elevenlabs.io/v1/text-to-speech/{voice_id}"
-        
-        headers = {
-            "Accept": "audio/mpeg",
-            "Content-Type": "application/json",
-            "xi-api-key": settings.eleven_labs_api_key
-        }
-        
-        data = {
-            "text": text,
-            "model_id": "eleven_monolingual_v1",
-            "voice_settings": {
-                "stability": 0.5,
-                "similarity_boost": 0.5
-            }
-        }
-        
         print(f"Making request to ElevenLabs API...")
-        response = requests.post(url, json=data, headers=headers)
-        print(f"ElevenLabs response status: {response.status_code}")
+        audio = synthesize_speech(text, voice_id, similarity_boost=0.5)
         
-        if response.status_code == 200:
+        if audio:
             # Save audio file
             session_id = str(uuid.uuid4())
             audio_filename = f"{session_id}.mp3"
@@ -382,19 +227,20 @@ def generate_audio_with_elevenlabs(text: str, voice_id: str) -> str:
             # Ensure uploads directory exists
             os.makedirs("uploads", exist_ok=True)
             
-            with open(audio_path, "wb") as f:
-                f.write(response.content)
+            with tracing.span("disk.write", bytes=len(audio)), open(audio_path, "wb") as f:
+                f.write(audio)
+            assets.record(audio_filename, sessionType="visualization", voiceId=voice_id)
             
             print(f"Audio file saved to: {audio_path}")
             return f"/uploads/{audio_filename}"
         else:
-            print(f"ElevenLabs API error: {response.status_code} - {response.text}")
             return None
             
     except Exception as e:
         print(f"Error generating audio: {e}")
         return None
 
+@tracing.traced("disk.fallback_scan")
 def get_random_existing_audio_url():
     uploads_dir = "uploads"
     try:
@@ -406,52 +252,42 @@ def get_random_existing_audio_url():
         print(f"Error selecting fallback audio: {e}")
     return None
 
-@router.post("/start", response_model=VisualizationResponse)
+def record_session_job(session_id: str, req: VisualizationStartRequest, audio_url: Optional[str], created_at: str):
+    """Share session metadata with every worker so completion can be matched to it"""
+    get_state().set_job(
+        session_id, status="ready", sessionType="visualization", goal=req.goal,
+        goalCategory=req.goalCategory, voiceId=req.voiceId, audioUrl=audio_url, createdAt=created_at,
+        owner=auth.current_identity()
+    )
+
+@router.post("/start", response_model=VisualizationResponse,
+             dependencies=[Depends(rate_limited("visualize-start"))])
+@fairness.fair_share(cost=lambda req: VISUALIZATION_SECONDS / 60)
 def start_visualization(req: VisualizationStartRequest):
     """Start a visualization session with personalized script and audio"""
     try:
-        # Create detailed context from all answers and challenges
-        answers_context = ""
-        if req.allAnswers:
-            answers_context = "User's detailed responses:\n"
-            for question_id, answer in req.allAnswers.items():
-                answers_context += f"- {question_id}: {answer}\n"
-        
         challenges_context = ""
         if req.identifiedChallenges:
             challenges_context = f"Identified challenges: {', '.join(req.identifiedChallenges)}\n"
         
-        # Generate personalized visualization script using OpenAI
-        prompt = f"""
-        Create a {req.sessionType} visualization script for someone with a {req.goalComplexity} goal: {req.goal}
-        
-        {answers_context}
-        {challenges_context}
-        
-        The script should be:
-        - Deeply personalized based on their goal and answers
-        - Address specific challenges they've identified
-        - Include vivid sensory details (sight, sound, touch, emotion)
-        - Use calming, motivational language
-        - Include specific action steps within the visualization
-        - Written for {req.userExperienceLevel} level
-        - Approximately 5-7 minutes when spoken
-        - Include natural pauses for reflection (indicated by "...")
-        
-        Make it feel like a personal coaching session that guides them to their goal.
-        Return only the visualization script text.
-        """
+        # Generate personalized visualization script using OpenAI, sized to the voice's speaking rate
+        words = calibration.target_words(VISUALIZATION_SECONDS, req.voiceId)
+        messages = prompts.build_messages(
+            "visualization_script",
+            answers=req.allAnswers,
+            answers_header="User's detailed responses:",
+            session_type=req.sessionType,
+            complexity=req.goalComplexity,
+            goal=req.goal,
+            challenges=challenges_context,
+            experience=req.userExperienceLevel,
+            minutes="5-7",
+            words=words
+        )
         
-        response = openai.chat.completions.create(
-            model=settings.openai_model,
-            messages=[
-                {"role": "system", "content": "You are a visualization expert who creates deeply personalized, vivid visualization scripts that help people achieve their goals and overcome challenges."},
-                {"role": "user", "content": prompt}
-            ],
-            max_tokens=800,
-            temperature=0.7,
+        script = calibration.trim_script(
+            script_completion(messages, words, model=settings.openai_model, temperature=0.7), words
         )
-        script = response.choices[0].message.content.strip()
         
         # Generate audio using ElevenLabs
         print(f"Generating audio for script length: {len(script)}")
@@ -475,6 +311,8 @@ def start_visualization(req: VisualizationStartRequest):
         ]
         
         session_id = str(uuid.uuid4())
+        created_at = datetime.utcnow().isoformat()
+        record_session_job(session_id, req, audio_url, created_at)
         
         return VisualizationResponse(
             sessionId=session_id,
@@ -485,7 +323,7 @@ def start_visualization(req: VisualizationStartRequest):
             challenges=req.identifiedChallenges,
             solutions=[],  # Would be populated from challenge analysis
             actionPlan=action_plan,
-            createdAt=datetime.utcnow().isoformat(),
+            createdAt=created_at,
             voiceId=req.voiceId,
             sessionType=req.sessionType
         )
@@ -508,6 +346,8 @@ def start_visualization(req: VisualizationStartRequest):
         audio_url = None
         
     session_id = str(uuid.uuid4())
+    created_at = datetime.utcnow().isoformat()
+    record_session_job(session_id, req, audio_url, created_at)
         
     return VisualizationResponse(
         sessionId=session_id,
@@ -518,7 +358,7 @@ def start_visualization(req: VisualizationStartRequest):
             challenges=req.identifiedChallenges,
             solutions=[],
             actionPlan=["Review your visualization daily", "Take one small action today"],
-        createdAt=datetime.utcnow().isoformat(),
+        createdAt=created_at,
             voiceId=req.voiceId,
             sessionType=req.sessionType
         )
@@ -526,6 +366,9 @@ def start_visualization(req: VisualizationStartRequest):
 @router.post("/session/{session_id}/complete")
 def complete_visualization_session(session_id: str, req: SessionCompleteRequest):
     """Complete a visualization session with optional feedback"""
+    if req.userId:
+        # History is only recorded for the signed-in user it belongs to
+        auth.require_user(req.userId, owner=(get_state().get_job(session_id) or {}).get("owner"))
     try:
         print(f"Completing visualization session: {session_id}")
         print(f"Request data: rating={req.rating}, notes={req.notes}")
@@ -543,6 +386,17 @@ def complete_visualization_session(session_id: str, req: SessionCompleteRequest)
         
         print(f"Visualization session completed: {completion_data}")
         
+        if req.userId:
+            from app import history  # SQLAlchemy loads on first completion, not at startup
+            
+            job = get_state().get_job(session_id) or {}
+            history.record_completion(
+                session_id, req.userId, "visualization", created_at=job.get("createdAt"),
+                rating=req.rating, notes=req.notes, clarity_score=req.clarityScore,
+                confidence_score=req.confidenceScore, goal=job.get("goal"),
+                voiceId=job.get("voiceId"), audioUrl=job.get("audioUrl")
+            )
+        
         return {
             "success": True,
             "message": "Visualization session completed successfully",
@@ -558,13 +412,7 @@ def complete_visualization_session(session_id: str, req: SessionCompleteRequest)
 def get_available_voices():
     """Get available voices for visualization guidance"""
     try:
-        url = "https://api.elevenlabs.io/v1/voices"
-        headers = {
-            "Accept": "application/json",
-            "xi-api-key": settings.eleven_labs_api_key
-        }
-        
-        response = requests.get(url, headers=headers)
+        response = get_tts_client().get("/voices")
         
         if response.status_code == 200:
             voices_data = response.json()
@@ -0,0 +1,193 @@
+from typing import Any, Dict, List, Optional
+from app.config import settings
+from app import tracing
+import json
+import math
+import os
+import re
+import threading
+import zlib
+
+# Hashed term space; large enough that collisions between intake answers are rare
+DIMENSIONS = 1 << 18
+
+_TOKEN = re.compile(r"[a-z0-9']+")
+# Where a user's answer was quoted in a stored script, filled with the next user's answer on reuse
+_MARKER = re.compile(r"\{\{answer:([^}]*)\}\}")
+# Sentence boundaries, kept as separators so the pauses and line breaks in scripts survive
+_BOUNDARY = re.compile(r"((?<=[.!?])\s+|\n+)")
+# Consecutive answer words that mark a sentence as echoing someone's own phrasing
+SHINGLE_WORDS = 4
+
+def _term_counts(text: str) -> Dict[int, int]:
+    counts: Dict[int, int] = {}
+    words = _TOKEN.findall(text.lower())
+    # Unigrams plus bigrams, so "not stressed" and "stressed" differ
+    terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    for term in terms:
+        bucket = zlib.crc32(term.encode()) % DIMENSIONS
+        counts[bucket] = counts.get(bucket, 0) + 1
+    return counts
+
+def request_text(mood: str, answers: Dict[str, Any]) -> str:
+    return " ".join([mood] + [str(v) for v in answers.values()])
+
+def _shingles(text: str) -> set:
+    words = _TOKEN.findall(text.lower())
+    return {tuple(words[i:i + SHINGLE_WORDS]) for i in range(len(words) - SHINGLE_WORDS + 1)}
+
+def _map_sentences(text: str, func) -> str:
+    """Apply func to every sentence; a sentence it maps to None is dropped with its trailing break"""
+    parts = _BOUNDARY.split(text)
+    kept = []
+    for i in range(0, len(parts), 2):
+        sentence = func(parts[i])
+        if sentence is not None:
+            kept.append(sentence + (parts[i + 1] if i + 1 < len(parts) else ""))
+    return "".join(kept)
+
+def redact(script: str, answers: Dict[str, Any]) -> str:
+    """The script with this user's words taken out, safe to serve to someone else.
+
+    Answers quoted verbatim become markers that personalize() fills with the
+    next user's answers; sentences that still paraphrase an answer closely
+    (sharing a run of SHINGLE_WORDS words with it) are dropped.
+    """
+    template = script
+    shingles = set()
+    for question_id, value in answers.items():
+        value = str(value).strip()
+        if len(value) < 3:
+            continue
+        marker = "{{answer:%s}}" % question_id
+        template = re.sub(rf"(?<!\w){re.escape(value)}(?!\w)", lambda m: marker, template, flags=re.IGNORECASE)
+        shingles |= _shingles(value)
+    if not shingles:
+        return template
+    return _map_sentences(template, lambda sentence: None if _shingles(sentence) & shingles else sentence)
+
+class ScriptIndex:
+    """Nearest-neighbour lookup over previously generated (mood, answers) -> (script, audio) pairs.
+
+    Requests are compared as hashed TF-IDF vectors by cosine distance, only
+    against entries in the same partition (same mood, voice and duration), so
+    a match can reuse the stored audio as-is. Only redacted scripts are
+    stored (see redact()), never the answers themselves. Entries are appended
+    to a JSONL file that every worker on the same host reads from its last
+    offset when it grows, including the lines it wrote itself.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.entries: Dict[str, List[dict]] = {}
+        self.document_frequency: Dict[int, int] = {}
+        self.total = 0
+        self._loaded_size = 0
+        self._vectors_total = 0
+        self._lock = threading.Lock()
+
+    def _add_entry(self, entry: dict) -> None:
+        entry["counts"] = {int(k): v for k, v in entry["counts"].items()}
+        if "template" not in entry:
+            # Written before scripts were redacted
+            script = entry.pop("script")
+            entry["template"] = redact(script, entry.pop("answers", {}))
+            entry["verbatim"] = entry["template"] == script
+        self.entries.setdefault(entry["partition"], []).append(entry)
+        for bucket in entry["counts"]:
+            self.document_frequency[bucket] = self.document_frequency.get(bucket, 0) + 1
+        self.total += 1
+
+    def _refresh(self) -> None:
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size <= self._loaded_size:
+            return
+        with open(self.path) as f:
+            f.seek(self._loaded_size)
+            for line in f:
+                if line.endswith("\n"):
+                    self._add_entry(json.loads(line))
+                    self._loaded_size += len(line.encode())
+
+    def _vector(self, counts: Dict[int, int]) -> Dict[int, float]:
+        vector = {
+            bucket: (1 + math.log(tf)) * math.log((1 + self.total) / (1 + self.document_frequency.get(bucket, 0)) + 1)
+            for bucket, tf in counts.items()
+        }
+        norm = math.sqrt(sum(w * w for w in vector.values())) or 1.0
+        return {bucket: w / norm for bucket, w in vector.items()}
+
+    def _entry_vector(self, entry: dict) -> Dict[int, float]:
+        """Cached TF-IDF vector; all are rebuilt once the index has grown ~10% and the IDF weights have drifted"""
+        if self.total - self._vectors_total > max(10, self._vectors_total // 10):
+            for entries in self.entries.values():
+                for stale in entries:
+                    stale.pop("vector", None)
+            self._vectors_total = self.total
+        if "vector" not in entry:
+            entry["vector"] = self._vector(entry["counts"])
+        return entry["vector"]
+
+    @tracing.traced("reuse.lookup")
+    def find(self, partition: str, text: str, max_distance: float) -> Optional[dict]:
+        """Closest stored entry within max_distance (1 - cosine similarity), or None"""
+        with self._lock:
+            self._refresh()
+            candidates = self.entries.get(partition, [])
+            if not candidates:
+                return None
+            query = self._vector(_term_counts(text))
+            best, best_distance = None, max_distance
+            for entry in candidates:
+                vector = self._entry_vector(entry)
+                similarity = sum(w * vector.get(bucket, 0.0) for bucket, w in query.items())
+                distance = 1 - similarity
+                if distance <= best_distance:
+                    best, best_distance = entry, distance
+        if best is None:
+            return None
+        match = {k: v for k, v in best.items() if k not in ("counts", "vector")}
+        match["distance"] = round(max(best_distance, 0.0), 4)
+        return match
+
+    def add(self, partition: str, text: str, script: str, audio_url: str, answers: Dict[str, Any]) -> None:
+        template = redact(script, answers)
+        entry = {
+            "partition": partition,
+            "counts": _term_counts(text),
+            "template": template,
+            # The stored audio says only what the template says, so it can be served as-is
+            "verbatim": template == script,
+            "audioUrl": audio_url,
+        }
+        line = (json.dumps(entry) + "\n").encode()
+        with self._lock:
+            # One O_APPEND write, so lines from concurrent workers never interleave
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                os.write(fd, line)
+            finally:
+                os.close(fd)
+            # Read back from our offset: picks up this entry and any other worker appended meanwhile
+            self._refresh()
+
+def personalize(template: str, answers: Dict[str, Any]) -> str:
+    """Fill a redacted script's answer markers with this user's answers; sentences left without one are dropped"""
+    def fill(sentence: str) -> Optional[str]:
+        values = [str(answers.get(question_id, "")).strip() for question_id in _MARKER.findall(sentence)]
+        if not all(values):
+            return None
+        # A callable replacement, so backslashes in answers are taken literally
+        return _MARKER.sub(lambda m: str(answers[m.group(1)]).strip(), sentence)
+    return _map_sentences(template, fill) if _MARKER.search(template) else template
+
+_index: Optional[ScriptIndex] = None
+
+def get_index() -> ScriptIndex:
+    global _index
+    if _index is None:
+        _index = ScriptIndex(os.path.join(getattr(settings, "upload_dir", "uploads"), "script_index.jsonl"))
+    return _index
@@ -0,0 +1,303 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+from fastapi import HTTPException, Request
+from app.config import settings
+from app import tracing
+import json
+import threading
+import time
+import uuid
+
+class SharedState(ABC):
+    """Key/value state shared by every worker: cache indexes, locks, rate limits and job status.
+
+    Subclasses implement the primitive operations; the helpers on this class
+    are written in terms of them so routers never depend on the backend.
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[bytes]:
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value, ttl: Optional[float] = None) -> None:
+        ...
+
+    @abstractmethod
+    def delete(self, *keys: str) -> None:
+        ...
+
+    @abstractmethod
+    def incr(self, key: str, amount: int = 1) -> int:
+        ...
+
+    @abstractmethod
+    def scan(self, prefix: str) -> Iterator[str]:
+        ...
+
+    @abstractmethod
+    def acquire(self, name: str, token: str, ttl: float) -> bool:
+        ...
+
+    @abstractmethod
+    def release(self, name: str, token: str) -> None:
+        ...
+
+    @abstractmethod
+    def allow(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> bool:
+        """Token bucket: refill `rate` tokens per second up to `capacity`; take `cost` if available"""
+
+    def get_json(self, key: str) -> Any:
+        raw = self.get(key)
+        return json.loads(raw) if raw is not None else None
+
+    def set_json(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        self.set(key, json.dumps(value), ttl)
+
+    @contextmanager
+    def lock(self, name: str, ttl: float = 120, timeout: float = 180):
+        """Single-flight lock across workers.
+
+        Callers should re-check their cache inside the block: a worker that
+        waited here usually finds the result the holder just produced.
+        """
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout
+        delay = 0.05
+        with tracing.span("lock.wait", lock=name):
+            while not self.acquire(name, token, ttl):
+                if time.monotonic() >= deadline:
+                    raise TimeoutError(f"Timed out waiting for lock {name}")
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+        try:
+            yield
+        finally:
+            self.release(name, token)
+
+    def set_job(self, job_id: str, ttl: Optional[float] = 86400, **fields) -> Dict[str, Any]:
+        job = self.get_json(f"job:{job_id}") or {}
+        job.update(fields)
+        job["updatedAt"] = time.time()
+        self.set_json(f"job:{job_id}", job, ttl)
+        return job
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return self.get_json(f"job:{job_id}")
+
+class MemoryState(SharedState):
+    """In-process backend, for tests and single-worker deployments"""
+
+    def __init__(self):
+        self._data: Dict[str, Tuple[bytes, Optional[float]]] = {}
+        self._buckets: Dict[str, Tuple[float, float]] = {}
+        self._mutex = threading.Lock()
+
+    def _live(self, key: str) -> Optional[bytes]:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires = item
+        if expires is not None and expires <= time.monotonic():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._mutex:
+            return self._live(key)
+
+    def set(self, key: str, value, ttl: Optional[float] = None) -> None:
+        if isinstance(value, str):
+            value = value.encode()
+        expires = time.monotonic() + ttl if ttl else None
+        with self._mutex:
+            self._data[key] = (value, expires)
+
+    def delete(self, *keys: str) -> None:
+        with self._mutex:
+            for key in keys:
+                self._data.pop(key, None)
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._mutex:
+            current = int(self._live(key) or 0) + amount
+            expires = self._data.get(key, (None, None))[1]
+            self._data[key] = (str(current).encode(), expires)
+            return current
+
+    def scan(self, prefix: str) -> Iterator[str]:
+        now = time.monotonic()
+        with self._mutex:
+            # Iterate a snapshot: expired keys are dropped afterwards, not while walking the dict
+            items = list(self._data.items())
+            keys, expired = [], []
+            for key, (_, expires) in items:
+                if expires is not None and expires <= now:
+                    expired.append(key)
+                elif key.startswith(prefix):
+                    keys.append(key)
+            for key in expired:
+                self._data.pop(key, None)
+        return iter(keys)
+
+    def acquire(self, name: str, token: str, ttl: float) -> bool:
+        key = f"lock:{name}"
+        with self._mutex:
+            if self._live(key) is not None:
+                return False
+            self._data[key] = (token.encode(), time.monotonic() + ttl)
+            return True
+
+    def release(self, name: str, token: str) -> None:
+        key = f"lock:{name}"
+        with self._mutex:
+            if self._live(key) == token.encode():
+                del self._data[key]
+
+    def allow(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> bool:
+        now = time.monotonic()
+        with self._mutex:
+            tokens, updated = self._buckets.get(key, (capacity, now))
+            tokens = min(capacity, tokens + (now - updated) * rate)
+            allowed = tokens >= cost
+            if allowed:
+                tokens -= cost
+            self._buckets[key] = (tokens, now)
+            return allowed
+
+# Release only if the lock still holds our token, so an expired holder can't free a successor's lock
+_RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+_TOKEN_BUCKET_SCRIPT = """
+local bucket = redis.call('hmget', KEYS[1], 'tokens', 'updated')
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local now = tonumber(ARGV[4])
+local tokens = tonumber(bucket[1]) or capacity
+local updated = tonumber(bucket[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+end
+redis.call('hset', KEYS[1], 'tokens', tokens, 'updated', now)
+redis.call('expire', KEYS[1], math.ceil(capacity / math.max(rate, 0.001)) + 1)
+return allowed
+"""
+
+class RedisState(SharedState):
+    """Redis backend, so every uvicorn worker and node shares caches, locks and limits"""
+
+    def __init__(self, url: str, prefix: str = ""):
+        import redis
+
+        self.client = redis.Redis.from_url(url, socket_connect_timeout=2)
+        self.prefix = prefix
+        self._release = self.client.register_script(_RELEASE_SCRIPT)
+        self._token_bucket = self.client.register_script(_TOKEN_BUCKET_SCRIPT)
+
+    def _key(self, key: str) -> str:
+        return self.prefix + key
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(self._key(key))
+
+    def set(self, key: str, value, ttl: Optional[float] = None) -> None:
+        self.client.set(self._key(key), value, px=int(ttl * 1000) if ttl else None)
+
+    def delete(self, *keys: str) -> None:
+        if keys:
+            self.client.delete(*(self._key(k) for k in keys))
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        return self.client.incrby(self._key(key), amount)
+
+    def scan(self, prefix: str) -> Iterator[str]:
+        for key in self.client.scan_iter(match=self._key(prefix) + "*", count=500):
+            yield key.decode()[len(self.prefix):]
+
+    def acquire(self, name: str, token: str, ttl: float) -> bool:
+        return bool(self.client.set(self._key(f"lock:{name}"), token, nx=True, px=int(ttl * 1000)))
+
+    def release(self, name: str, token: str) -> None:
+        self._release(keys=[self._key(f"lock:{name}")], args=[token])
+
+    def allow(self, key: str, rate: float, capacity: float, cost: float = 1.0) -> bool:
+        return bool(self._token_bucket(keys=[self._key(f"bucket:{key}")], args=[rate, capacity, cost, time.time()]))
+
+_state: Optional[SharedState] = None
+_state_lock = threading.Lock()
+
+def get_state() -> SharedState:
+    """Return the process-wide state backend, connecting on first use.
+
+    STATE_BACKEND=redis requires Redis, memory never uses it, and auto (the
+    default) uses Redis when it answers a ping and falls back to memory.
+    """
+    global _state
+    if _state is not None:
+        return _state
+    with _state_lock:
+        if _state is None:
+            _state = _create_state()
+        return _state
+
+def _create_state() -> SharedState:
+    backend = getattr(settings, "state_backend", "auto")
+    prefix = getattr(settings, "state_key_prefix", "mindful:")
+    if backend == "memory":
+        return MemoryState()
+    try:
+        state = RedisState(settings.redis_url, prefix)
+        state.client.ping()
+        print(f"Using Redis shared state at {settings.redis_url}")
+        return state
+    except Exception as e:
+        if backend == "redis":
+            raise
+        print(f"Redis unavailable ({e}), using in-process state")
+        return MemoryState()
+
+def set_state(state: Optional[SharedState]) -> None:
+    """Swap the backend, e.g. to a fresh MemoryState in tests"""
+    global _state
+    _state = state
+
+def allow_call(name: str, per_minute: Optional[int] = None) -> bool:
+    """Take one call from the current user's `name` bucket (SYNTHESIS_RATE_PER_MINUTE by default).
+
+    Signed-in users are limited per account and anonymous ones per client.
+    The client id is the caller's own choice, so an anonymous address as a
+    whole is also capped at ANON_CLIENTS_PER_ADDRESS clients' worth, like
+    the quota.
+    """
+    from app.auth import current_address, current_identity
+
+    limit = per_minute or settings.synthesis_rate_per_minute
+    identity, address = current_identity(), current_address()
+    state = get_state()
+    if not state.allow(f"{name}:{identity}", limit / 60.0, limit):
+        return False
+    if identity.startswith("anon:") and identity != address:
+        shared = limit * getattr(settings, "anon_clients_per_address", 10)
+        return state.allow(f"{name}:{address}:all", shared / 60.0, shared)
+    return True
+
+def rate_limited(name: str, per_minute: Optional[int] = None):
+    """FastAPI dependency limiting each user or client to `per_minute` calls, shared across workers (see allow_call).
+
+    Defaults to SYNTHESIS_RATE_PER_MINUTE, read per request so settings stay lazy.
+    """
+    def dependency(request: Request):
+        if not allow_call(name, per_minute):
+            raise HTTPException(status_code=429, detail="Too many requests, please slow down")
+    return dependency
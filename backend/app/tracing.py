@@ -0,0 +1,149 @@
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Any, Dict, List, Optional
+from app.config import settings
+import re
+import threading
+import time
+import uuid
+
+class Span:
+    __slots__ = ("name", "attrs", "start", "end", "error", "children")
+
+    def __init__(self, name: str, attrs: Dict[str, Any]):
+        self.name = name
+        self.attrs = attrs
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.error: Optional[str] = None
+        self.children: List["Span"] = []
+
+    def to_dict(self, origin: float) -> dict:
+        end = self.end if self.end is not None else time.perf_counter()
+        return {
+            "name": self.name,
+            "startMs": round((self.start - origin) * 1000, 2),
+            "durationMs": round((end - self.start) * 1000, 2),
+            "attrs": self.attrs,
+            "error": self.error,
+            "children": [child.to_dict(origin) for child in self.children],
+        }
+
+class Trace:
+    """Span tree for one request; spans from threadpool workers attach to it through the context"""
+
+    def __init__(self, trace_id: str, name: str):
+        self.trace_id = trace_id
+        self.started_at = time.time()
+        self.root = Span(name, {})
+
+    @property
+    def duration_ms(self) -> float:
+        end = self.root.end if self.root.end is not None else time.perf_counter()
+        return (end - self.root.start) * 1000
+
+    def to_dict(self) -> dict:
+        return {
+            "traceId": self.trace_id,
+            "startedAt": self.started_at,
+            "durationMs": round(self.duration_ms, 2),
+            "root": self.root.to_dict(self.root.start),
+        }
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("trace", default=None)
+_span: ContextVar[Optional[Span]] = ContextVar("span", default=None)
+
+# Full span trees of the most recent requests over TRACE_SLOW_MS, newest last
+_slow_traces: Optional[deque] = None
+_slow_lock = threading.Lock()
+
+def current_trace_id() -> Optional[str]:
+    trace = _trace.get()
+    return trace.trace_id if trace else None
+
+@contextmanager
+def span(name: str, **attrs):
+    """Time a block as a child of the current span; does nothing outside a traced request"""
+    parent = _span.get()
+    if parent is None:
+        yield None
+        return
+    current = Span(name, attrs)
+    parent.children.append(current)
+    token = _span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _span.reset(token)
+
+def traced(name: Optional[str] = None):
+    """Decorator recording every call of a helper as a span"""
+    def decorator(func):
+        label = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def _keep(trace: Trace) -> None:
+    global _slow_traces
+    with _slow_lock:
+        if _slow_traces is None:
+            _slow_traces = deque(maxlen=getattr(settings, "trace_buffer_size", 100))
+        _slow_traces.append(trace.to_dict())
+
+def slow_traces(limit: int = 20, min_ms: float = 0, path: Optional[str] = None) -> List[dict]:
+    with _slow_lock:
+        traces = list(_slow_traces or [])
+    traces = [t for t in reversed(traces)
+              if t["durationMs"] >= min_ms and (not path or path in t["root"]["name"])]
+    return traces[:limit]
+
+def get_slow_trace(trace_id: str) -> Optional[dict]:
+    with _slow_lock:
+        return next((t for t in _slow_traces or [] if t["traceId"] == trace_id), None)
+
+class TracingMiddleware:
+    """Start a trace per HTTP request, return its id in X-Trace-Id and keep it if the request was slow"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        # Callers may pass their own id to correlate with client logs; only safe header characters are kept
+        trace_id = re.sub(r"[^A-Za-z0-9_.-]", "", headers.get(b"x-trace-id", b"").decode("latin-1"))[:64] or uuid.uuid4().hex
+        trace = Trace(trace_id, f"{scope['method']} {scope['path']}")
+        trace_token = _trace.set(trace)
+        span_token = _span.set(trace.root)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                trace.root.attrs["status"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-trace-id", trace_id.encode())]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_id)
+        except BaseException as e:
+            trace.root.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            trace.root.end = time.perf_counter()
+            _span.reset(span_token)
+            _trace.reset(trace_token)
+            if trace.duration_ms >= getattr(settings, "trace_slow_ms", 2000):
+                _keep(trace)
@@ -0,0 +1,321 @@
+from abc import ABC, abstractmethod
+from collections import deque
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional
+from app.config import settings
+from app.clients import get_openai_speech_client, get_tts_client
+from app import admission, calibration, capture, hedging, metering, mp3, tracing
+import math
+import shlex
+import shutil
+import subprocess
+import threading
+import time
+
+# Voice used by a provider when the requested voice has no entry in TTS_VOICE_MAP
+DEFAULT_VOICES = {"openai": "alloy", "local": "en-us"}
+# A provider that hasn't been called for this long gets one request again, so a recovered one is noticed
+PROBE_AFTER_SECONDS = 30.0
+# How quickly past errors stop counting against a provider
+ERROR_DECAY_SECONDS = 60.0
+# A healthy provider this much slower than the fastest one drops behind it in the ranking
+LATENCY_TOLERANCE = 1.5
+
+# Provider and model of the last successful synthesis in this context, recorded with the asset it produced
+_last_synthesis: ContextVar[Optional[dict]] = ContextVar("last_synthesis", default=None)
+
+class TTSProvider(ABC):
+    """Common interface of the speech engines: synthesize text with a provider-native voice into mp3 bytes"""
+
+    name = ""
+    model = ""
+    remote = True
+
+    def available(self) -> bool:
+        return True
+
+    @abstractmethod
+    def synthesize(self, text: str, voice: str, similarity_boost: float = 0.75) -> Optional[bytes]:
+        ...
+
+class ElevenLabsClient(TTSProvider):
+    """ElevenLabs API client holding one pooled HTTP session per process"""
+
+    name = "elevenlabs"
+
+    def __init__(self, api_key: str, base_url: str, model: str):
+        import requests
+
+        self.api_key = api_key
+        self.base_url = base_url
+        self.model = model
+        self.session = requests.Session()
+
+    def available(self) -> bool:
+        return bool(self.api_key)
+
+    def get(self, path: str):
+        headers = {
+            "Accept": "application/json",
+            "xi-api-key": self.api_key
+        }
+        with tracing.span("elevenlabs.get", path=path):
+            return self.session.get(f"{self.base_url}{path}", headers=headers)
+
+    def synthesize(self, text: str, voice_id: str, similarity_boost: float = 0.75) -> Optional[bytes]:
+        """Synthesize text and return the mp3 bytes, or None on failure"""
+        url = f"{self.base_url}/text-to-speech/{voice_id}"
+        headers = {
+            "Accept": "audio/mpeg",
+            "Content-Type": "application/json",
+            "xi-api-key": self.api_key
+        }
+        data = {
+            "text": text,
+            "model_id": self.model,
+            "voice_settings": {
+                "stability": 0.5,
+                "similarity_boost": similarity_boost
+            }
+        }
+        try:
+            with tracing.span("elevenlabs.synthesize", chars=len(text), voiceId=voice_id):
+                response = self.session.post(url, json=data, headers=headers, stream=True)
+                if response.status_code != 200:
+                    print(f"ElevenLabs API error: {response.status_code} - {response.text[:500]}")
+                    return None
+                # Audio streams as it is generated; a hedged attempt that lost stops reading and hangs up
+                chunks = []
+                for chunk in response.iter_content(chunk_size=16384):
+                    if hedging.cancelled():
+                        response.close()
+                        return None
+                    chunks.append(chunk)
+                return b"".join(chunks)
+        except Exception as e:
+            print(f"Error calling ElevenLabs: {e}")
+            return None
+
+class OpenAITTS(TTSProvider):
+    """OpenAI speech endpoint through the shared openai client"""
+
+    name = "openai"
+
+    def __init__(self, model: str):
+        self.model = model
+
+    def available(self) -> bool:
+        return bool(settings.openai_api_key)
+
+    def synthesize(self, text: str, voice: str, similarity_boost: float = 0.75) -> Optional[bytes]:
+        try:
+            with tracing.span("openai.speech", chars=len(text), voice=voice):
+                response = get_openai_speech_client().audio.speech.create(
+                    model=self.model, voice=voice, input=text, response_format="mp3"
+                )
+            return response.content
+        except Exception as e:
+            print(f"Error calling OpenAI TTS: {e}")
+            return None
+
+class LocalTTS(TTSProvider):
+    """Offline engine: a command that reads text on stdin and writes WAV to stdout, encoded to mp3 by ffmpeg.
+
+    The default command is espeak-ng; anything with the same contract (e.g.
+    piper) can be configured with LOCAL_TTS_COMMAND.
+    """
+
+    name = "local"
+    remote = False
+
+    def __init__(self, command: str):
+        self.command = command
+        self.model = (shlex.split(command) or ["local"])[0]
+
+    def available(self) -> bool:
+        args = shlex.split(self.command)
+        return bool(args) and shutil.which(args[0]) is not None and shutil.which("ffmpeg") is not None
+
+    def synthesize(self, text: str, voice: str, similarity_boost: float = 0.75) -> Optional[bytes]:
+        try:
+            with tracing.span("local_tts.synthesize", chars=len(text), voice=voice):
+                wav = subprocess.run(
+                    [arg.replace("{voice}", voice) for arg in shlex.split(self.command)],
+                    input=text.encode(), capture_output=True, timeout=120, check=True
+                ).stdout
+                # Same rate and layout as the remote providers' mp3 so clips can be concatenated
+                return subprocess.run(
+                    ["ffmpeg", "-loglevel", "error", "-i", "pipe:0", "-ar", "44100", "-ac", "1",
+                     "-codec:a", "libmp3lame", "-b:a", "128k", "-f", "mp3", "pipe:1"],
+                    input=wav, capture_output=True, timeout=120, check=True
+                ).stdout or None
+        except Exception as e:
+            print(f"Error running local TTS: {e}")
+            return None
+
+class ProviderStats:
+    """Rolling latency (ms per character over the last calls) and a time-decayed error rate"""
+
+    def __init__(self, window: int = 20):
+        self.latency = deque(maxlen=window)
+        self.error_rate = 0.0
+        self.updated = 0.0
+        self.calls = 0
+        self.errors = 0
+
+    def _decayed_errors(self) -> float:
+        age = time.monotonic() - self.updated
+        return self.error_rate * math.exp(-age / ERROR_DECAY_SECONDS)
+
+    def record(self, ok: bool, seconds: float, chars: int) -> None:
+        self.error_rate = 0.8 * self._decayed_errors() + 0.2 * (0.0 if ok else 1.0)
+        self.updated = time.monotonic()
+        self.calls += 1
+        if ok:
+            self.latency.append(seconds * 1000 / max(chars, 1))
+        else:
+            self.errors += 1
+
+    def ms_per_char(self) -> Optional[float]:
+        return sum(self.latency) / len(self.latency) if self.latency else None
+
+    def healthy(self) -> bool:
+        if time.monotonic() - self.updated >= PROBE_AFTER_SECONDS:
+            return True
+        latency = self.ms_per_char()
+        slow = latency is not None and latency > getattr(settings, "tts_slow_ms_per_char", 20)
+        return not slow and self._decayed_errors() <= getattr(settings, "tts_max_error_rate", 0.5)
+
+    def snapshot(self) -> dict:
+        latency = self.ms_per_char()
+        return {
+            "msPerChar": round(latency, 2) if latency is not None else None,
+            "errorRate": round(self._decayed_errors(), 3),
+            "calls": self.calls,
+            "errors": self.errors,
+            "healthy": self.healthy(),
+        }
+
+class TTSRouter:
+    """Picks a provider per request from rolling latency and error measurements.
+
+    Healthy remote providers are tried in TTS_PROVIDERS order, except that
+    one much slower than the fastest healthy provider drops behind it. When
+    every remote provider is slow or failing, or synthesis is being skipped
+    for load or budget, the local engine speaks instead, so users still get
+    their own script rather than an unrelated stored file. Voice ids are the
+    ElevenLabs ids the app uses everywhere; TTS_VOICE_MAP gives each one's
+    equivalent on the other providers.
+    """
+
+    def __init__(self, providers: List[TTSProvider]):
+        self.providers = providers
+        self.stats: Dict[str, ProviderStats] = {p.name: ProviderStats() for p in providers}
+        self.lock = threading.Lock()
+
+    def voice_for(self, provider: TTSProvider, voice_id: str) -> str:
+        if provider.name == "elevenlabs":
+            return voice_id
+        mapped = getattr(settings, "tts_voice_map", {}).get(voice_id, {})
+        return mapped.get(provider.name) or DEFAULT_VOICES.get(provider.name, voice_id)
+
+    def ranked(self, allow_remote: bool = True, prefer: Optional[str] = None) -> List[TTSProvider]:
+        available = [p for p in self.providers if p.available()]
+        with self.lock:
+            remote = [p for p in available if p.remote and allow_remote]
+            healthy = [p for p in remote if self.stats[p.name].healthy()]
+            latencies = [self.stats[p.name].ms_per_char() for p in healthy]
+            fastest = min((l for l in latencies if l is not None), default=None)
+
+            def lagging(provider: TTSProvider) -> bool:
+                latency = self.stats[provider.name].ms_per_char()
+                return fastest is not None and latency is not None and latency > fastest * LATENCY_TOLERANCE
+
+            order = sorted(healthy, key=lambda p: (p.name != prefer, lagging(p)))
+        local = [p for p in available if not p.remote]
+        return order + local + [p for p in remote if p not in healthy]
+
+    def synthesize(self, text: str, voice_id: str, similarity_boost: float = 0.75,
+                   prefer: Optional[str] = None, hedge: bool = False) -> tuple:
+        """Returns (mp3 bytes, provider name), or (None, None) when every provider failed.
+
+        hedge=True backs up a slow remote call to the same provider (so the
+        voice stays the same) when the text is short enough to be worth it.
+        """
+        for provider in self.ranked(admission.allow_synthesis(), prefer):
+            started = time.monotonic()
+            attempt = self._metered(provider, text, self.voice_for(provider, voice_id), similarity_boost)
+            if hedge and provider.remote and len(text) <= getattr(settings, "hedge_max_chars", 600):
+                audio = hedging.hedged(f"tts.{provider.name}", attempt)
+            else:
+                audio = attempt()
+            elapsed = time.monotonic() - started
+            with self.lock:
+                self.stats[provider.name].record(bool(audio), elapsed, len(text))
+            capture.record_upstream(
+                "tts", provider=provider.name, ms=round(elapsed * 1000, 1), chars=len(text),
+                seconds=round(mp3.duration(audio), 3) if audio else None,
+            )
+            if audio:
+                calibration.observe(voice_id, text, audio, provider.name)
+                _last_synthesis.set({"provider": provider.name, "model": provider.model})
+                return audio, provider.name
+            print(f"TTS provider {provider.name} failed, trying the next one")
+        return None, None
+
+    @staticmethod
+    def _metered(provider: TTSProvider, text: str, voice: str, similarity_boost: float) -> Callable[[], Optional[bytes]]:
+        def attempt() -> Optional[bytes]:
+            audio = provider.synthesize(text, voice, similarity_boost)
+            if audio and provider.remote:
+                metering.record_synthesis(text)
+            return audio
+        return attempt
+
+    def snapshot(self) -> Dict[str, dict]:
+        with self.lock:
+            return {
+                p.name: dict(self.stats[p.name].snapshot(), available=p.available())
+                for p in self.providers
+            }
+
+@lru_cache(maxsize=None)
+def get_tts_router() -> TTSRouter:
+    providers = {
+        "elevenlabs": get_tts_client,
+        "openai": lambda: OpenAITTS(getattr(settings, "openai_tts_model", "tts-1")),
+        "local": lambda: LocalTTS(getattr(settings, "local_tts_command", "espeak-ng -s 140 -v {voice} --stdout")),
+    }
+    names = getattr(settings, "tts_providers", ["elevenlabs", "openai", "local"])
+    return TTSRouter([providers[name]() for name in names if name in providers])
+
+def synthesize_speech(text: str, voice_id: str, similarity_boost: float = 0.75, hedge: bool = False) -> Optional[bytes]:
+    """Synthesize text with the best provider right now and return the mp3 bytes, or None if all failed"""
+    if not admission.allow_synthesis():
+        print("Remote synthesis skipped under load or over budget, using the local engine")
+    return get_tts_router().synthesize(text, voice_id, similarity_boost, hedge=hedge)[0]
+
+def last_synthesis() -> Optional[dict]:
+    return _last_synthesis.get()
+
+def primary_provider() -> str:
+    """The first configured provider, whose clips are cached under the plain filenames"""
+    router = get_tts_router()
+    return router.providers[0].name if router.providers else "elevenlabs"
+
+def preferred_provider() -> Optional[str]:
+    """The provider the next synthesis would try first"""
+    ranked = get_tts_router().ranked(admission.allow_synthesis())
+    return ranked[0].name if ranked else None
+
+def sticky_synthesizer(voice_id: str, similarity_boost: float = 0.75) -> Callable[[str], Optional[bytes]]:
+    """synthesize_speech for the chunks of one track: keeps the provider the first chunk used,
+    so the voice doesn't change mid-session unless that provider fails"""
+    used = {"provider": None}
+
+    def synthesize(text: str) -> Optional[bytes]:
+        audio, provider = get_tts_router().synthesize(text, voice_id, similarity_boost, prefer=used["provider"])
+        used["provider"] = used["provider"] or provider
+        return audio
+    return synthesize
@@ -0,0 +1,152 @@
+"""Pre-generate meditation and visualization sessions from a JSONL file of specs.
+
+Run from anywhere:
+
+    python scripts/batch_generate.py specs.jsonl results.jsonl [--concurrency 4]
+
+Each spec line looks like:
+
+    {"id": "camp-1", "kind": "meditation", "mood": "stressed", "voiceId": "...", "duration": 600,
+     "answers": {"q1": "..."}}
+    {"id": "camp-2", "kind": "visualization", "goal": "Run a marathon", "goalCategory": "health",
+     "voiceId": "...", "answers": {}, "challenges": ["time management"]}
+
+Sessions are generated with the same router code the API uses and land in
+the same uploads directory it serves. They run exempt from the per-user
+quota and fair-share slots, which only apply to API callers. Every finished session is appended to
+the results file, so re-running with the same files resumes where it left
+off; sessions whose audio failed are retried.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAUNCH_DIR = os.getcwd()
+sys.path.insert(0, BACKEND_DIR)
+# The routers write to ./uploads, so run from the directory the API serves
+os.chdir(BACKEND_DIR)
+
+from app import fairness  # noqa: E402
+from app.routers import meditate, visualize  # noqa: E402
+
+def spec_id(spec: dict) -> str:
+    if spec.get("id"):
+        return str(spec["id"])
+    return hashlib.sha1(json.dumps(spec, sort_keys=True).encode()).hexdigest()[:16]
+
+def load_specs(path: str) -> list:
+    specs = []
+    with open(path) as f:
+        for line_number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                specs.append(json.loads(line))
+            except json.JSONDecodeError as e:
+                print(f"Skipping line {line_number}: {e}")
+    return specs
+
+def load_checkpoint(path: str) -> set:
+    """Ids of specs already generated successfully"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path) as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if result.get("status") == "ok":
+                done.add(result["id"])
+    return done
+
+async def generate(spec: dict) -> dict:
+    """Run one spec through the router's generation code"""
+    kind = spec.get("kind", "meditation")
+    if kind == "meditation":
+        response = await meditate.start_meditation(meditate.MeditationStartRequest(
+            mood=spec["mood"],
+            voiceId=spec["voiceId"],
+            duration=spec.get("duration", 600),
+            allAnswers=spec.get("answers", {}),
+            backgroundMusic=spec.get("backgroundMusic", meditate.music.DEFAULT_STYLE),
+        ))
+    elif kind == "visualization":
+        response = await visualize.start_visualization(visualize.VisualizationStartRequest(
+            goal=spec["goal"],
+            goalCategory=spec.get("goalCategory", ""),
+            goalComplexity=spec.get("goalComplexity", "Moderate"),
+            voiceId=spec["voiceId"],
+            allAnswers=spec.get("answers", {}),
+            identifiedChallenges=spec.get("challenges", []),
+            userExperienceLevel=spec.get("userExperienceLevel", "beginner"),
+            sessionType=spec.get("sessionType", "goal_achievement"),
+        ))
+    else:
+        raise ValueError(f"Unknown kind: {kind}")
+    audio_url = response.audioUrl or ""
+    audio_ok = bool(audio_url) and os.path.exists(os.path.join("uploads", audio_url.rsplit("/", 1)[-1]))
+    return {
+        "kind": kind,
+        "sessionId": response.sessionId,
+        "audioUrl": audio_url,
+        "script": response.script,
+        "status": "ok" if audio_ok else "degraded",
+    }
+
+async def run(specs: list, results_path: str, concurrency: int) -> None:
+    done = load_checkpoint(results_path)
+    pending = [s for s in specs if spec_id(s) not in done]
+    print(f"{len(specs)} specs, {len(specs) - len(pending)} already done, {len(pending)} to generate")
+
+    semaphore = asyncio.Semaphore(concurrency)
+    write_lock = asyncio.Lock()
+    counts = {"ok": 0, "degraded": 0, "error": 0}
+    started = time.perf_counter()
+
+    async def worker(spec: dict, out):
+        async with semaphore:
+            t0 = time.perf_counter()
+            try:
+                with fairness.exempt():
+                    result = await generate(spec)
+            except Exception as e:
+                result = {"status": "error", "error": str(getattr(e, "detail", "") or e) or repr(e)}
+            result["id"] = spec_id(spec)
+            result["elapsed"] = round(time.perf_counter() - t0, 2)
+        async with write_lock:
+            out.write(json.dumps(result) + "\n")
+            out.flush()
+            counts[result["status"]] += 1
+            finished = sum(counts.values())
+            if finished % 10 == 0 or finished == len(pending):
+                rate = finished / max(time.perf_counter() - started, 1e-6)
+                print(f"{finished}/{len(pending)} done ({rate:.2f} sessions/s) {counts}")
+
+    with open(results_path, "a") as out:
+        await asyncio.gather(*(worker(spec, out) for spec in pending))
+
+    elapsed = time.perf_counter() - started
+    total = sum(counts.values())
+    print(f"Generated {total} sessions in {elapsed:.1f}s "
+          f"({total / max(elapsed, 1e-6):.2f} sessions/s, {total * 60 / max(elapsed, 1e-6):.1f}/min): {counts}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("specs", help="JSONL file of session specs")
+    parser.add_argument("results", help="JSONL file results are appended to (also the resume checkpoint)")
+    parser.add_argument("--concurrency", type=int, default=4, help="sessions generated at once")
+    args = parser.parse_args()
+    specs_path = os.path.join(LAUNCH_DIR, args.specs)
+    results_path = os.path.join(LAUNCH_DIR, args.results)
+    asyncio.run(run(load_specs(specs_path), results_path, args.concurrency))
+
+if __name__ == "__main__":
+    main()
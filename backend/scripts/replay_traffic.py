@@ -0,0 +1,256 @@
+"""Replay a traffic capture against the backend with recorded upstream responses.
+
+Enable capture in production with CAPTURE_ENABLED=True, copy the files from
+CAPTURE_DIR, then run from the backend directory:
+
+    python scripts/replay_traffic.py captures/capture-*.jsonl.gz [--speed 4] [--limit 5000]
+
+Requests are sent to `app.main.app` in-process at their recorded offsets,
+divided by --speed (0 sends them as fast as --concurrency allows). OpenAI
+and TTS never get called: each request is answered with the completions and
+synthesis latencies captured with it, and speech comes back as silence of the
+recorded duration. The app runs in a fresh working directory with in-memory
+state, so two replays of the same log start from the same caches.
+Latencies are reported per route next to the recorded ones, in milliseconds.
+"""
+import argparse
+import asyncio
+import glob
+import gzip
+import json
+import os
+import random
+import re
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from contextvars import ContextVar
+from types import SimpleNamespace
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+UUID = re.compile(r"[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}")
+# Header of a 128 kbps 44.1 kHz MPEG-1 Layer III frame, the template for replayed speech
+FRAME_HEADER = bytes([0xFF, 0xFB, 0x90, 0x64])
+
+# Upstream calls recorded for the request being replayed, consumed in order
+_recorded: ContextVar[list] = ContextVar("recorded_upstream", default=[])
+_lock = threading.Lock()
+
+def read_capture(paths: list) -> list:
+    records = []
+    for pattern in paths:
+        for path in sorted(glob.glob(pattern)):
+            opener = gzip.open if path.endswith(".gz") else open
+            with opener(path, "rt") as f:
+                records.extend(json.loads(line) for line in f if line.strip())
+    return sorted(records, key=lambda r: r["t"])
+
+def next_call(kind: str):
+    calls = _recorded.get()
+    with _lock:
+        for i, call in enumerate(calls):
+            if call["k"] == kind:
+                return calls.pop(i)
+    return None
+
+def install_fakes(upstream_delay: bool) -> None:
+    """Point the OpenAI client and the TTS router at the recording"""
+    from app import clients, mp3, tts
+
+    class Completions:
+        def create(self, **kwargs):
+            call = next_call("openai")
+            if call is None:
+                # Nothing recorded (e.g. a background thread): take the app's fallback path
+                raise RuntimeError("No recorded completion")
+            if upstream_delay:
+                time.sleep(call["ms"] / 1000)
+            usage = SimpleNamespace(prompt_tokens=call["prompt"], completion_tokens=call["completion"],
+                                    total_tokens=call["prompt"] + call["completion"])
+            message = SimpleNamespace(content=call["content"])
+            return SimpleNamespace(choices=[SimpleNamespace(message=message)], usage=usage)
+
+    class ReplayTTS(tts.TTSProvider):
+        def __init__(self, name: str):
+            self.name = name
+            self.model = "replay"
+            self.remote = name != "local"
+
+        def available(self) -> bool:
+            return True
+
+        def synthesize(self, text, voice, similarity_boost=0.75):
+            call = next_call("tts")
+            if call is None:
+                # Background prefetch is not recorded; estimate from the text
+                call = {"ms": len(text) * 10, "seconds": len(text) / 15}
+            if upstream_delay:
+                time.sleep(call["ms"] / 1000)
+            if not call.get("seconds"):
+                return None
+            return mp3.silence(call["seconds"], FRAME_HEADER)
+
+    chat = SimpleNamespace(completions=Completions())
+    clients._openai_client = lambda: SimpleNamespace(chat=chat)
+    names = getattr(tts.settings, "tts_providers", ["elevenlabs", "openai", "local"])
+    router = tts.TTSRouter([ReplayTTS(name) for name in names])
+    tts.get_tts_router = lambda: router
+
+def percentile(values: list, q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))], 1)
+
+class Replayer:
+    def __init__(self, app, records: list, speed: float, concurrency: int):
+        import httpx
+
+        self.httpx = httpx
+        self.app = app
+        self.records = records
+        self.speed = speed
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.clients = {}
+        self.tokens = {}
+        # Recorded session id -> (index of the request that created it, future of the id the replay got)
+        self.sessions = {}
+        for index, record in enumerate(records):
+            if record.get("sid") and record["sid"] not in self.sessions:
+                self.sessions[record["sid"]] = (index, asyncio.get_running_loop().create_future())
+        self.results = defaultdict(list)
+        self.skipped = 0
+
+    def client_for(self, record: dict):
+        """Anonymous users replay from a stable fake address so per-address limits still apply"""
+        user = record["u"]
+        if user not in self.clients:
+            address = "10.{}.{}.{}".format(*(int(user[i:i + 2], 36) % 256 for i in (0, 2, 4)))
+            transport = self.httpx.ASGITransport(app=self.app, client=(address, 0))
+            self.clients[user] = self.httpx.AsyncClient(transport=transport, base_url="http://replay", timeout=None)
+        return self.clients[user]
+
+    def headers_for(self, record: dict) -> dict:
+        if not record.get("a"):
+            return {}
+        from app.auth import create_access_token
+
+        if record["u"] not in self.tokens:
+            self.tokens[record["u"]] = create_access_token(record["u"], expires_minutes=24 * 60)
+        return {"Authorization": f"Bearer {self.tokens[record['u']]}"}
+
+    async def substitute(self, text: str, index: int) -> str:
+        """Swap recorded session ids for replayed ones, waiting for the request that creates each"""
+        for recorded in set(UUID.findall(text)):
+            owner, future = self.sessions.get(recorded, (index, None))
+            if owner >= index:
+                continue
+            try:
+                replayed = await asyncio.wait_for(asyncio.shield(future), timeout=120)
+            except asyncio.TimeoutError:
+                continue
+            text = text.replace(recorded, replayed or recorded)
+        return text
+
+    async def send(self, index: int, record: dict) -> None:
+        if record.get("b") is None and record.get("bs"):
+            # Uploads and oversized bodies were recorded by size only
+            self.skipped += 1
+            owner, future = self.sessions.get(record.get("sid"), (None, None))
+            if owner == index:
+                future.set_result(None)
+            return
+        path = await self.substitute(record["p"] + ("?" + record["q"] if record.get("q") else ""), index)
+        body = json.loads(await self.substitute(json.dumps(record["b"]), index)) if record.get("b") is not None else None
+        token = _recorded.set(list(record.get("up") or []))
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.client_for(record).request(
+                    record["m"], path, json=body, headers=self.headers_for(record))
+                status = response.status_code
+            except Exception as e:
+                print(f"{record['m']} {record['r']} raised {e}")
+                status, response = 0, None
+            elapsed = (time.perf_counter() - started) * 1000
+        _recorded.reset(token)
+        owner, future = self.sessions.get(record.get("sid"), (None, None))
+        if owner == index:
+            try:
+                replayed = response.json().get("sessionId") if response is not None else None
+            except ValueError:
+                replayed = None
+            future.set_result(replayed)
+        self.results[(record["m"], record["r"])].append((record["s"], status, record["ms"], elapsed))
+
+    async def run(self) -> float:
+        t0 = self.records[0]["t"]
+        start = time.monotonic()
+        tasks = []
+        for index, record in enumerate(self.records):
+            if self.speed:
+                delay = (record["t"] - t0) / self.speed - (time.monotonic() - start)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            tasks.append(asyncio.create_task(self.send(index, record)))
+        await asyncio.gather(*tasks)
+        for client in self.clients.values():
+            await client.aclose()
+        return time.monotonic() - start
+
+def report(results: dict, skipped: int, wall: float) -> None:
+    print(f"{'route':<44} {'n':>5} {'status ok':>9}  {'recorded p50/p95/p99':>22}  {'replayed p50/p95/p99':>22}")
+    total = 0
+    for (method, route), rows in sorted(results.items(), key=lambda item: -len(item[1])):
+        total += len(rows)
+        same = sum(1 for recorded, replayed, _, _ in rows if recorded == replayed)
+        recorded = [r[2] for r in rows]
+        replayed = [r[3] for r in rows]
+        print(f"{method + ' ' + route:<44} {len(rows):>5} {same / len(rows):>9.0%}  "
+              f"{'/'.join(str(percentile(recorded, q)) for q in (0.5, 0.95, 0.99)):>22}  "
+              f"{'/'.join(str(percentile(replayed, q)) for q in (0.5, 0.95, 0.99)):>22}")
+    print(f"\n{total} requests in {wall:.1f}s ({total / wall if wall else 0:.1f}/s), {skipped} skipped")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="capture files or glob patterns (.jsonl or .jsonl.gz)")
+    parser.add_argument("--speed", type=float, default=1.0, help="replay N times faster than recorded; 0 for no pacing")
+    parser.add_argument("--limit", type=int, default=0, help="replay only the first N requests")
+    parser.add_argument("--concurrency", type=int, default=64, help="most requests in flight at once")
+    parser.add_argument("--no-upstream-delay", action="store_true", help="answer upstream calls immediately")
+    parser.add_argument("--workdir", help="working directory for uploads (default: a fresh temporary one)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    records = read_capture([os.path.abspath(p) for p in args.paths])
+    if args.limit:
+        records = records[:args.limit]
+    if not records:
+        sys.exit("No captured requests found")
+
+    # Placeholder keys let Settings() load without a .env; nothing calls upstream
+    for key, value in {
+        "OPENAI_API_KEY": "replay", "ELEVEN_LABS_API_KEY": "replay", "STATE_BACKEND": "memory",
+        "CAPTURE_ENABLED": "false", "PRECOMPUTE_BACKGROUND_BEDS": "false", "UPLOAD_DIR": "uploads",
+    }.items():
+        os.environ.setdefault(key, value)
+    os.chdir(args.workdir or tempfile.mkdtemp(prefix="replay-"))
+    random.seed(args.seed)
+
+    install_fakes(not args.no_upstream_delay)
+    from app.main import app
+
+    async def replay():
+        replayer = Replayer(app, records, args.speed, args.concurrency)
+        wall = await replayer.run()
+        report(replayer.results, replayer.skipped, wall)
+
+    print(f"Replaying {len(records)} requests at {'full' if not args.speed else f'{args.speed:g}x'} speed in {os.getcwd()}")
+    asyncio.run(replay())
+
+if __name__ == "__main__":
+    main()
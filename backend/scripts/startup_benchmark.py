@@ -0,0 +1,82 @@
+"""Report how long the backend takes to import and to answer its first request.
+
+Run from the backend directory:
+
+    python scripts/startup_benchmark.py [--top 25] [--module app.main]
+
+Imports happen in a fresh interpreter with `-X importtime`, so results match
+what a cold replica pays. Times are in milliseconds.
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+FIRST_REQUEST = """
+import time
+start = time.perf_counter()
+from fastapi.testclient import TestClient
+from app.main import app
+with TestClient(app) as client:
+    client.get("/api/health")
+print(round((time.perf_counter() - start) * 1000, 1))
+"""
+
+def parse_importtime(stderr: str) -> list:
+    """Turn `-X importtime` output into (module, self_ms, cumulative_ms) rows"""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|", 2)
+        rows.append((name.strip(), int(self_us) / 1000, int(cumulative_us) / 1000))
+    return rows
+
+def run(code: str, importtime: bool = False) -> subprocess.CompletedProcess:
+    env = dict(os.environ)
+    # Placeholder keys let Settings() load without a .env; nothing calls upstream
+    env.setdefault("OPENAI_API_KEY", "benchmark")
+    env.setdefault("ELEVEN_LABS_API_KEY", "benchmark")
+    env.setdefault("PRECOMPUTE_BACKGROUND_BEDS", "false")
+    args = [sys.executable] + (["-X", "importtime"] if importtime else []) + ["-c", code]
+    return subprocess.run(args, cwd=BACKEND_DIR, env=env, capture_output=True, text=True)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--module", default="app.main", help="module to import")
+    parser.add_argument("--top", type=int, default=25, help="number of slowest modules to list")
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    result = run(f"import {args.module}", importtime=True)
+    wall_ms = (time.perf_counter() - start) * 1000
+    if result.returncode != 0:
+        print(result.stderr[-2000:])
+        sys.exit(result.returncode)
+
+    rows = parse_importtime(result.stderr)
+    total = next((cumulative for name, _, cumulative in rows if name == args.module), 0.0)
+    print(f"Interpreter + import {args.module}: {wall_ms:.1f} ms wall, {total:.1f} ms in imports")
+    print()
+    print(f"{'cumulative':>12} {'self':>10}  module")
+    for name, self_ms, cumulative in sorted(rows, key=lambda r: r[2], reverse=True)[:args.top]:
+        print(f"{cumulative:>12.1f} {self_ms:>10.1f}  {name}")
+
+    print()
+    print("App modules:")
+    for name, self_ms, cumulative in rows:
+        if name == "app" or name.startswith("app."):
+            print(f"{cumulative:>12.1f} {self_ms:>10.1f}  {name}")
+
+    first = run(FIRST_REQUEST)
+    if first.returncode == 0:
+        print()
+        print(f"Import to first /api/health response: {first.stdout.strip().splitlines()[-1]} ms")
+    else:
+        print(f"\nFirst request check failed: {first.stderr[-500:]}")
+
+if __name__ == "__main__":
+    main()
@@ -7,7 +7,7 @@ import { useState, useEffect, useRef } from 'react';
 import { motion, AnimatePresence } from 'framer-motion';
 import { useSwipeable } from 'react-swipeable';
 import axios from 'axios';
-import { BACKEND_URL } from '@/lib/config';
+import { BACKEND_URL, clientHeaders } from '@/lib/config';
 const VOICE_ID = '21m00Tcm4TlvDq8ikWAM'; // Default voice
 const STEP_DURATION = 75; // 75 seconds per step (10 minutes / 8 steps)
 
@@ -32,7 +32,7 @@ export default function DailyPracticePage() {
       const response = await axios.post(`${BACKEND_URL}/one-tap/start`, {
         sessionType: 'daily-practice',
         voiceId: VOICE_ID,
-      });
+      }, { headers: clientHeaders() });
       setAudioUrl(BACKEND_URL + response.data.audioUrl);
       setScriptSteps(response.data.steps || []);
     } catch (e) {
@@ -1,4 +1,4 @@
-import { BACKEND_URL } from './config';
+import { BACKEND_URL, clientHeaders } from './config';
 
 const API_BASE_URL = `${BACKEND_URL}/api`;
 
@@ -17,6 +17,7 @@ async function apiRequest<T>(
   const config: RequestInit = {
     headers: {
       'Content-Type': 'application/json',
+      ...clientHeaders(),
       ...options.headers,
     },
     ...options,
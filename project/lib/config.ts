@@ -1,6 +1,17 @@
 // Centralized configuration for the app
 export const BACKEND_URL = process.env.NEXT_PUBLIC_API_URL || 'http://localhost:8000';
 
+// Random id of this install, sent as X-Client-Id so anonymous users sharing an address get their own quota
+export function clientHeaders(): Record<string, string> {
+  if (typeof window === 'undefined') return {};
+  let clientId = window.localStorage.getItem('clientId');
+  if (!clientId) {
+    clientId = window.crypto.randomUUID();
+    window.localStorage.setItem('clientId', clientId);
+  }
+  return { 'X-Client-Id': clientId };
+}
+
 // API endpoints
 export const API_ENDPOINTS = {
   health: `${BACKEND_URL}/api/health`,